@@ -0,0 +1,113 @@
+"""下载路径基准：对比 os.sendfile 零拷贝、池化缓冲区与 aiofiles 分片读循环的吞吐与峰值内存。
+
+用法: python bench_download.py [--size-mb 512] [--streams 4] [--range]
+每种模式向 socketpair 并发写入 --streams 份文件内容，对端线程负责排空，
+输出总吞吐 (MB/s) 与 tracemalloc 统计的 Python 堆峰值。
+
+sendfile 模式对应 __main__ 以 ZeroCopyHttpProtocol 启动时的下载路径：ZeroCopyResponseCycle 调用
+loop.sendfile，在 asyncio 事件循环的普通 TCP 连接上即内核 sendfile；pooled 对应限速开启或未安装
+httptools 时的回退生成器（iter_pooled_file）。
+"""
+import os
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+import tracemalloc
+
+import aiofiles
+
+from server import STREAM_DOWNLOAD_CHUNK_SIZE, RANGE_DOWNLOAD_CHUNK_SIZE, iter_pooled_file
+
+def drain(sock: socket.socket, expected: int):
+    remain = expected
+    buf = bytearray(1024 * 1024)
+    while remain > 0:
+        n = sock.recv_into(buf)
+        if not n:
+            break
+        remain -= n
+    sock.close()
+
+async def send_sendfile(loop, sock, path, offset, count):
+    # 与 ZeroCopyResponseCycle 相同：loop.sendfile 在 transport 的 socket 上调用 loop.sock_sendfile
+    with open(path, "rb") as f:
+        await loop.sock_sendfile(sock, f, offset, count, fallback=False)
+
+async def send_generator(loop, sock, path, offset, count, chunk_size):
+    # 与 download_file 回退生成器 iterfile/iter_all 相同的读取方式
+    async with aiofiles.open(path, "rb") as f:
+        await f.seek(offset)
+        while count > 0:
+            data = await f.read(min(chunk_size, count))
+            if not data:
+                break
+            count -= len(data)
+            await loop.sock_sendall(sock, data)
+
+async def send_pooled(loop, sock, path, offset, count, chunk_size):
+    # 与 download_file 的 iter_pooled_file 相同：池化 bytearray + readinto，自适应分片
+    async for data in iter_pooled_file(path, offset, offset + count - 1, chunk_size):
+        await loop.sock_sendall(sock, data)
+
+async def run_mode(mode: str, path: str, streams: int, offset: int, count: int, chunk_size: int):
+    loop = asyncio.get_running_loop()
+    pairs = [socket.socketpair() for _ in range(streams)]
+    drains = []
+    for a, b in pairs:
+        a.setblocking(False)
+        t = threading.Thread(target=drain, args=(b, count), daemon=True)
+        t.start()
+        drains.append(t)
+    tracemalloc.start()
+    begin = time.perf_counter()
+    if mode == "sendfile":
+        tasks = [send_sendfile(loop, a, path, offset, count) for a, _ in pairs]
+    elif mode == "pooled":
+        tasks = [send_pooled(loop, a, path, offset, count, chunk_size) for a, _ in pairs]
+    else:
+        tasks = [send_generator(loop, a, path, offset, count, chunk_size) for a, _ in pairs]
+    await asyncio.gather(*tasks)
+    for a, _ in pairs:
+        a.close()
+    for t in drains:
+        t.join()
+    elapsed = time.perf_counter() - begin
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=512)
+    parser.add_argument("--streams", type=int, default=4)
+    parser.add_argument("--range", action="store_true", help="测试 206 分支（跳过首尾各 1/4）")
+    args = parser.parse_args()
+    if not hasattr(os, "sendfile"):
+        print("当前平台不支持 os.sendfile", file=sys.stderr)
+        sys.exit(1)
+
+    size = args.size_mb * 1024 * 1024
+    with tempfile.NamedTemporaryFile(delete=False) as tmp:
+        block = os.urandom(1024 * 1024)
+        for _ in range(args.size_mb):
+            tmp.write(block)
+        path = tmp.name
+    try:
+        if args.range:
+            offset, count, chunk_size = size // 4, size // 2, RANGE_DOWNLOAD_CHUNK_SIZE
+        else:
+            offset, count, chunk_size = 0, size, STREAM_DOWNLOAD_CHUNK_SIZE
+        total_mb = count * args.streams / 1024 / 1024
+        print(f"文件 {args.size_mb}MB, 并发 {args.streams}, 每流 {count / 1024 / 1024:.0f}MB, 分片 {chunk_size // 1024 // 1024}MB")
+        for mode in ("generator", "pooled", "sendfile"):
+            elapsed, peak = asyncio.run(run_mode(mode, path, args.streams, offset, count, chunk_size))
+            print(f"{mode:>9}: {total_mb / elapsed:9.1f} MB/s  峰值内存 {peak / 1024 / 1024:8.2f} MB")
+    finally:
+        os.remove(path)
+
+if __name__ == "__main__":
+    main()
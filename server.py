@@ -3,9 +3,17 @@ import shutil
 import json
 import asyncio
 import threading
+import time
+import mmap
+import gzip
+import mimetypes
+import functools
+import multiprocessing
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from datetime import datetime
 from urllib.parse import quote, unquote
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, UploadFile, File, Request, HTTPException, Query
 from fastapi.responses import HTMLResponse, FileResponse, Response, JSONResponse, StreamingResponse
@@ -15,6 +23,27 @@ import uvicorn
 import aiofiles
 from contextlib import asynccontextmanager
 import hashlib
+import secrets
+import base64
+import bisect
+try:
+    import zstandard  # 可选依赖：安装后额外提供 zstd 编码
+except ImportError:
+    zstandard = None
+import stat
+import errno
+import struct
+import tarfile
+import zlib
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # 旧版本 python-multipart 的包名为 multipart
+    from multipart.multipart import MultipartParser, parse_options_header
+try:
+    from uvicorn.protocols.http.httptools_impl import HttpToolsProtocol, RequestResponseCycle
+except ImportError:  # httptools 为可选依赖，未安装时 uvicorn 只能使用 h11 协议，不提供零拷贝发送
+    HttpToolsProtocol = RequestResponseCycle = None
+from email.utils import formatdate, parsedate_to_datetime
 
 # 加载环境变量
 load_dotenv()
@@ -27,17 +56,187 @@ UPLOAD_DIR = os.environ.get("UPLOAD_DIR", "obs")
 
 # 全局性能参数（使用位置见行内注释）
 # MAX_UPLOAD_SIZE: 上传大小限制（None 表示无限制）
-# 使用位置：upload_file_form 写入循环累计判断；upload_file_put 流式写入累计判断
+# 使用位置：receive_form_file 边接收边累计判断；upload_file_put 按 Content-Length 预判并流式累计判断
 MAX_UPLOAD_SIZE = None
-# UPLOAD_CHUNK_SIZE: 表单上传读取分片大小（10MB）
-# 使用位置：upload_file_form 读取循环
+# UPLOAD_CHUNK_SIZE: 表单上传写盘合并大小（10MB），流式解析出的文件数据攒够后一次写入临时文件
+# 使用位置：receive_form_file 写入循环
 UPLOAD_CHUNK_SIZE = 10 * 1024 * 1024
-# RANGE_DOWNLOAD_CHUNK_SIZE: Range 分片下载时的单次读取分片大小（10MB）
+# RANGE_DOWNLOAD_CHUNK_SIZE: Range 分片下载时的单次读取分片大小上限（10MB）
 # 使用位置：download_file -> iterfile(chunk_size=...)
 RANGE_DOWNLOAD_CHUNK_SIZE = 10 * 1024 * 1024
-# STREAM_DOWNLOAD_CHUNK_SIZE: 完整流式下载分片大小（40MB）
-# 使用位置：download_file 无 Range 分支的 StreamingResponse 生成器
+# STREAM_DOWNLOAD_CHUNK_SIZE: 完整流式下载分片大小上限（40MB）
+# 使用位置：download_file 无 Range 分支 -> iter_all（自适应分片的上限）
 STREAM_DOWNLOAD_CHUNK_SIZE = 40 * 1024 * 1024
+# MERGE_READ_SIZE: 分片合并时的单次读取大小（字节），合并与整体哈希共用同一次读取
+# 使用位置：merge_parts 的 readinto 缓冲区
+MERGE_READ_SIZE = 4 * 1024 * 1024
+
+# UPLOAD_ASSEMBLY_MODE: 断点续传会话的默认组装方式
+# "inplace": upload_init 预分配目标临时文件，分片按 index*chunk_size 直接 pwrite，完成时仅校验 + os.replace
+# "parts": 每个分片一个 {index}.part 文件，完成时合并（支持时使用 copy_file_range）
+# 使用位置：upload_init 创建会话（客户端可用 assembly 字段覆盖）
+UPLOAD_ASSEMBLY_MODE = "inplace"
+# INPLACE_WRITE_COALESCE: 原位写入时合并请求体小块的阈值（字节），攒够后一次 pwrite
+# 使用位置：upload_chunk 原位组装分支
+INPLACE_WRITE_COALESCE = 1 * 1024 * 1024
+# PUT_WRITE_COALESCE: PUT 上传合并请求体小块的对齐写入粒度（字节），每次 pwrite 都是它的整数倍且偏移对齐
+# 使用位置：upload_file_put 写入循环
+PUT_WRITE_COALESCE = 4 * 1024 * 1024
+# UPLOAD_FSYNC_POLICY: 上传发布前的落盘策略
+#   "none"     —— 不主动 fsync，依赖内核回写（默认，与历史行为一致）
+#   "on-close" —— 每个上传关闭后立即 fsync 临时文件，replace 后再 fsync 目录
+#   "batched"  —— 组提交：FSYNC_BATCH_WINDOW 内到达的发布合并为一次执行器任务，同目录只 fsync 一次
+# FSYNC_BATCH_WINDOW: 组提交的收集窗口（秒）
+# 使用位置：publish_upload（表单上传与 PUT 上传）；FSYNC_BATCHER
+UPLOAD_FSYNC_POLICY = "none"
+FSYNC_BATCH_WINDOW = 0.005
+# TUS_VERSION: 支持的 tus 断点续传协议版本（单文件流式续传，PATCH 按 Upload-Offset 追加）
+# TUS_CHECKSUM_ALGORITHMS: PATCH 可选 Upload-Checksum 支持的算法
+# 使用位置：/tus 系列路由
+TUS_VERSION = "1.0.0"
+TUS_CHECKSUM_ALGORITHMS = ("sha1", "sha256", "md5")
+# ARCHIVE_MAX_ENTRIES: POST /archive 单次打包的文件数上限
+# ZIP64_LIMIT: ZIP 条目大小或偏移达到该值时改用 zip64 扩展字段
+# 使用位置：download_archive；plan_zip / zip_local_header / zip_central_header
+ARCHIVE_MAX_ENTRIES = 100000
+ZIP64_LIMIT = 0xFFFFFFFF
+# RATE_LIMIT_GLOBAL_BPS: 所有传输合计的速率上限（字节/秒），None 表示不限
+# RATE_LIMIT_CLIENT_BPS: 单个客户端 IP 的速率上限（字节/秒），None 表示不限
+# RATE_LIMIT_BURST_SECONDS: 令牌桶容量 = 速率 × 该秒数，即允许的瞬时突发
+# RATE_LIMIT_QUANTUM: 下载按该粒度申请令牌（字节），大分片拆开发送，各流交替推进
+# RATE_LIMIT_SMALL_TRANSFER / RATE_LIMIT_SMALL_WEIGHT: 不超过该大小的传输在加权公平调度中使用更高权重，
+#   大文件传输进行时小文件仍保持低延迟
+# 使用位置：BANDWIDTH（download_file、download_archive 与各上传接收循环）；运行时经 PUT /config/ratelimit 调整
+RATE_LIMIT_GLOBAL_BPS = None
+RATE_LIMIT_CLIENT_BPS = None
+RATE_LIMIT_BURST_SECONDS = 0.25
+RATE_LIMIT_QUANTUM = 256 * 1024
+RATE_LIMIT_SMALL_TRANSFER = 4 * 1024 * 1024
+RATE_LIMIT_SMALL_WEIGHT = 8
+# ADMISSION_LIMITS: 各传输类别允许同时执行的数量 —— merge: 分片合并与整文件哈希；download: 大文件下载；upload: 大文件上传
+# ADMISSION_QUEUE_SIZE: 每个类别排队等待的请求数上限，队列已满立即返回 503
+# ADMISSION_QUEUE_TIMEOUT: 排队最长等待时间（秒），超时返回 503
+# ADMISSION_RETRY_AFTER: 503 响应携带的 Retry-After（秒）
+# ADMISSION_LARGE_DOWNLOAD / ADMISSION_LARGE_UPLOAD: 计入 download / upload 类别的字节阈值（长度未知的上传按大文件计）
+# 使用位置：ADMISSION（upload_complete、finish_tus_upload、HASH_INDEXER、download_file、download_archive 与各上传入口）；
+#   运行时经 PUT /config/admission 调整
+ADMISSION_LIMITS = {"merge": 2, "download": 32, "upload": 16}
+ADMISSION_QUEUE_SIZE = 64
+ADMISSION_QUEUE_TIMEOUT = 30
+ADMISSION_RETRY_AFTER = 5
+ADMISSION_LARGE_DOWNLOAD = 64 * 1024 * 1024
+ADMISSION_LARGE_UPLOAD = 64 * 1024 * 1024
+# HASH_QUEUE_SIZE: 后台哈希队列容量，满时丢弃（下次巡检补上）
+# HASH_SWEEP_SECONDS: 后台巡检缺失哈希的间隔（秒），启动时立即执行一次
+# 使用位置：HASH_INDEXER
+HASH_QUEUE_SIZE = 1024
+HASH_SWEEP_SECONDS = 300
+
+# UPLOAD_SESSION_TTL_SECONDS: 上传会话闲置（无分片写入）超过该时长即被后台清理
+# STAGING_MAX_BYTES: .chunks 暂存区总占用上限，超出时淘汰最久未活动的闲置会话，仍不足则新会话返回 507
+# STAGING_EVICT_GRACE_SECONDS: 最近该时长内活动过的会话不参与容量淘汰
+# STAGING_SWEEP_SECONDS: 暂存区巡检间隔（秒），启动时立即执行一次
+# 使用位置：STAGING（lifespan 后台巡检、upload_init 容量检查）
+UPLOAD_SESSION_TTL_SECONDS = 24 * 3600
+STAGING_MAX_BYTES = 100 * 1024 * 1024 * 1024
+STAGING_EVICT_GRACE_SECONDS = 600
+STAGING_SWEEP_SECONDS = 300
+
+# CONTENT_ADDRESSED_STORE: 内容寻址存储开关；开启后断点续传的文件按 sha256 只存一份（UPLOAD_DIR/.blobs），
+# 文件名为指向 blob 的硬链接，任意文件名的相同内容都可秒传
+# 使用位置：upload_init 秒传判定；upload_complete 发布文件
+CONTENT_ADDRESSED_STORE = False
+# UPLOAD_SESSION_MAX_WRITERS: 单个上传会话同时写入的分片数上限，超出返回 429 + Retry-After
+# 使用位置：upload_chunk -> SESSION_WRITERS；首页 JS 并发窗口上限 UPLOAD_WINDOW_MAX
+UPLOAD_SESSION_MAX_WRITERS = 4
+# MERGE_COPY_FILE_RANGE: parts 模式合并时使用 os.copy_file_range（文件系统支持时可 reflink），失败自动回退普通写入
+# 使用位置：merge_parts
+MERGE_COPY_FILE_RANGE = True
+
+# ZERO_COPY_DOWNLOAD: 服务器支持 ASGI zerocopysend/pathsend 扩展时，下载由内核 sendfile 零拷贝发送
+#   __main__ 开启时以 ZeroCopyHttpProtocol（声明 zerocopysend）+ asyncio 事件循环启动 uvicorn，
+#   uvloop 未实现 loop.sendfile；未安装 httptools 时退回 uvicorn 默认协议，下载走回退生成器
+# 使用位置：download_file 200/206 分支 -> ZeroCopyFileResponse；__main__ -> uvicorn.run(http=...)；
+#   不支持时回退到池化缓冲区 / mmap 生成器
+ZERO_COPY_DOWNLOAD = True
+# MAX_RANGE_COUNT: 单个 Range 请求合并后允许的最大区间数，超出返回 416（防多区间放大攻击）
+# 使用位置：parse_range_header
+MAX_RANGE_COUNT = 16
+# FILE_CACHE_MAX_BYTES: 热点小文件内存缓存的总字节预算（0 表示关闭缓存）
+# 使用位置：FileCache（download_file 命中/填充；上传、合并、删除处理函数失效）
+FILE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+# FILE_CACHE_MAX_OBJECT_SIZE: 单个对象可进入缓存的最大字节数（1MB）
+# 使用位置：FileCache.accepts
+FILE_CACHE_MAX_OBJECT_SIZE = 1 * 1024 * 1024
+# FILE_CACHE_REVALIDATE_SECONDS: 缓存项超过该时长后命中时重新 stat 一次，发现带外修改
+# 使用位置：FileCache.get
+FILE_CACHE_REVALIDATE_SECONDS = 5
+# MMAP_RANGE_SERVING: Range 请求直接从共享的 mmap 映射切片（memoryview，不复制）返回
+# 使用位置：download_file -> iterfile；映射由 MmapPool 管理
+MMAP_RANGE_SERVING = True
+# MMAP_POOL_MAX_FILES: mmap 映射池最多保留的文件数，超出按 LRU 退役
+# 使用位置：MmapPool.acquire
+MMAP_POOL_MAX_FILES = 64
+# STAT_CACHE_TTL_SECONDS / STAT_CACHE_MAX_ENTRIES: HEAD 请求使用的 stat 结果缓存有效期与容量
+# 使用位置：StatCache（head_file 读取；上传与删除处理函数失效）
+STAT_CACHE_TTL_SECONDS = 2
+STAT_CACHE_MAX_ENTRIES = 100000
+# COMPRESS_MIN_SIZE / COMPRESS_MAX_SIZE: 参与透明压缩的文件大小范围
+# 使用位置：SidecarCompressor.compressible（download_file / head_file 整文件响应）
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_MAX_SIZE = 512 * 1024 * 1024
+# COMPRESS_MIME_PREFIXES / COMPRESS_EXTENSIONS: 可压缩类型白名单（MIME 前缀或扩展名命中其一即可）
+# 使用位置：SidecarCompressor.compressible
+COMPRESS_MIME_PREFIXES = ("text/", "application/json", "application/javascript", "application/xml", "image/svg+xml")
+COMPRESS_EXTENSIONS = {".txt", ".log", ".json", ".csv", ".md", ".xml", ".yaml", ".yml", ".html", ".js", ".css", ".svg"}
+# COMPRESS_GZIP_LEVEL / COMPRESS_ZSTD_LEVEL: 后台生成旁路压缩文件的压缩级别
+# 使用位置：SidecarCompressor.build
+COMPRESS_GZIP_LEVEL = 6
+COMPRESS_ZSTD_LEVEL = 10
+# COMPRESS_QUEUE_SIZE: 待生成旁路压缩文件的队列上限，队列满时本次跳过
+# 使用位置：SidecarCompressor.schedule
+COMPRESS_QUEUE_SIZE = 1024
+# SIDECAR_DIR: 旁路文件（压缩副本 {name}.gz/.zst、哈希索引 {name}.sha256）所在的私有子目录（与源文件同目录），
+#   不与用户自己的隐藏文件混在一起
+# 使用位置：SidecarCompressor.sidecar_path；hash_sidecar_path
+SIDECAR_DIR = ".sidecars"
+# BUFFER_POOL_MAX_BYTES: 所有下载流共享的读缓冲区内存上限（256MB），用满时新的流等待空闲缓冲区
+# 使用位置：BufferPool（download_file -> iter_pooled_file 文件读取路径）
+BUFFER_POOL_MAX_BYTES = 256 * 1024 * 1024
+# ADAPTIVE_CHUNK_MIN: 自适应分片的最小尺寸（上限沿用 STREAM/RANGE_DOWNLOAD_CHUNK_SIZE）
+# 使用位置：iter_pooled_file
+ADAPTIVE_CHUNK_MIN = 256 * 1024
+# ADAPTIVE_CHUNK_TARGET_SECONDS: 单个分片期望覆盖的发送时长，按观测到的 socket 排空速率换算分片大小
+# 使用位置：iter_pooled_file
+ADAPTIVE_CHUNK_TARGET_SECONDS = 0.05
+# TRANSPORT_SAFE_TAIL: 传输层写缓冲可能仍引用的已发送字节上限（须大于服务器写缓冲高水位 64KB）；
+# 流末尾这部分字节以副本发送，保证缓冲区归还后被复用时不会改写尚未发出的数据
+# 使用位置：iter_pooled_file
+TRANSPORT_SAFE_TAIL = 256 * 1024
+# FILE_INDEX_RESCAN_SECONDS: 目录索引的周期性全量重扫间隔，用于发现带外增删改
+# 使用位置：lifespan -> FileIndex.run_rescan
+FILE_INDEX_RESCAN_SECONDS = 60
+# FILE_LIST_PAGE_MAX: /api/files 单页最多返回的条目数
+# 使用位置：list_files_api
+FILE_LIST_PAGE_MAX = 1000
+# FILE_LIST_SCAN_MAX: 带 q 关键字过滤时单次请求最多检查的条目数；达到上限仍未凑满一页时
+#   提前返回已匹配条目与续扫游标，避免稀有关键字在事件循环上扫完整个视图
+# 使用位置：FileIndex.page
+FILE_LIST_SCAN_MAX = 5000
+# HOMEPAGE_PAGE_SIZE: 首页首屏直接输出的文件条目数，其余条目滚动时通过 /api/files 分页加载
+# 使用位置：homepage
+HOMEPAGE_PAGE_SIZE = 200
+# FS_EXECUTOR_WORKERS: 阻塞文件系统操作专用线程池的线程数（aiofiles 读写、unlink/rename/rmtree、目录扫描等）
+# 使用位置：FS_EXECUTOR -> run_blocking 与所有 aiofiles.open(executor=...)
+FS_EXECUTOR_WORKERS = 16
+# HASH_EXECUTOR_MODE: 整文件哈希等 CPU 密集任务的执行器，"thread" 或 "process"（进程池可用满多核）
+# HASH_EXECUTOR_WORKERS: 哈希执行器并发数
+# 使用位置：get_hash_executor -> run_hashing（HASH_INDEXER、分片合并）
+HASH_EXECUTOR_MODE = "thread"
+HASH_EXECUTOR_WORKERS = 2
+# LOOP_LAG_INTERVAL: 事件循环延迟采样间隔（秒）
+# 使用位置：lifespan -> LOOP_LAG 监测，/stats/loop 查询
+LOOP_LAG_INTERVAL = 0.05
 # UVICORN 运行参数
 # 使用位置：__main__ 中的 uvicorn.run(...)
 UVICORN_CONFIG = {
@@ -52,6 +251,76 @@ def get_upload_dir() -> str:
 def get_chunk_dir() -> str:
     return os.path.join(get_upload_dir(), ".chunks")
 
+# 阻塞文件系统操作的专用有界线程池，与默认执行器隔离，避免与其他 to_thread 调用互相挤占
+FS_EXECUTOR = ThreadPoolExecutor(max_workers=FS_EXECUTOR_WORKERS, thread_name_prefix="obs-fs")
+# 哈希执行器按 HASH_EXECUTOR_MODE 首次使用时创建（进程池不在导入时启动子进程）
+HASH_EXECUTOR = None
+
+def get_hash_executor():
+    global HASH_EXECUTOR
+    if HASH_EXECUTOR is None:
+        if HASH_EXECUTOR_MODE == "process":
+            HASH_EXECUTOR = ProcessPoolExecutor(max_workers=HASH_EXECUTOR_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        else:
+            HASH_EXECUTOR = ThreadPoolExecutor(max_workers=HASH_EXECUTOR_WORKERS, thread_name_prefix="obs-hash")
+    return HASH_EXECUTOR
+
+def shutdown_hash_executor():
+    global HASH_EXECUTOR
+    if HASH_EXECUTOR is not None:
+        HASH_EXECUTOR.shutdown(wait=False, cancel_futures=True)
+        HASH_EXECUTOR = None
+
+async def run_blocking(func, *args, **kwargs):
+    """在 FS_EXECUTOR 中执行阻塞的文件系统调用"""
+    return await asyncio.get_running_loop().run_in_executor(FS_EXECUTOR, functools.partial(func, *args, **kwargs))
+
+async def run_hashing(func, *args):
+    """在哈希执行器中执行 CPU 密集任务；process 模式下 func 与参数须可 pickle"""
+    return await asyncio.get_running_loop().run_in_executor(get_hash_executor(), functools.partial(func, *args))
+
+class LoopLagMonitor:
+    """周期性 sleep 并测量实际唤醒的延迟，反映事件循环被同步代码阻塞的程度"""
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.last = 0.0
+        self.max = 0.0
+        self.samples = 0
+
+    async def run(self, interval: float):
+        while True:
+            begin = time.perf_counter()
+            await asyncio.sleep(interval)
+            lag = max(time.perf_counter() - begin - interval, 0.0)
+            self.last = lag
+            self.max = max(self.max, lag)
+            self.samples += 1
+
+    def start(self):
+        self.task = asyncio.create_task(self.run(LOOP_LAG_INTERVAL))
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def reset(self):
+        self.max = 0.0
+        self.samples = 0
+
+    def stats(self) -> dict:
+        return {
+            "last_ms": round(self.last * 1000, 3),
+            "max_ms": round(self.max * 1000, 3),
+            "samples": self.samples,
+        }
+
+LOOP_LAG = LoopLagMonitor()
+
 # 内存存储 Notice 内容
 NOTICE_CONTENT = ""
 NOTICE_LOCK = asyncio.Lock()
@@ -63,8 +332,22 @@ async def lifespan(app: FastAPI):
     app.state.chunk_dir = os.path.join(app.state.upload_dir, ".chunks")
     os.makedirs(app.state.upload_dir, exist_ok=True)
     os.makedirs(app.state.chunk_dir, exist_ok=True)
+    await run_blocking(FILE_INDEX.load, app.state.upload_dir)
+    await run_blocking(BLOB_STORE.load, app.state.upload_dir)
+    LOOP_LAG.start()
+    STAGING.start(app.state.chunk_dir)
+    FILE_INDEX.start()
+    COMPRESSOR.start()
+    HASH_INDEXER.start()
     yield
     # Shutdown
+    await FILE_INDEX.stop()
+    await COMPRESSOR.stop()
+    await HASH_INDEXER.stop()
+    await LOOP_LAG.stop()
+    await STAGING.stop()
+    await FSYNC_BATCHER.stop()
+    shutdown_hash_executor()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -98,6 +381,1389 @@ class ConnectionManager:
 
 manager = ConnectionManager()
 
+class CachedFile:
+    __slots__ = ("st", "data", "checked_at")
+
+    def __init__(self, st: os.stat_result, data: bytes):
+        self.st = st
+        self.data = data
+        self.checked_at = time.monotonic()
+
+# 热点小文件缓存：按总字节预算做 LRU 淘汰
+class FileCache:
+    def __init__(self, max_bytes: int, max_object_size: int):
+        self.max_bytes = max_bytes
+        self.max_object_size = max_object_size
+        self.entries: "OrderedDict[str, CachedFile]" = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def accepts(self, size: int) -> bool:
+        return self.max_bytes > 0 and size <= min(self.max_object_size, self.max_bytes)
+
+    def get(self, path: str) -> Optional[CachedFile]:
+        key = os.path.abspath(path)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+        if time.monotonic() - entry.checked_at > FILE_CACHE_REVALIDATE_SECONDS:
+            try:
+                st = os.stat(key)
+            except OSError:
+                st = None
+            if st is None or stat_key(st) != stat_key(entry.st):
+                self.invalidate(key)
+                with self.lock:
+                    self.misses += 1
+                return None
+            entry.checked_at = time.monotonic()
+        with self.lock:
+            if self.entries.get(key) is entry:
+                self.entries.move_to_end(key)
+            self.hits += 1
+        return entry
+
+    def put(self, path: str, st: os.stat_result, data: bytes) -> CachedFile:
+        key = os.path.abspath(path)
+        entry = CachedFile(st, data)
+        if not self.accepts(len(data)):
+            return entry
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old.data)
+            self.entries[key] = entry
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted.data)
+                self.evictions += 1
+        return entry
+
+    def invalidate(self, path: str):
+        key = os.path.abspath(path)
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old.data)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+                "max_object_size": self.max_object_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+FILE_CACHE = FileCache(FILE_CACHE_MAX_BYTES, FILE_CACHE_MAX_OBJECT_SIZE)
+
+class MappedFile:
+    __slots__ = ("st", "mm", "refs", "retired")
+
+    def __init__(self, st: os.stat_result, mm: mmap.mmap):
+        self.st = st
+        self.mm = mm
+        self.refs = 0
+        self.retired = False
+
+# 最近被 Range 访问的文件的 mmap 映射池：引用计数，文件替换/删除或被 LRU 淘汰后退役，
+# 最后一个使用者释放时关闭映射
+class MmapPool:
+    def __init__(self, max_files: int):
+        self.max_files = max_files
+        self.entries: "OrderedDict[str, MappedFile]" = OrderedDict()
+        self.mapped = 0
+        self.reused = 0
+        self.lock = threading.Lock()
+
+    def acquire(self, path: str, st: os.stat_result) -> Optional[MappedFile]:
+        key = os.path.abspath(path)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and stat_key(entry.st) == stat_key(st):
+                entry.refs += 1
+                self.entries.move_to_end(key)
+                self.reused += 1
+                return entry
+        try:
+            with open(key, "rb") as f:
+                # 打开后再核对 inode/size/mtime，避免映射到请求之后被替换的新文件
+                if stat_key(os.fstat(f.fileno())) != stat_key(st):
+                    return None
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        entry = MappedFile(st, mm)
+        entry.refs = 1
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self._retire(old)
+            self.entries[key] = entry
+            self.mapped += 1
+            while len(self.entries) > self.max_files:
+                _, evicted = self.entries.popitem(last=False)
+                self._retire(evicted)
+        return entry
+
+    def release(self, entry: MappedFile):
+        with self.lock:
+            entry.refs -= 1
+            if entry.retired and entry.refs <= 0:
+                self._close(entry)
+
+    def invalidate(self, path: str):
+        with self.lock:
+            entry = self.entries.pop(os.path.abspath(path), None)
+            if entry is not None:
+                self._retire(entry)
+
+    def _retire(self, entry: MappedFile):
+        entry.retired = True
+        if entry.refs <= 0:
+            self._close(entry)
+
+    @staticmethod
+    def _close(entry: MappedFile):
+        try:
+            entry.mm.close()
+        except BufferError:
+            # 传输层仍持有切片（尚未写完），映射随最后一个 memoryview 回收
+            pass
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "files": len(self.entries),
+                "max_files": self.max_files,
+                "in_use": sum(1 for e in self.entries.values() if e.refs > 0),
+                "mapped": self.mapped,
+                "reused": self.reused,
+            }
+
+MMAP_POOL = MmapPool(MMAP_POOL_MAX_FILES)
+
+# 预分配 bytearray 缓冲区池：按尺寸分桶复用，空闲与在用缓冲区总量不超过 max_bytes
+class BufferPool:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.free: dict = {}
+        self.free_bytes = 0
+        self.in_use = 0
+        self.allocated = 0
+        self.reused = 0
+        self.waits = 0
+        self.waiters: list = []
+        self.lock = threading.Lock()
+
+    def try_acquire(self, size: int) -> Optional[bytearray]:
+        with self.lock:
+            bucket = self.free.get(size)
+            if bucket:
+                buf = bucket.pop()
+                self.free_bytes -= size
+                self.in_use += size
+                self.reused += 1
+                return buf
+            # 没有任何在用缓冲区时允许超额分配一个，避免单个超大请求永久等待
+            if self.in_use > 0 and self.in_use + size > self.max_bytes:
+                return None
+            # 为新分配腾出空间：丢弃其它尺寸的空闲缓冲区
+            while self.free_bytes > 0 and self.in_use + self.free_bytes + size > self.max_bytes:
+                largest = max(k for k, v in self.free.items() if v)
+                self.free[largest].pop()
+                self.free_bytes -= largest
+            self.in_use += size
+            self.allocated += 1
+        return bytearray(size)
+
+    async def acquire(self, size: int) -> bytearray:
+        while True:
+            buf = self.try_acquire(size)
+            if buf is not None:
+                return buf
+            loop = asyncio.get_running_loop()
+            waiter = (loop, loop.create_future())
+            with self.lock:
+                self.waiters.append(waiter)
+                self.waits += 1
+            try:
+                # 登记后再试一次，避免错过登记前发生的归还
+                buf = self.try_acquire(size)
+                if buf is not None:
+                    return buf
+                await waiter[1]
+            finally:
+                with self.lock:
+                    if waiter in self.waiters:
+                        self.waiters.remove(waiter)
+
+    def release(self, buf: bytearray):
+        size = len(buf)
+        with self.lock:
+            self.in_use -= size
+            self.free.setdefault(size, []).append(buf)
+            self.free_bytes += size
+            waiters, self.waiters = self.waiters, []
+        for loop, fut in waiters:
+            loop.call_soon_threadsafe(lambda f=fut: f.done() or f.set_result(None))
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "max_bytes": self.max_bytes,
+                "in_use_bytes": self.in_use,
+                "free_bytes": self.free_bytes,
+                "allocated": self.allocated,
+                "reused": self.reused,
+                "waits": self.waits,
+                "waiting": len(self.waiters),
+            }
+
+BUFFER_POOL = BufferPool(BUFFER_POOL_MAX_BYTES)
+
+class TokenBucket:
+    """令牌桶；rate 为 None 时不限速。允许欠账：令牌不少于 min(申请量, 容量) 即放行，再整笔扣除"""
+    def __init__(self, rate: Optional[float], burst_seconds: float):
+        self.configure(rate, burst_seconds)
+        self.tokens = self.capacity
+        self.stamp = time.monotonic()
+
+    def configure(self, rate: Optional[float], burst_seconds: float):
+        self.rate = rate
+        self.capacity = rate * burst_seconds if rate else 0.0
+        if rate:
+            self.tokens = min(getattr(self, "tokens", self.capacity), self.capacity)
+
+    def wait_time(self, n: int, now: float) -> float:
+        if not self.rate:
+            return 0.0
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        need = min(n, self.capacity)
+        return 0.0 if self.tokens >= need else (need - self.tokens) / self.rate
+
+    def consume(self, n: int):
+        if self.rate:
+            self.tokens -= n
+
+    def full(self, now: float) -> bool:
+        return not self.rate or self.tokens + (now - self.stamp) * self.rate >= self.capacity
+
+class TransferFlow:
+    __slots__ = ("client", "weight", "finish")
+
+    def __init__(self, client: str, weight: float):
+        self.client = client
+        self.weight = weight
+        self.finish = 0.0
+
+class BandwidthShaper:
+    """
+    按客户端 IP 与全局两级令牌桶整形传输字节。等待中的申请按加权公平排队：
+    虚拟完成时间 = max(系统虚拟时间, 该流上次完成时间) + 字节数 / 权重，全局令牌按完成时间先后发放；
+    某客户端自身限速未就绪时跳过它，让其他客户端先行。
+    """
+    def __init__(self):
+        self.global_bps = RATE_LIMIT_GLOBAL_BPS
+        self.client_bps = RATE_LIMIT_CLIENT_BPS
+        self.burst_seconds = RATE_LIMIT_BURST_SECONDS
+        self.small_transfer = RATE_LIMIT_SMALL_TRANSFER
+        self.small_weight = RATE_LIMIT_SMALL_WEIGHT
+        self.global_bucket = TokenBucket(self.global_bps, self.burst_seconds)
+        self.client_buckets: Dict[str, TokenBucket] = {}
+        self.client_flows: Dict[str, int] = {}
+        self.waiting = []
+        self.seq = 0
+        self.vtime = 0.0
+        self.wakeup: Optional[asyncio.Event] = None
+        self.task: Optional[asyncio.Task] = None
+        self.granted = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.max_wait = 0.0
+
+    def enabled(self) -> bool:
+        return bool(self.global_bps or self.client_bps)
+
+    def configure(self, **options):
+        for key, value in options.items():
+            setattr(self, key, value)
+        self.global_bucket.configure(self.global_bps, self.burst_seconds)
+        for bucket in self.client_buckets.values():
+            bucket.configure(self.client_bps, self.burst_seconds)
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    def open(self, client: str, total: Optional[int]) -> TransferFlow:
+        weight = self.small_weight if total is not None and total <= self.small_transfer else 1
+        self.client_flows[client] = self.client_flows.get(client, 0) + 1
+        if client not in self.client_buckets:
+            self.client_buckets[client] = TokenBucket(self.client_bps, self.burst_seconds)
+        return TransferFlow(client, weight)
+
+    def close(self, flow: TransferFlow):
+        n = self.client_flows.get(flow.client, 0) - 1
+        if n > 0:
+            self.client_flows[flow.client] = n
+        else:
+            self.client_flows.pop(flow.client, None)
+        self.prune_idle(time.monotonic())
+
+    def prune_idle(self, now: float):
+        # 空闲客户端的令牌桶保留到自然回满再删除，否则紧接着的新请求会拿到一个满桶，连续小请求永远不受单客户端限速
+        for client in [c for c, bucket in self.client_buckets.items() if c not in self.client_flows and bucket.full(now)]:
+            del self.client_buckets[client]
+
+    async def acquire(self, flow: TransferFlow, n: int):
+        if not self.enabled():
+            return
+        loop = asyncio.get_running_loop()
+        flow.finish = max(self.vtime, flow.finish) + n / flow.weight
+        fut = loop.create_future()
+        self.seq += 1
+        self.waiting.append((flow.finish, self.seq, flow, n, fut, time.monotonic()))
+        if self.wakeup is None:
+            self.wakeup = asyncio.Event()
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.dispatch())
+        self.wakeup.set()
+        await fut
+
+    async def dispatch(self):
+        while self.waiting:
+            now = time.monotonic()
+            self.waiting = sorted(item for item in self.waiting if not item[4].done())
+            chosen = None
+            delay = None
+            for item in self.waiting:
+                _, _, flow, n, _, _ = item
+                global_wait = self.global_bucket.wait_time(n, now)
+                if global_wait > 0:
+                    # 全局令牌按虚拟完成时间顺序发放，不允许后来者插队
+                    delay = global_wait if delay is None else min(delay, global_wait)
+                    break
+                bucket = self.client_buckets.get(flow.client)
+                client_wait = bucket.wait_time(n, now) if bucket is not None else 0.0
+                if client_wait > 0:
+                    delay = client_wait if delay is None else min(delay, client_wait)
+                    continue
+                chosen = item
+                break
+            if chosen is None:
+                if not self.waiting:
+                    break
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            finish, _, flow, n, fut, queued_at = chosen
+            self.waiting.remove(chosen)
+            self.global_bucket.consume(n)
+            bucket = self.client_buckets.get(flow.client)
+            if bucket is not None:
+                bucket.consume(n)
+            self.vtime = max(self.vtime, finish)
+            self.granted += n
+            waited = now - queued_at
+            if waited > 0.001:
+                self.waits += 1
+                self.wait_seconds += waited
+                self.max_wait = max(self.max_wait, waited)
+            fut.set_result(None)
+        if not self.waiting:
+            # 队列清空后重置虚拟时间，避免数值无限增长
+            self.vtime = 0.0
+
+    async def shape(self, stream, client: str, total: Optional[int], quantum: Optional[int] = None):
+        """包装异步字节流：每块先申请令牌再交出；quantum 指定时把大块拆成该粒度的 memoryview"""
+        flow = self.open(client, total)
+        try:
+            async for chunk in stream:
+                if not self.enabled():
+                    yield chunk
+                    continue
+                if quantum and len(chunk) > quantum:
+                    # 逐片释放子视图：上游可能是 mmap 切片，残留的视图会阻止映射关闭
+                    view = memoryview(chunk)
+                    try:
+                        for pos in range(0, len(view), quantum):
+                            piece = view[pos:pos + quantum]
+                            try:
+                                await self.acquire(flow, len(piece))
+                                yield piece
+                            finally:
+                                piece.release()
+                    finally:
+                        view.release()
+                else:
+                    await self.acquire(flow, len(chunk))
+                    yield chunk
+        finally:
+            self.close(flow)
+            if hasattr(stream, "aclose"):
+                await stream.aclose()
+
+    def config(self) -> dict:
+        return {
+            "global_bps": self.global_bps,
+            "client_bps": self.client_bps,
+            "burst_seconds": self.burst_seconds,
+            "small_transfer": self.small_transfer,
+            "small_weight": self.small_weight,
+        }
+
+    def stats(self) -> dict:
+        return {
+            **self.config(),
+            "enabled": self.enabled(),
+            "clients": len(self.client_flows),
+            "flows": sum(self.client_flows.values()),
+            "waiting": len(self.waiting),
+            "granted_bytes": self.granted,
+            "waits": self.waits,
+            "wait_seconds": round(self.wait_seconds, 3),
+            "max_wait": round(self.max_wait, 3),
+        }
+
+BANDWIDTH = BandwidthShaper()
+
+def client_address(request: Request) -> str:
+    return request.client.host if request.client else "unknown"
+
+def request_body(request: Request):
+    """请求体字节流，经 BANDWIDTH 按客户端与全局限速整形"""
+    length = request.headers.get("content-length")
+    total = int(length) if length and length.isdigit() else None
+    return BANDWIDTH.shape(request.stream(), client_address(request), total)
+
+def shaped_download(request: Request, content, total: int):
+    """下载内容生成器经 BANDWIDTH 整形，大分片按 RATE_LIMIT_QUANTUM 拆分以便各流交替发送"""
+    return BANDWIDTH.shape(content, client_address(request), total, RATE_LIMIT_QUANTUM)
+
+async def iter_bytes(data):
+    yield data
+
+class AdmissionGate:
+    """
+    单个传输类别的准入控制：最多 limit 个同时执行，其余按到达顺序在容量 max_queue 的队列中等待；
+    队列已满或等待超过 timeout 秒时以 503 + Retry-After 拒绝。后台任务（background=True）只排队不被拒绝。
+    """
+    def __init__(self, name: str, limit: int, max_queue: int, timeout: float):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.active = 0
+        self.waiters = deque()
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait = 0.0
+
+    def busy(self, detail: str) -> HTTPException:
+        return HTTPException(status_code=503, detail=detail, headers={"Retry-After": str(ADMISSION_RETRY_AFTER)})
+
+    async def acquire(self, background: bool = False):
+        if self.active < self.limit and not self.waiters:
+            self.active += 1
+            self.admitted += 1
+            return
+        if not background and len(self.waiters) >= self.max_queue:
+            self.rejected += 1
+            raise self.busy(f"服务繁忙（{self.name} 排队已满），请稍后重试")
+        fut = asyncio.get_running_loop().create_future()
+        self.waiters.append(fut)
+        self.queued += 1
+        began = time.monotonic()
+        try:
+            await asyncio.wait_for(fut, None if background else self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise self.busy(f"服务繁忙（{self.name} 排队超时），请稍后重试")
+        except BaseException:
+            # 名额已转交但等待方被取消（如客户端断开）：原样归还
+            if fut.done() and not fut.cancelled():
+                self.release()
+            raise
+        finally:
+            if fut in self.waiters:
+                self.waiters.remove(fut)
+        waited = time.monotonic() - began
+        self.admitted += 1
+        self.wait_seconds += waited
+        self.max_wait = max(self.max_wait, waited)
+
+    def release(self):
+        # 有人排队时名额直接转交给队首，active 不变
+        while self.waiters:
+            fut = self.waiters.popleft()
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self.active -= 1
+
+    def configure(self, limit: Optional[int] = None, max_queue: Optional[int] = None, timeout: Optional[float] = None):
+        if limit is not None:
+            self.limit = limit
+        if max_queue is not None:
+            self.max_queue = max_queue
+        if timeout is not None:
+            self.timeout = timeout
+        # 上调并发后立即放行排队者
+        while self.active < self.limit and self.waiters:
+            fut = self.waiters.popleft()
+            if not fut.done():
+                self.active += 1
+                fut.set_result(None)
+
+    def config(self) -> dict:
+        return {"limit": self.limit, "max_queue": self.max_queue, "timeout": self.timeout}
+
+    def stats(self) -> dict:
+        return {
+            **self.config(),
+            "active": self.active,
+            "waiting": sum(1 for fut in self.waiters if not fut.done()),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "wait_avg_ms": round(self.wait_seconds / self.queued * 1000, 1) if self.queued else 0.0,
+            "wait_max_ms": round(self.max_wait * 1000, 1),
+        }
+
+ADMISSION = {
+    name: AdmissionGate(name, limit, ADMISSION_QUEUE_SIZE, ADMISSION_QUEUE_TIMEOUT)
+    for name, limit in ADMISSION_LIMITS.items()
+}
+
+@asynccontextmanager
+async def admitted(gate: Optional[AdmissionGate], background: bool = False):
+    """在 gate 准入后执行；gate 为 None 表示不受限"""
+    if gate is None:
+        yield
+        return
+    await gate.acquire(background)
+    try:
+        yield
+    finally:
+        gate.release()
+
+def upload_gate(request: Request) -> Optional[AdmissionGate]:
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) < ADMISSION_LARGE_UPLOAD:
+        return None
+    return ADMISSION["upload"]
+
+class AdmittedResponse(Response):
+    """包装已占用准入名额的响应：发送结束（含客户端中途断开）后归还名额"""
+    def __init__(self, response: Response, gate: AdmissionGate):
+        self.response = response
+        self.gate = gate
+        self.background = None
+        self.status_code = response.status_code
+        self.raw_headers = response.raw_headers
+
+    async def __call__(self, scope, receive, send):
+        if self.background is not None and self.response.background is None:
+            self.response.background = self.background
+        try:
+            await self.response(scope, receive, send)
+        finally:
+            self.gate.release()
+
+async def admit_download(response: Response, nbytes: int) -> Response:
+    """大于 ADMISSION_LARGE_DOWNLOAD 的下载在 download 类别准入后才开始发送"""
+    if nbytes < ADMISSION_LARGE_DOWNLOAD:
+        return response
+    gate = ADMISSION["download"]
+    await gate.acquire()
+    return AdmittedResponse(response, gate)
+
+def adaptive_chunk_size(rate: float, max_chunk: int) -> int:
+    """按排空速率（字节/秒）换算分片大小，取 [ADAPTIVE_CHUNK_MIN, max_chunk] 内不超过目标值的 2 的幂。"""
+    target = max(int(rate * ADAPTIVE_CHUNK_TARGET_SECONDS), ADAPTIVE_CHUNK_MIN)
+    size = ADAPTIVE_CHUNK_MIN
+    while size * 2 <= min(target, max_chunk):
+        size *= 2
+    return size
+
+async def iter_pooled_file(path: str, start: int, end: int, max_chunk: int):
+    """读取 [start, end] 并以池化缓冲区的 memoryview 逐片产出。
+
+    每个流持有一块分为两半的缓冲区交替 readinto：一半的数据交给传输层后，
+    至少再产出一整片（>= 写缓冲高水位）才会改写它。分片大小随两次产出之间观测到的
+    排空速率自适应；末尾 TRANSPORT_SAFE_TAIL 字节以副本产出，之后才归还缓冲区。
+    """
+    remain = end - start + 1
+    async with aiofiles.open(path, "rb", executor=FS_EXECUTOR) as f:
+        await f.seek(start)
+        if remain <= TRANSPORT_SAFE_TAIL:
+            data = await f.read(remain)
+            if data:
+                yield data
+            return
+        chunk = ADAPTIVE_CHUNK_MIN
+        buf = await BUFFER_POOL.acquire(2 * chunk)
+        retired = None
+        half = 0
+        rate = None
+        try:
+            while remain > TRANSPORT_SAFE_TAIL:
+                view = memoryview(buf)[half * chunk:(half + 1) * chunk]
+                n = await f.readinto(view[:min(chunk, remain - TRANSPORT_SAFE_TAIL)])
+                if not n:
+                    return
+                remain -= n
+                began = time.monotonic()
+                yield view[:n]
+                elapsed = max(time.monotonic() - began, 1e-6)
+                if retired is not None and n >= ADAPTIVE_CHUNK_MIN:
+                    # 新缓冲区已产出一整片，旧缓冲区中的数据必然已发出
+                    BUFFER_POOL.release(retired)
+                    retired = None
+                rate = n / elapsed if rate is None else 0.7 * rate + 0.3 * n / elapsed
+                half ^= 1
+                wanted = adaptive_chunk_size(rate, max_chunk)
+                if wanted != chunk and n == chunk and retired is None:
+                    resized = BUFFER_POOL.try_acquire(2 * wanted)
+                    if resized is not None:
+                        retired, buf, chunk, half = buf, resized, wanted, 0
+            data = await f.read(remain)
+            if data:
+                yield data
+        finally:
+            if retired is not None:
+                BUFFER_POOL.release(retired)
+            BUFFER_POOL.release(buf)
+
+# 短 TTL 的 stat 结果缓存：HEAD 不打开文件、不重复 stat
+class StatCache:
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, Tuple[os.stat_result, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def stat(self, path: str) -> os.stat_result:
+        """返回缓存或新鲜的 stat 结果；文件不存在时抛出 OSError。"""
+        key = os.path.abspath(path)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        st = os.stat(key)
+        with self.lock:
+            self.entries[key] = (st, now + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return st
+
+    def invalidate(self, path: str):
+        with self.lock:
+            self.entries.pop(os.path.abspath(path), None)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"entries": len(self.entries), "ttl": self.ttl, "hits": self.hits, "misses": self.misses}
+
+STAT_CACHE = StatCache(STAT_CACHE_TTL_SECONDS, STAT_CACHE_MAX_ENTRIES)
+
+def accepted_encodings(header: Optional[str]) -> set:
+    """解析 Accept-Encoding，返回 q>0 的编码集合。"""
+    accepted = set()
+    for item in (header or "").split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if q > 0:
+            accepted.add(name)
+    return accepted
+
+# 透明压缩：后台工作协程为可压缩文件生成旁路压缩文件（.sidecars/{name}.gz / .sidecars/{name}.zst），
+# 旁路文件的 mtime 与源文件一致时才视为有效；旁路文件的 stat 按源文件 stat_key 缓存，命中时不再访问磁盘
+class SidecarCompressor:
+    SUFFIXES = {"zstd": "zst", "gzip": "gz"}
+
+    def __init__(self):
+        self.queue: Optional[asyncio.Queue] = None
+        self.task: Optional[asyncio.Task] = None
+        self.pending = set()
+        self.built = 0
+        self.failed = 0
+        self.skipped = 0
+        self.variants: "OrderedDict[str, Tuple[tuple, dict]]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def encodings() -> List[str]:
+        return ["zstd", "gzip"] if zstandard is not None else ["gzip"]
+
+    @classmethod
+    def sidecar_path(cls, path: str, encoding: str) -> str:
+        directory, name = os.path.split(path)
+        return os.path.join(directory, SIDECAR_DIR, f"{name}.{cls.SUFFIXES[encoding]}")
+
+    @staticmethod
+    def compressible(path: str, size: int) -> bool:
+        if size < COMPRESS_MIN_SIZE or size > COMPRESS_MAX_SIZE:
+            return False
+        if os.path.splitext(path)[1].lower() in COMPRESS_EXTENSIONS:
+            return True
+        mime, _ = mimetypes.guess_type(path)
+        return bool(mime) and mime.startswith(COMPRESS_MIME_PREFIXES)
+
+    def sidecar_stats(self, path: str, st: os.stat_result) -> dict:
+        """返回 {编码: 有效旁路文件的 stat 或 None}，源文件 stat_key 不变时直接取缓存"""
+        key = os.path.abspath(path)
+        with self.lock:
+            entry = self.variants.get(key)
+            if entry is not None and entry[0] == stat_key(st):
+                self.variants.move_to_end(key)
+                return entry[1]
+        found = {}
+        for encoding in self.encodings():
+            try:
+                sidecar_st = os.stat(self.sidecar_path(path, encoding))
+            except OSError:
+                sidecar_st = None
+            found[encoding] = sidecar_st if sidecar_st is not None and sidecar_st.st_mtime_ns == st.st_mtime_ns else None
+        with self.lock:
+            self.variants[key] = (stat_key(st), found)
+            self.variants.move_to_end(key)
+            while len(self.variants) > STAT_CACHE_MAX_ENTRIES:
+                self.variants.popitem(last=False)
+        return found
+
+    def forget(self, path: str):
+        with self.lock:
+            self.variants.pop(os.path.abspath(path), None)
+
+    def negotiate(self, path: str, st: os.stat_result, accept_encoding: Optional[str]):
+        """返回 (编码, 旁路文件路径, 旁路文件 stat)；没有可用的旁路文件时返回 None，并按需排队生成。"""
+        accepted = accepted_encodings(accept_encoding)
+        missing = False
+        sidecars = self.sidecar_stats(path, st)
+        for encoding in self.encodings():
+            if encoding not in accepted:
+                continue
+            sidecar_st = sidecars.get(encoding)
+            if sidecar_st is None:
+                missing = True
+                continue
+            if sidecar_st.st_size >= st.st_size:
+                # 压缩无收益，按原文发送
+                continue
+            return encoding, self.sidecar_path(path, encoding), sidecar_st
+        if missing:
+            self.schedule(path)
+        return None
+
+    def schedule(self, path: str):
+        if self.queue is None or path in self.pending:
+            return
+        try:
+            self.queue.put_nowait(path)
+            self.pending.add(path)
+        except asyncio.QueueFull:
+            self.skipped += 1
+
+    def start(self):
+        self.queue = asyncio.Queue(maxsize=COMPRESS_QUEUE_SIZE)
+        self.task = asyncio.create_task(self._worker())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        self.queue = None
+        self.task = None
+        self.pending.clear()
+
+    async def _worker(self):
+        while True:
+            path = await self.queue.get()
+            try:
+                await run_blocking(self.build, path)
+            except Exception as e:
+                self.failed += 1
+                print(f"Sidecar compression failed for {path}: {e}", flush=True)
+            finally:
+                self.pending.discard(path)
+
+    def build(self, path: str):
+        try:
+            self.build_sidecars(path)
+        finally:
+            # 无论生成、跳过还是失败，都让下一次请求重新 stat 旁路文件
+            self.forget(path)
+
+    def build_sidecars(self, path: str):
+        st = os.stat(path)
+        os.makedirs(os.path.join(os.path.dirname(path), SIDECAR_DIR), exist_ok=True)
+        for encoding in self.encodings():
+            sidecar = self.sidecar_path(path, encoding)
+            try:
+                if os.stat(sidecar).st_mtime_ns == st.st_mtime_ns:
+                    continue
+            except OSError:
+                pass
+            tmp = sidecar + ".tmp"
+            try:
+                with open(path, "rb") as src, open(tmp, "wb") as dst:
+                    if encoding == "gzip":
+                        with gzip.GzipFile(fileobj=dst, mode="wb", compresslevel=COMPRESS_GZIP_LEVEL, mtime=0) as gz:
+                            shutil.copyfileobj(src, gz, 1024 * 1024)
+                    else:
+                        zstandard.ZstdCompressor(level=COMPRESS_ZSTD_LEVEL).copy_stream(src, dst)
+                # 压缩期间源文件被替换或删除则放弃本次结果
+                if stat_key(os.stat(path)) != stat_key(st):
+                    os.remove(tmp)
+                    return
+                os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns))
+                os.replace(tmp, sidecar)
+                self.built += 1
+            except Exception:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                raise
+
+    def remove(self, path: str):
+        self.forget(path)
+        for encoding in self.SUFFIXES:
+            try:
+                os.remove(self.sidecar_path(path, encoding))
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        return {
+            "encodings": self.encodings(),
+            "queued": len(self.pending),
+            "built": self.built,
+            "failed": self.failed,
+            "skipped": self.skipped,
+        }
+
+COMPRESSOR = SidecarCompressor()
+
+class FileEntry:
+    __slots__ = ("name", "size", "mtime_ns", "ext")
+
+    def __init__(self, name: str, size: int, mtime_ns: int):
+        self.name = name
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.ext = os.path.splitext(name)[1].lower()
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "size": self.size,
+            "mtime": self.mtime_ns / 1e9,
+            "ext": self.ext,
+            "url": f"http://obs.dimond.top/{self.name}",
+        }
+
+# 排序键：time/size 降序，ext/name 升序；文件名作为次序键保证全序，可直接用作游标
+FILE_SORT_KEYS = {
+    "time": lambda e: (-e.mtime_ns, e.name),
+    "size": lambda e: (-e.size, e.name),
+    "ext": lambda e: (e.ext, e.name),
+    "name": lambda e: (e.name,),
+}
+
+# UPLOAD_DIR 顶层可见文件的内存索引：启动时全量扫描，处理函数增量更新，周期性重扫兜底；
+# 每种排序维护一份有序视图，另按扩展名各维护一份子视图（ext 过滤直接翻页），变更时用 bisect 原地增删
+class FileIndex:
+    def __init__(self):
+        self.root: Optional[str] = None
+        self.entries: dict = {}
+        self.views: dict = {}
+        self.ext_views: dict = {}
+        self.lock = threading.RLock()
+        self.task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def scan(root: str) -> dict:
+        entries = {}
+        try:
+            with os.scandir(root) as it:
+                for item in it:
+                    if item.name.startswith("."):
+                        continue
+                    try:
+                        if not item.is_file():
+                            continue
+                        st = item.stat()
+                    except OSError:
+                        continue
+                    entries[item.name] = FileEntry(item.name, st.st_size, st.st_mtime_ns)
+        except FileNotFoundError:
+            pass
+        return entries
+
+    @staticmethod
+    def build_view(entries: dict, sort: str) -> Tuple[list, list]:
+        key_fn = FILE_SORT_KEYS[sort]
+        items = sorted(entries.values(), key=key_fn)
+        return items, [key_fn(e) for e in items]
+
+    @staticmethod
+    def split_view(view: Tuple[list, list]) -> dict:
+        """把一份有序视图按扩展名拆成各自有序的子视图：{ext: (items, keys)}"""
+        by_ext = {}
+        for entry, key in zip(*view):
+            items, keys = by_ext.setdefault(entry.ext, ([], []))
+            items.append(entry)
+            keys.append(key)
+        return by_ext
+
+    def load(self, root: str):
+        # 在工作线程中扫描并预先排好各排序视图，加锁只做整体替换，列表请求不会在事件循环上重排全量
+        root = os.path.abspath(root)
+        entries = self.scan(root)
+        views = {sort: self.build_view(entries, sort) for sort in FILE_SORT_KEYS}
+        ext_views = {sort: self.split_view(view) for sort, view in views.items()}
+        with self.lock:
+            self.root = root
+            self.entries = entries
+            self.views = views
+            self.ext_views = ext_views
+
+    def loaded(self, root: str) -> bool:
+        return self.root == os.path.abspath(root)
+
+    def ensure(self, root: str):
+        if not self.loaded(root):
+            self.load(root)
+
+    async def run_rescan(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            if self.root is not None:
+                try:
+                    await run_blocking(self.load, self.root)
+                except Exception as e:
+                    print(f"File index rescan failed: {e}", flush=True)
+
+    def start(self):
+        self.task = asyncio.create_task(self.run_rescan(FILE_INDEX_RESCAN_SECONDS))
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def refresh(self, path: str):
+        """按单个路径的当前状态更新索引（不存在则移除）。"""
+        path = os.path.abspath(path)
+        name = os.path.basename(path)
+        if self.root is None or os.path.dirname(path) != self.root or name.startswith("."):
+            return
+        try:
+            st = os.stat(path)
+            entry = FileEntry(name, st.st_size, st.st_mtime_ns) if stat.S_ISREG(st.st_mode) else None
+        except OSError:
+            entry = None
+        with self.lock:
+            old = self.entries.pop(name, None)
+            if entry is not None:
+                self.entries[name] = entry
+            for sort, view in self.views.items():
+                key_fn = FILE_SORT_KEYS[sort]
+                by_ext = self.ext_views.get(sort)
+                if old is not None:
+                    self.remove_from_view(view, key_fn(old), old)
+                    if by_ext is not None and old.ext in by_ext:
+                        self.remove_from_view(by_ext[old.ext], key_fn(old), old)
+                        if not by_ext[old.ext][0]:
+                            del by_ext[old.ext]
+                if entry is not None:
+                    self.insert_into_view(view, key_fn(entry), entry)
+                    if by_ext is not None:
+                        self.insert_into_view(by_ext.setdefault(entry.ext, ([], [])), key_fn(entry), entry)
+
+    @staticmethod
+    def remove_from_view(view: Tuple[list, list], key: tuple, entry: FileEntry):
+        items, keys = view
+        i = bisect.bisect_left(keys, key)
+        if i < len(keys) and items[i] is entry:
+            del keys[i]
+            del items[i]
+
+    @staticmethod
+    def insert_into_view(view: Tuple[list, list], key: tuple, entry: FileEntry):
+        items, keys = view
+        i = bisect.bisect_left(keys, key)
+        keys.insert(i, key)
+        items.insert(i, entry)
+
+    def view(self, sort: str, ext: Optional[str] = None) -> Tuple[list, list]:
+        with self.lock:
+            cached = self.views.get(sort)
+            if cached is None:
+                cached = self.views[sort] = self.build_view(self.entries, sort)
+            if ext is None:
+                return cached
+            by_ext = self.ext_views.get(sort)
+            if by_ext is None:
+                by_ext = self.ext_views[sort] = self.split_view(cached)
+            return by_ext.get(ext, ([], []))
+
+    def page(self, sort: str, limit: int, after: Optional[tuple] = None,
+             q: Optional[str] = None, ext: Optional[str] = None) -> Tuple[list, Optional[tuple]]:
+        """
+        返回排序键大于 after 的至多 limit 个条目，以及下一页游标（没有更多时为 None）。
+        ext 过滤直接在该扩展名的子视图上翻页；q 过滤每次至多检查 FILE_LIST_SCAN_MAX 个条目，
+        达到上限时返回的条目可能不足 limit（甚至为空），游标指向已检查的最后一个条目，续扫即可。
+        """
+        with self.lock:
+            items, keys = self.view(sort, ext)
+            start = bisect.bisect_right(keys, after) if after is not None else 0
+            if q is None:
+                result = items[start:start + limit]
+                pos = start + len(result)
+            else:
+                q = q.lower()
+                end = min(len(items), start + FILE_LIST_SCAN_MAX)
+                result = []
+                pos = start
+                while pos < end and len(result) < limit:
+                    entry = items[pos]
+                    pos += 1
+                    if q in entry.name.lower():
+                        result.append(entry)
+            next_key = keys[pos - 1] if start < pos < len(items) else None
+            return result, next_key
+
+    def __len__(self):
+        return len(self.entries)
+
+FILE_INDEX = FileIndex()
+
+def encode_cursor(key: tuple) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(key), ensure_ascii=False).encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor: str, sort: str) -> tuple:
+    try:
+        key = tuple(json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")))
+    except Exception:
+        raise HTTPException(status_code=400, detail="无效的游标")
+    expected = (int, str) if sort in ("time", "size") else (str, str) if sort == "ext" else (str,)
+    if len(key) != len(expected) or not all(isinstance(v, t) for v, t in zip(key, expected)):
+        raise HTTPException(status_code=400, detail="游标与排序方式不匹配")
+    return key
+
+class BlobStore:
+    """
+    内容寻址存储：内容按 sha256 只存一份于 UPLOAD_DIR/.blobs/<前两位>/<sha256>，
+    用户可见的文件名是指向 blob 的硬链接，引用计数即 inode 链接数，最后一个文件名被删除时回收 blob。
+    内存索引 {sha256: (size, inode)} 使秒传判定无需读盘。
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.root = None
+        self.by_hash = {}
+        self.by_inode = {}
+
+    def blob_path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest)
+
+    def load(self, upload_dir: str):
+        root = os.path.join(os.path.abspath(upload_dir), ".blobs")
+        by_hash, by_inode = {}, {}
+        try:
+            with os.scandir(root) as subs:
+                for sub in subs:
+                    if not sub.is_dir():
+                        continue
+                    with os.scandir(sub.path) as it:
+                        for item in it:
+                            if len(item.name) != 64:
+                                continue
+                            st = item.stat()
+                            by_hash[item.name] = (st.st_size, st.st_ino)
+                            by_inode[st.st_ino] = item.name
+        except FileNotFoundError:
+            pass
+        with self.lock:
+            self.root = root
+            self.by_hash = by_hash
+            self.by_inode = by_inode
+
+    def ensure(self, upload_dir: str):
+        if self.root != os.path.join(os.path.abspath(upload_dir), ".blobs"):
+            self.load(upload_dir)
+
+    def lookup(self, digest: str, size: int) -> bool:
+        entry = self.by_hash.get(digest)
+        return entry is not None and entry[0] == size
+
+    def digest_for(self, st: os.stat_result) -> Optional[str]:
+        # blob 仍在时其文件名至少有两个链接
+        if st.st_nlink < 2:
+            return None
+        return self.by_inode.get(st.st_ino)
+
+    def ingest(self, src: str, digest: str, final_path: str) -> os.stat_result:
+        """把已校验的文件收入 blob（内容已存在则丢弃 src），再发布为 final_path，返回发布文件的 stat"""
+        with self.lock:
+            blob = self.blob_path(digest)
+            if digest in self.by_hash and os.path.exists(blob):
+                os.remove(src)
+            else:
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                os.replace(src, blob)
+                st = os.stat(blob)
+                self.by_hash[digest] = (st.st_size, st.st_ino)
+                self.by_inode[st.st_ino] = digest
+        return self.link(digest, final_path)
+
+    def link(self, digest: str, final_path: str) -> os.stat_result:
+        """以硬链接把 blob 原子发布为 final_path，被替换的旧文件按引用计数回收；返回发布文件的 stat"""
+        with self.lock:
+            blob_ino = self.by_hash[digest][1]
+            try:
+                old = os.lstat(final_path)
+            except FileNotFoundError:
+                old = None
+            if old is not None and old.st_ino == blob_ino:
+                return old
+            tmp = os.path.join(self.root, f"tmp-{secrets.token_hex(8)}")
+            os.link(self.blob_path(digest), tmp)
+            st = os.stat(tmp)
+            os.replace(tmp, final_path)
+        if old is not None:
+            self.release(old)
+        return st
+
+    def release(self, st: os.stat_result):
+        """某个文件名已解除链接：若它指向 blob 且再无其他文件名引用，删除 blob"""
+        with self.lock:
+            digest = self.by_inode.get(st.st_ino)
+            if digest is None:
+                return
+            blob = self.blob_path(digest)
+            try:
+                bst = os.stat(blob)
+            except FileNotFoundError:
+                bst = None
+            if bst is not None and bst.st_ino != st.st_ino:
+                return
+            if bst is None or bst.st_nlink <= 1:
+                if bst is not None:
+                    os.remove(blob)
+                self.by_hash.pop(digest, None)
+                self.by_inode.pop(st.st_ino, None)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "enabled": CONTENT_ADDRESSED_STORE,
+                "blobs": len(self.by_hash),
+                "bytes": sum(size for size, _ in self.by_hash.values()),
+            }
+
+BLOB_STORE = BlobStore()
+
+def refresh_path_state(path: str):
+    """删除过期的旁路压缩文件并按当前状态刷新目录索引（unlink/stat，在 FS_EXECUTOR 中执行）"""
+    COMPRESSOR.remove(path)
+    FILE_INDEX.refresh(path)
+
+async def invalidate_file_caches(path: str):
+    """文件被写入、替换或删除后调用：内存缓存在事件循环上立即清除，旁路文件与目录索引在工作线程中刷新。"""
+    FILE_CACHE.invalidate(path)
+    MMAP_POOL.invalidate(path)
+    STAT_CACHE.invalidate(path)
+    await run_blocking(refresh_path_state, path)
+
+def remove_file(path: str) -> Optional[os.stat_result]:
+    """删除文件并返回其删除前的 stat；文件不存在时返回 None（在 FS_EXECUTOR 中执行，大文件 unlink 可能较慢）"""
+    try:
+        st = os.lstat(path)
+        os.unlink(path)
+        return st
+    except FileNotFoundError:
+        return None
+
+def replace_file(src: str, dst: str) -> Optional[os.stat_result]:
+    """os.replace 到 dst，返回被替换文件的 stat（不存在时为 None）"""
+    try:
+        old = os.lstat(dst)
+    except FileNotFoundError:
+        old = None
+    os.replace(src, dst)
+    return old
+
+async def detach_existing_file(path: str):
+    """覆盖写入前先移除旧目录项：仍在读取（或已映射）旧文件的请求继续看到旧 inode，
+    不会因原地截断而读到半截数据或触发 SIGBUS。"""
+    st = await run_blocking(remove_file, path)
+    await invalidate_file_caches(path)
+    await run_blocking(forget_file_hash, path)
+    if st is not None:
+        await run_blocking(BLOB_STORE.release, st)
+
+def fsync_path(path: str):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def commit_publish_batch(items: List[Tuple[str, str]]) -> list:
+    """
+    组提交一批发布（在 FS_EXECUTOR 中执行）：逐个 fsync 临时文件并 os.replace 到目标，
+    再对涉及的目录各 fsync 一次。返回与 items 对应的结果：被替换文件的 stat（或 None），失败时为异常。
+    """
+    results = []
+    directories: Dict[str, List[int]] = {}
+    for i, (tmp_path, dst) in enumerate(items):
+        try:
+            fsync_path(tmp_path)
+            results.append(replace_file(tmp_path, dst))
+            directories.setdefault(os.path.dirname(dst) or ".", []).append(i)
+        except OSError as e:
+            results.append(e)
+    for directory, indices in directories.items():
+        try:
+            fsync_path(directory)
+        except OSError as e:
+            for i in indices:
+                results[i] = e
+    return results
+
+class FsyncBatcher:
+    """
+    fsync 组提交：FSYNC_BATCH_WINDOW 内到达的发布请求在一次执行器任务中落盘并改名，
+    同一目录的多个上传只 fsync 一次目录，一次线程切换完成整批
+    """
+    def __init__(self, window: float = FSYNC_BATCH_WINDOW):
+        self.window = window
+        self.pending: List[Tuple[str, str, asyncio.Future]] = []
+        self.task: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.requests = 0
+        self.dir_syncs = 0
+        self.max_batch = 0
+
+    async def publish(self, tmp_path: str, dst: str) -> Optional[os.stat_result]:
+        """fsync tmp_path 后原子替换 dst 并 fsync 所在目录，返回被替换文件的 stat"""
+        fut = asyncio.get_running_loop().create_future()
+        self.pending.append((tmp_path, dst, fut))
+        self.requests += 1
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+        return await fut
+
+    async def run(self):
+        await asyncio.sleep(self.window)
+        while self.pending:
+            batch, self.pending = self.pending, []
+            self.batches += 1
+            self.max_batch = max(self.max_batch, len(batch))
+            self.dir_syncs += len({os.path.dirname(dst) or "." for _, dst, _ in batch})
+            try:
+                results = await run_blocking(commit_publish_batch, [(tmp_path, dst) for tmp_path, dst, _ in batch])
+            except Exception as e:
+                results = [e] * len(batch)
+            for (_, _, fut), result in zip(batch, results):
+                if fut.done():
+                    continue
+                if isinstance(result, Exception):
+                    fut.set_exception(result)
+                else:
+                    fut.set_result(result)
+
+    async def stop(self):
+        # 关闭时等待在途批次完成，已受理的上传不丢失
+        if self.task is not None:
+            await self.task
+            self.task = None
+
+    def stats(self) -> dict:
+        return {
+            "policy": UPLOAD_FSYNC_POLICY,
+            "window": self.window,
+            "batches": self.batches,
+            "requests": self.requests,
+            "dir_syncs": self.dir_syncs,
+            "max_batch": self.max_batch,
+            "pending": len(self.pending),
+        }
+
+FSYNC_BATCHER = FsyncBatcher()
+
+def upload_temp_path(upload_dir: str) -> str:
+    """上传临时文件放在目标目录内（隐藏文件名），保证 os.replace 同文件系统原子发布"""
+    return os.path.join(upload_dir, f".upload-{secrets.token_hex(8)}.tmp")
+
+def preallocate_file(fd: int, size: int):
+    """按已知大小预分配磁盘块，减少碎片与元数据更新；空间不足时抛出 ENOSPC，其它失败（如文件系统不支持）忽略"""
+    if size <= 0:
+        return
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except (AttributeError, OSError) as e:
+        if getattr(e, "errno", None) == errno.ENOSPC:
+            raise
+
+async def publish_upload(tmp_path: str, save_path: str, digest: str):
+    """按 UPLOAD_FSYNC_POLICY 落盘后用 os.replace 原子发布临时文件，并刷新缓存与哈希索引"""
+    upload_dir = os.path.dirname(save_path) or "."
+    # 发布前取临时文件的 stat：改名不改变 inode/大小/mtime，发布后立即被覆盖也不会把哈希记到别的版本上
+    st = await run_blocking(os.stat, tmp_path)
+    if UPLOAD_FSYNC_POLICY == "batched":
+        old = await FSYNC_BATCHER.publish(tmp_path, save_path)
+    else:
+        if UPLOAD_FSYNC_POLICY == "on-close":
+            await run_blocking(fsync_path, tmp_path)
+        old = await run_blocking(replace_file, tmp_path, save_path)
+        if UPLOAD_FSYNC_POLICY == "on-close":
+            await run_blocking(fsync_path, upload_dir)
+    await invalidate_file_caches(save_path)
+    await run_blocking(remember_file_hash, save_path, digest, st)
+    if old is not None:
+        await run_blocking(BLOB_STORE.release, old)
+
 # --- Helper Functions ---
 
 async def get_notice():
@@ -110,6 +1776,132 @@ async def update_notice(content: str):
         NOTICE_CONTENT = content
     return True
 
+class ZeroCopyFileResponse(StreamingResponse):
+    """文件区间 [start, end] 的流式响应。
+
+    ASGI 服务器声明 http.response.zerocopysend 扩展时，交由服务器用 os.sendfile
+    零拷贝发送；整文件且声明 http.response.pathsend 时按路径发送；否则回退到 content 生成器。
+    uvicorn 自带协议不支持这两个扩展，__main__ 通过 ZeroCopyHttpProtocol 声明 zerocopysend。
+    """
+
+    def __init__(self, path: str, start: int, end: int, file_size: int, content, status_code: int = 200,
+                 headers: Optional[dict] = None, media_type: Optional[str] = None):
+        super().__init__(content, status_code=status_code, headers=headers, media_type=media_type)
+        self.path = path
+        self.offset = start
+        self.count = end - start + 1
+        self.whole_file = start == 0 and self.count == file_size
+        self.send_mode = "stream"
+
+    async def __call__(self, scope, receive, send):
+        extensions = scope.get("extensions") or {}
+        # 限速开启时必须经过整形后的 content 生成器，不能交给服务器零拷贝直发
+        zero_copy = ZERO_COPY_DOWNLOAD and not BANDWIDTH.enabled()
+        if zero_copy and "http.response.zerocopysend" in extensions:
+            self.send_mode = "zerocopysend"
+        elif zero_copy and self.whole_file and "http.response.pathsend" in extensions:
+            self.send_mode = "pathsend"
+        await super().__call__(scope, receive, send)
+
+    async def stream_response(self, send):
+        if self.send_mode == "stream":
+            await super().stream_response(send)
+            return
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if self.send_mode == "pathsend":
+            await send({"type": "http.response.pathsend", "path": os.path.abspath(self.path)})
+            return
+        with open(self.path, "rb") as f:
+            await send({
+                "type": "http.response.zerocopysend",
+                "file": f,
+                "offset": self.offset,
+                "count": self.count,
+                "more_body": False,
+            })
+
+async def sendfile_to_transport(transport, flow, f, offset: int, count: int) -> int:
+    """把文件区间写入 transport，返回实际发送的字节数（文件被截断时小于 count）。
+
+    优先 loop.sendfile（普通 TCP 连接上为内核 sendfile 零拷贝）；uvloop 未实现时
+    退回 FS_EXECUTOR 中 os.pread 分片读 + transport.write，并遵守 uvicorn 的写流控。
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.sendfile(transport, f, offset, count)
+    except NotImplementedError:
+        pass
+    fd = f.fileno()
+    sent = 0
+    while sent < count and not transport.is_closing():
+        data = await run_blocking(os.pread, fd, min(STREAM_DOWNLOAD_CHUNK_SIZE, count - sent), offset + sent)
+        if not data:
+            break
+        transport.write(data)
+        sent += len(data)
+        if flow.write_paused:
+            await flow.drain()
+    return sent
+
+if HttpToolsProtocol is not None:
+    class ZeroCopyResponseCycle(RequestResponseCycle):
+        """在 uvicorn 请求周期上实现 http.response.zerocopysend：响应头照常由父类写出，
+        响应体用 sendfile_to_transport 从文件直接发送。"""
+
+        async def send(self, message):
+            if message["type"] != "http.response.zerocopysend":
+                await super().send(message)
+                return
+            if self.flow.write_paused and not self.disconnected:
+                await self.flow.drain()
+            if self.disconnected:
+                return
+            if not self.response_started or self.response_complete:
+                raise RuntimeError(f"Unexpected ASGI message '{message['type']}'.")
+            if self.chunked_encoding:
+                raise RuntimeError("zerocopysend 需要响应头声明 Content-Length")
+            count = message["count"]
+            more_body = message.get("more_body", False)
+            if self.scope["method"] == "HEAD":
+                self.expected_content_length = 0
+            else:
+                if count > self.expected_content_length:
+                    raise RuntimeError("Response content longer than Content-Length")
+                sent = 0
+                try:
+                    sent = await sendfile_to_transport(
+                        self.transport, self.flow, message["file"], message.get("offset", 0), count)
+                except OSError:
+                    pass
+                if sent != count:
+                    # 对端断开或文件被截断：响应已无法按 Content-Length 完成，只能断开连接
+                    self.transport.close()
+                    return
+                self.expected_content_length -= count
+            if not more_body:
+                if self.expected_content_length != 0:
+                    raise RuntimeError("Response content shorter than Content-Length")
+                self.response_complete = True
+                self.message_event.set()
+                if not self.keep_alive:
+                    self.transport.close()
+                self.on_response()
+
+    class ZeroCopyHttpProtocol(HttpToolsProtocol):
+        """声明 http.response.zerocopysend 扩展的 uvicorn HTTP 协议，经 uvicorn.run(http=...) 启用。"""
+
+        def on_message_begin(self) -> None:
+            super().on_message_begin()
+            self.scope["extensions"] = {"http.response.zerocopysend": {}}
+
+        def on_headers_complete(self) -> None:
+            super().on_headers_complete()
+            if type(self.cycle) is RequestResponseCycle:
+                # run_asgi 任务此时尚未开始执行，替换类即可让其 send 支持零拷贝消息
+                self.cycle.__class__ = ZeroCopyResponseCycle
+else:
+    ZeroCopyHttpProtocol = None
+
 # --- Routes ---
 
 @app.websocket("/ws")
@@ -183,30 +1975,142 @@ async def save_notice_file(request: Request):
     
     try:
         os.makedirs(upload_dir, exist_ok=True)
-        async with aiofiles.open(save_path, 'w', encoding='utf-8') as f:
-            await f.write(content)
+        # 写临时文件后原子替换：同名文件可能正被映射下载，原地截断会让读取方触发 SIGBUS
+        data = content.encode("utf-8")
+        tmp_path, _, digest = await receive_to_temp(iter_bytes(data), upload_dir, len(data))
+        await publish_upload(tmp_path, save_path, digest)
         return {"status": "ok", "filename": filename}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to save notice: {str(e)}")
 
+@app.get("/stats/cache")
+async def cache_stats():
+    return FILE_CACHE.stats()
+
+@app.get("/stats/mmap")
+async def mmap_stats():
+    return MMAP_POOL.stats()
+
+@app.get("/stats/stat")
+async def stat_cache_stats():
+    return STAT_CACHE.stats()
+
+@app.get("/stats/compress")
+async def compress_stats():
+    return COMPRESSOR.stats()
+
+@app.get("/stats/buffers")
+async def buffer_stats():
+    return BUFFER_POOL.stats()
+
+@app.get("/stats/uploads")
+async def upload_stats():
+    return UPLOAD_METER.stats()
+
+@app.get("/stats/fsync")
+async def fsync_stats():
+    return FSYNC_BATCHER.stats()
+
+@app.get("/stats/ratelimit")
+async def ratelimit_stats():
+    return BANDWIDTH.stats()
+
+@app.get("/config/ratelimit")
+async def get_ratelimit_config():
+    return BANDWIDTH.config()
+
+@app.put("/config/ratelimit")
+async def update_ratelimit_config(request: Request):
+    """运行时调整限速：global_bps / client_bps 为 null 表示不限，其余为正数"""
+    data = await request.json()
+    options = {}
+    for key in ("global_bps", "client_bps", "burst_seconds", "small_transfer", "small_weight"):
+        if key not in data:
+            continue
+        value = data[key]
+        if value is None and key in ("global_bps", "client_bps"):
+            options[key] = None
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+            raise HTTPException(status_code=400, detail=f"参数非法: {key}")
+        options[key] = value
+    BANDWIDTH.configure(**options)
+    return BANDWIDTH.config()
+
+@app.get("/stats/admission")
+async def admission_stats():
+    return {name: gate.stats() for name, gate in ADMISSION.items()}
+
+@app.get("/config/admission")
+async def get_admission_config():
+    return {name: gate.config() for name, gate in ADMISSION.items()}
+
+@app.put("/config/admission")
+async def update_admission_config(request: Request):
+    """运行时调整准入：{"merge": {"limit": 4, "max_queue": 16, "timeout": 10}, ...}"""
+    data = await request.json()
+    updates = {}
+    for name, options in data.items():
+        if name not in ADMISSION or not isinstance(options, dict):
+            raise HTTPException(status_code=400, detail=f"未知类别: {name}")
+        for key, value in options.items():
+            minimum = 1 if key == "limit" else 0
+            if key not in ("limit", "max_queue", "timeout") or isinstance(value, bool) \
+                    or not isinstance(value, (int, float)) or value < minimum:
+                raise HTTPException(status_code=400, detail=f"参数非法: {name}.{key}")
+        updates[name] = options
+    for name, options in updates.items():
+        ADMISSION[name].configure(**options)
+    return {name: gate.config() for name, gate in ADMISSION.items()}
+
+@app.get("/stats/staging")
+async def staging_stats():
+    return STAGING.stats()
+
+@app.get("/stats/loop")
+async def loop_stats():
+    return LOOP_LAG.stats()
+
+@app.get("/stats/hashes")
+async def hash_stats():
+    return HASH_INDEXER.stats()
+
+@app.get("/stats/blobs")
+async def blob_stats():
+    return BLOB_STORE.stats()
+
+@app.get("/api/files")
+async def list_files_api(
+    request: Request,
+    sort: str = Query("time", enum=["time", "ext", "size", "name"]),
+    limit: int = Query(100, ge=1, le=FILE_LIST_PAGE_MAX),
+    cursor: Optional[str] = None,
+    q: Optional[str] = None,
+    ext: Optional[str] = None,
+):
+    upload_dir = getattr(request.app.state, "upload_dir", get_upload_dir())
+    if not FILE_INDEX.loaded(upload_dir):
+        await run_blocking(FILE_INDEX.load, upload_dir)
+    after = decode_cursor(cursor, sort) if cursor else None
+    if ext:
+        ext = ext.lower() if ext.startswith(".") else "." + ext.lower()
+    items, next_key = FILE_INDEX.page(sort, limit, after=after, q=q, ext=ext)
+    return {
+        "items": [e.to_dict() for e in items],
+        "next_cursor": encode_cursor(next_key) if next_key is not None else None,
+        "total": len(FILE_INDEX),
+    }
+
 @app.get("/")
 async def homepage(request: Request, sort: str = Query("time", enum=["time", "ext"])):
     # 获取文件列表
-    files_list = []
+    # 首屏条目来自内存目录索引：按扩展名 (A-Z) 或按时间 (最新在前)
     upload_dir = getattr(request.app.state, "upload_dir", get_upload_dir())
-    if os.path.exists(upload_dir):
-        try:
-            raw_files = [f for f in os.listdir(upload_dir) if not f.startswith('.')]
-            
-            if sort == 'ext':
-                # 按扩展名排序 (A-Z)
-                raw_files.sort(key=lambda x: (os.path.splitext(x)[1].lower(), x))
-            else:
-                raw_files.sort(key=lambda x: os.path.getmtime(os.path.join(upload_dir, x)), reverse=True)
-                
-            files_list = raw_files
-        except Exception:
-            files_list = []
+    if not FILE_INDEX.loaded(upload_dir):
+        await run_blocking(FILE_INDEX.load, upload_dir)
+    sort_key = "ext" if sort == "ext" else "time"
+    first_page, next_key = FILE_INDEX.page(sort_key, HOMEPAGE_PAGE_SIZE)
+    files_list = [e.name for e in first_page]
 
     # 构建HTML
     html = """
@@ -328,13 +2232,129 @@ async def homepage(request: Request, sort: str = Query("time", enum=["time", "ex
                 padding-bottom: 0;
             }
         </style>
+        <script type="text/js-worker" id="sha256-worker">
+            // 增量 SHA-256：按 file.slice 窗口读取并逐块更新，内存占用与文件大小无关
+            const K = new Uint32Array([
+                0x428a2f98, 0x71374491, 0xb5c0fbcf, 0xe9b5dba5, 0x3956c25b, 0x59f111f1, 0x923f82a4, 0xab1c5ed5,
+                0xd807aa98, 0x12835b01, 0x243185be, 0x550c7dc3, 0x72be5d74, 0x80deb1fe, 0x9bdc06a7, 0xc19bf174,
+                0xe49b69c1, 0xefbe4786, 0x0fc19dc6, 0x240ca1cc, 0x2de92c6f, 0x4a7484aa, 0x5cb0a9dc, 0x76f988da,
+                0x983e5152, 0xa831c66d, 0xb00327c8, 0xbf597fc7, 0xc6e00bf3, 0xd5a79147, 0x06ca6351, 0x14292967,
+                0x27b70a85, 0x2e1b2138, 0x4d2c6dfc, 0x53380d13, 0x650a7354, 0x766a0abb, 0x81c2c92e, 0x92722c85,
+                0xa2bfe8a1, 0xa81a664b, 0xc24b8b70, 0xc76c51a3, 0xd192e819, 0xd6990624, 0xf40e3585, 0x106aa070,
+                0x19a4c116, 0x1e376c08, 0x2748774c, 0x34b0bcb5, 0x391c0cb3, 0x4ed8aa4a, 0x5b9cca4f, 0x682e6ff3,
+                0x748f82ee, 0x78a5636f, 0x84c87814, 0x8cc70208, 0x90befffa, 0xa4506ceb, 0xbef9a3f7, 0xc67178f2
+            ]);
+            class Sha256 {
+                constructor() {
+                    this.h = new Uint32Array([0x6a09e667, 0xbb67ae85, 0x3c6ef372, 0xa54ff53a, 0x510e527f, 0x9b05688c, 0x1f83d9ab, 0x5be0cd19]);
+                    this.w = new Uint32Array(64);
+                    this.block = new Uint8Array(64);
+                    this.blockLen = 0;
+                    this.bytes = 0;
+                }
+                compress(buf, off) {
+                    const w = this.w, h = this.h;
+                    for (let i = 0; i < 16; i++, off += 4) {
+                        w[i] = (buf[off] << 24) | (buf[off + 1] << 16) | (buf[off + 2] << 8) | buf[off + 3];
+                    }
+                    for (let i = 16; i < 64; i++) {
+                        const x = w[i - 15], y = w[i - 2];
+                        const s0 = ((x >>> 7) | (x << 25)) ^ ((x >>> 18) | (x << 14)) ^ (x >>> 3);
+                        const s1 = ((y >>> 17) | (y << 15)) ^ ((y >>> 19) | (y << 13)) ^ (y >>> 10);
+                        w[i] = (w[i - 16] + s0 + w[i - 7] + s1) | 0;
+                    }
+                    let a = h[0], b = h[1], c = h[2], d = h[3], e = h[4], f = h[5], g = h[6], k = h[7];
+                    for (let i = 0; i < 64; i++) {
+                        const S1 = ((e >>> 6) | (e << 26)) ^ ((e >>> 11) | (e << 21)) ^ ((e >>> 25) | (e << 7));
+                        const t1 = (k + S1 + ((e & f) ^ (~e & g)) + K[i] + w[i]) | 0;
+                        const S0 = ((a >>> 2) | (a << 30)) ^ ((a >>> 13) | (a << 19)) ^ ((a >>> 22) | (a << 10));
+                        const t2 = (S0 + ((a & b) ^ (a & c) ^ (b & c))) | 0;
+                        k = g; g = f; f = e; e = (d + t1) | 0;
+                        d = c; c = b; b = a; a = (t1 + t2) | 0;
+                    }
+                    h[0] += a; h[1] += b; h[2] += c; h[3] += d;
+                    h[4] += e; h[5] += f; h[6] += g; h[7] += k;
+                }
+                update(data) {
+                    let off = 0;
+                    this.bytes += data.length;
+                    if (this.blockLen) {
+                        off = Math.min(64 - this.blockLen, data.length);
+                        this.block.set(data.subarray(0, off), this.blockLen);
+                        this.blockLen += off;
+                        if (this.blockLen < 64) return;
+                        this.compress(this.block, 0);
+                        this.blockLen = 0;
+                    }
+                    for (; off + 64 <= data.length; off += 64) this.compress(data, off);
+                    if (off < data.length) {
+                        this.block.set(data.subarray(off), 0);
+                        this.blockLen = data.length - off;
+                    }
+                }
+                hex() {
+                    const bits = this.bytes * 8;
+                    const pad = new Uint8Array((this.blockLen < 56 ? 64 : 128) - this.blockLen);
+                    const n = pad.length;
+                    pad[0] = 0x80;
+                    const hi = Math.floor(bits / 0x100000000), lo = bits >>> 0;
+                    for (let i = 0; i < 4; i++) {
+                        pad[n - 8 + i] = (hi >>> (24 - 8 * i)) & 0xff;
+                        pad[n - 4 + i] = (lo >>> (24 - 8 * i)) & 0xff;
+                    }
+                    this.update(pad);
+                    return Array.from(this.h, x => x.toString(16).padStart(8, '0')).join('');
+                }
+            }
+            self.onmessage = async (event) => {
+                const { file, windowSize } = event.data;
+                const hasher = new Sha256();
+                for (let off = 0; off < file.size; off += windowSize) {
+                    const end = Math.min(off + windowSize, file.size);
+                    hasher.update(new Uint8Array(await file.slice(off, end).arrayBuffer()));
+                    self.postMessage({ done: end, total: file.size });
+                }
+                self.postMessage({ hash: hasher.hex() });
+            };
+        </script>
         <script>
             const CHUNK_SIZE_BROWSER = 10 * 1024 * 1024; // 浏览器分片上传大小 10MB
-            async function sha256Hex(file) {
-                const buf = await file.arrayBuffer();
-                const digest = await crypto.subtle.digest("SHA-256", buf);
-                const arr = Array.from(new Uint8Array(digest));
-                return arr.map(b => b.toString(16).padStart(2, "0")).join("");
+            const UPLOAD_WINDOW_MAX = {upload_window_max}; // 并发分片窗口上限（与服务端每会话写入上限一致）
+            const UPLOAD_WINDOW_INIT = 2; // 初始并发分片数
+            const UPLOAD_RETRY_LIMIT = 5; // 单个分片最多尝试次数
+            const UPLOAD_BACKOFF_BASE_MS = 500; // 重试退避基数，按 2^n 增长并加随机抖动
+            const HASH_WINDOW_BROWSER = 8 * 1024 * 1024; // Web Worker 增量哈希每次读取的窗口大小
+            function decodeChunkBitmap(b64, total) {
+                // 服务端分片位图：第 i 个分片对应第 i>>3 字节的第 (i&7) 位
+                const bin = atob(b64 || '');
+                const done = new Set();
+                for (let i = 0; i < total; i++) {
+                    const byte = i >> 3;
+                    if (byte < bin.length && (bin.charCodeAt(byte) >> (i & 7)) & 1) done.add(i);
+                }
+                return done;
+            }
+            function sha256InWorker(file) {
+                const src = document.getElementById('sha256-worker').textContent;
+                const url = URL.createObjectURL(new Blob([src], { type: 'text/javascript' }));
+                const worker = new Worker(url);
+                const cleanup = () => {
+                    worker.terminate();
+                    URL.revokeObjectURL(url);
+                };
+                return new Promise((resolve, reject) => {
+                    worker.onmessage = (event) => {
+                        if (event.data.hash) {
+                            cleanup();
+                            resolve(event.data.hash);
+                        }
+                    };
+                    worker.onerror = (err) => {
+                        cleanup();
+                        reject(err);
+                    };
+                    worker.postMessage({ file, windowSize: HASH_WINDOW_BROWSER });
+                });
             }
             async function deleteFile(filename) {
                 if (!confirm(`确定要删除 ${filename} 吗？`)) return;
@@ -391,12 +2411,14 @@ async def homepage(request: Request, sort: str = Query("time", enum=["time", "ex
                 const chunkSize = CHUNK_SIZE_BROWSER;
                 const totalChunks = Math.ceil(size / chunkSize);
                 const hashAlgo = "sha256";
-                const hash = await sha256Hex(file);
-                // 初始化会话（包含秒传判定）
+                // 哈希在 Web Worker 中与分片上传并行计算，整体哈希在 complete 时提交
+                const hashPromise = sha256InWorker(file);
+                const fingerprint = String(file.lastModified);
+                // 初始化会话（哈希未就绪，以 文件名 + 大小 + 修改时间 标识会话，便于续传）
                 let resp = await fetch('/upload/init', {
                     method: 'POST',
                     headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ filename, size, hash_algo: hashAlgo, hash, chunk_size: chunkSize, total_chunks: totalChunks })
+                    body: JSON.stringify({ filename, size, hash_algo: hashAlgo, fingerprint, chunk_size: chunkSize, total_chunks: totalChunks, status_format: 'bitmap' })
                 });
                 if (!resp.ok) {
                     const t = await resp.text();
@@ -410,25 +2432,105 @@ async def homepage(request: Request, sort: str = Query("time", enum=["time", "ex
                     return;
                 }
                 const uploadId = info.upload_id;
-                const uploaded = new Set(info.uploaded || []);
-                // 上传缺失分片（带简单重试）
+                const uploaded = decodeChunkBitmap(info.uploaded_bitmap, totalChunks);
+                // 哈希就绪后探测秒传，命中则停止派发剩余分片
+                let skippedUrl = null;
+                const probePromise = hashPromise.then(async hash => {
+                    const r = await fetch('/upload/init', {
+                        method: 'POST',
+                        headers: { 'Content-Type': 'application/json' },
+                        body: JSON.stringify({ filename, size, hash_algo: hashAlgo, hash, probe: true })
+                    });
+                    if (r.ok) {
+                        const p = await r.json();
+                        if (p.skip) skippedUrl = p.url;
+                    }
+                }).catch(() => {});
+                const pending = [];
                 for (let i = 0; i < totalChunks; i++) {
-                    if (uploaded.has(i)) continue;
-                    const start = i * chunkSize;
-                    const end = Math.min(start + chunkSize, size);
-                    const blob = file.slice(start, end);
-                    let ok = false;
-                    for (let attempt = 0; attempt < 3 && !ok; attempt++) {
-                        const r = await fetch(`/upload/chunk/${encodeURIComponent(uploadId)}/${i}`, {
-                            method: 'PUT',
-                            body: await blob.arrayBuffer(),
-                        });
-                        ok = r.status === 201;
+                    if (!uploaded.has(i)) pending.push(i);
+                }
+                // 并发窗口：按实测吞吐自适应增减，分片失败指数退避重试（429 时遵循 Retry-After 并收缩窗口）
+                let windowSize = Math.min(UPLOAD_WINDOW_INIT, UPLOAD_WINDOW_MAX);
+                let bestRate = 0;
+                let sampleBytes = 0;
+                let sampleStart = performance.now();
+                let sampleCount = 0;
+                const sleep = ms => new Promise(r => setTimeout(r, ms));
+                function adaptWindow(bytes) {
+                    sampleBytes += bytes;
+                    sampleCount++;
+                    if (sampleCount < windowSize) return;
+                    const rate = sampleBytes / Math.max(performance.now() - sampleStart, 1);
+                    if (rate > bestRate * 1.1) {
+                        bestRate = rate;
+                        windowSize = Math.min(windowSize + 1, UPLOAD_WINDOW_MAX);
+                    } else if (rate < bestRate * 0.8) {
+                        windowSize = Math.max(windowSize - 1, 1);
                     }
-                    if (!ok) {
-                        alert('分片上传失败，无法完成：' + i);
-                        return;
+                    sampleBytes = 0;
+                    sampleCount = 0;
+                    sampleStart = performance.now();
+                }
+                async function sendChunk(i) {
+                    const start = i * chunkSize;
+                    const body = await file.slice(start, Math.min(start + chunkSize, size)).arrayBuffer();
+                    for (let attempt = 0; attempt < UPLOAD_RETRY_LIMIT; attempt++) {
+                        let r = null;
+                        try {
+                            r = await fetch(`/upload/chunk/${encodeURIComponent(uploadId)}/${i}`, { method: 'PUT', body });
+                        } catch (e) {
+                            r = null;
+                        }
+                        if (r && r.status === 201) return body.byteLength;
+                        let delay = UPLOAD_BACKOFF_BASE_MS * 2 ** attempt;
+                        if (r && r.status === 429) {
+                            const retryAfter = parseFloat(r.headers.get('Retry-After'));
+                            if (retryAfter) delay = Math.max(delay, retryAfter * 1000);
+                            windowSize = Math.max(windowSize - 1, 1);
+                        }
+                        await sleep(delay + Math.random() * delay / 2);
                     }
+                    throw new Error('分片上传失败，无法完成：' + i);
+                }
+                try {
+                    await new Promise((resolve, reject) => {
+                        let next = 0, active = 0, done = 0, aborted = false;
+                        const pump = () => {
+                            if (aborted) return;
+                            if (done === pending.length || (skippedUrl && active === 0)) return resolve();
+                            while (!skippedUrl && active < windowSize && next < pending.length) {
+                                const i = pending[next++];
+                                active++;
+                                sendChunk(i).then(bytes => {
+                                    active--;
+                                    done++;
+                                    adaptWindow(bytes);
+                                    pump();
+                                }, err => {
+                                    aborted = true;
+                                    reject(err);
+                                });
+                            }
+                        };
+                        pump();
+                    });
+                } catch (e) {
+                    alert(e.message);
+                    return;
+                }
+                await probePromise;
+                if (skippedUrl) {
+                    alert('文件已存在，已秒传：' + skippedUrl);
+                    window.location.reload();
+                    return;
+                }
+                let hash;
+                try {
+                    hash = await hashPromise;
+                } catch (e) {
+                    alert('哈希计算失败: ' + e.message);
+                    return;
                 }
                 // 合并完成
                 const c = await fetch(`/upload/complete/${encodeURIComponent(uploadId)}`, {
@@ -508,6 +2610,68 @@ async def homepage(request: Request, sort: str = Query("time", enum=["time", "ex
                 }
             }
 
+            // 文件列表分页：哨兵元素进入视口时通过 /api/files 加载下一页
+            function renderFileItem(item) {
+                const li = document.createElement('li');
+                const link = document.createElement('a');
+                link.href = item.url;
+                link.target = '_blank';
+                link.textContent = item.name;
+                const actions = document.createElement('span');
+                actions.className = 'actions';
+                const download = document.createElement('a');
+                download.href = item.url;
+                download.setAttribute('download', '');
+                download.textContent = '下载';
+                const del = document.createElement('button');
+                del.className = 'btn-delete';
+                del.title = '删除';
+                del.textContent = '🗑️';
+                del.addEventListener('click', () => deleteFile(item.name));
+                actions.append(download, del);
+                li.append(link, ' ', actions);
+                return li;
+            }
+
+            async function loadMoreFiles() {
+                const more = document.getElementById('file-list-more');
+                if (!more || !more.dataset.cursor || more.dataset.loading) return;
+                more.dataset.loading = '1';
+                try {
+                    const params = new URLSearchParams({
+                        sort: more.dataset.sort,
+                        limit: more.dataset.limit,
+                        cursor: more.dataset.cursor,
+                    });
+                    const resp = await fetch(`/api/files?${params}`);
+                    if (!resp.ok) return;
+                    const data = await resp.json();
+                    const list = document.getElementById('file-list');
+                    for (const item of data.items) {
+                        list.appendChild(renderFileItem(item));
+                    }
+                    more.dataset.cursor = data.next_cursor || '';
+                } catch (e) {
+                    console.error('加载文件列表失败:', e);
+                    return;
+                } finally {
+                    delete more.dataset.loading;
+                }
+                // 加载后哨兵仍在视口内（页面未填满）时继续加载
+                if (more.dataset.cursor && more.getBoundingClientRect().top < window.innerHeight) {
+                    loadMoreFiles();
+                }
+            }
+
+            document.addEventListener('DOMContentLoaded', () => {
+                const more = document.getElementById('file-list-more');
+                if (more && 'IntersectionObserver' in window) {
+                    new IntersectionObserver((entries) => {
+                        if (entries.some(e => e.isIntersecting)) loadMoreFiles();
+                    }).observe(more);
+                }
+            });
+
             // Notice Board Logic
             document.addEventListener('DOMContentLoaded', () => {
                 const noticeArea = document.getElementById('notice-content');
@@ -629,21 +2793,28 @@ async def homepage(request: Request, sort: str = Query("time", enum=["time", "ex
             <a href="?sort=ext" class="{ext_active}">按扩展名 (A-Z)</a>
         </div>
 
-        <ul>
+        <ul id="file-list">
     """
     
     # 动态设置 active 类
     time_active = "active" if sort != 'ext' else ""
     ext_active = "active" if sort == 'ext' else ""
     html = html.replace("{time_active}", time_active).replace("{ext_active}", ext_active)
+    html = html.replace("{upload_window_max}", str(UPLOAD_SESSION_MAX_WRITERS))
     
     host = "obs.dimond.top"
-    if not files_list:
-        html += '<li class="empty">暂无文件</li>'
-    else:
-        for f in files_list:
-            file_url = f"http://{host}/{f}"
-            html += f'''
+    next_cursor = encode_cursor(next_key) if next_key is not None else ""
+
+    # 先发送页面框架（CSS/JS），再输出首屏条目；后续页由前端滚动加载
+    async def render():
+        yield html
+        if not files_list:
+            yield '<li class="empty">暂无文件</li>'
+        else:
+            items = []
+            for f in files_list:
+                file_url = f"http://{host}/{f}"
+                items.append(f'''
             <li>
                 <a href="{file_url}" target="_blank">{f}</a> 
                 <span class="actions">
@@ -651,28 +2822,642 @@ async def homepage(request: Request, sort: str = Query("time", enum=["time", "ex
                     <button class="btn-delete" onclick="deleteFile('{f}')" title="删除">🗑️</button>
                 </span>
             </li>
-            '''
-    
-    html += """
+            ''')
+            yield "".join(items)
+        yield f"""
         </ul>
+        <div id="file-list-more" data-sort="{sort_key}" data-limit="{HOMEPAGE_PAGE_SIZE}" data-cursor="{next_cursor}"></div>
     </body>
     </html>
     """
-    return HTMLResponse(content=html)
+    return StreamingResponse(render(), media_type="text/html; charset=utf-8")
 
 def make_upload_id(filename: str, size: int, hash_algo: str, file_hash: str) -> str:
     safe_name = filename.replace("/", "_")
     return f"{hash_algo}:{file_hash}:{size}:{safe_name}"
 
-def file_sha256(path: str) -> str:
-    h = hashlib.sha256()
-    with open(path, "rb") as f:
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(1024 * 1024)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+def chunk_digest_path(up_dir: str, index: int) -> str:
+    # 分片摘要与分片同目录存放：{index}.part 对应 {index}.sha256
+    return os.path.join(up_dir, f"{index}.sha256")
+
+def pwrite_all(fd: int, data, offset: int):
+    view = memoryview(data)
+    while view:
+        n = os.pwrite(fd, view, offset)
+        view = view[n:]
+        offset += n
+
+def update_hashes(data, *hashers):
+    for h in hashers:
+        if h is not None:
+            h.update(data)
+
+def hash_and_pwrite(fd: int, data, offset: int, *hashers):
+    # 在 FS_EXECUTOR 中对合并后的整块先哈希再写入：大块 update 释放 GIL，不占用事件循环
+    update_hashes(data, *hashers)
+    pwrite_all(fd, data, offset)
+
+def copy_file_range_all(in_fd: int, out_fd: int, count: int, offset_out: int):
+    done = 0
+    while done < count:
+        n = os.copy_file_range(in_fd, out_fd, count - done, done, offset_out + done)
+        if n == 0:
+            raise OSError("copy_file_range 提前结束")
+        done += n
+
+def list_uploaded_parts(up_dir: str) -> List[int]:
+    """一次目录扫描列出已改名落盘的分片序号（在工作线程中执行）"""
+    uploaded = []
+    try:
+        with os.scandir(up_dir) as it:
+            for item in it:
+                if item.name.endswith(".part"):
+                    try:
+                        uploaded.append(int(item.name[:-5]))
+                    except ValueError:
+                        pass
+    except OSError:
+        pass
+    return sorted(uploaded)
+
+def merge_parts(up_dir: str, total_chunks: int, out_path: str) -> Tuple[int, str]:
+    """
+    顺序合并分片到 out_path，并在同一次读取中计算整体 sha256。
+    支持 copy_file_range 时数据由内核复制（可 reflink），读取仅用于哈希。
+    在工作线程中执行，返回 (合并后大小, sha256)。
+    """
+    h = hashlib.sha256()
+    size = 0
+    buf = bytearray(MERGE_READ_SIZE)
+    view = memoryview(buf)
+    use_cfr = MERGE_COPY_FILE_RANGE and hasattr(os, "copy_file_range")
+    out_fd = os.open(out_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        for i in range(total_chunks):
+            with open(os.path.join(up_dir, f"{i}.part"), "rb") as inp:
+                copied = False
+                if use_cfr:
+                    try:
+                        copy_file_range_all(inp.fileno(), out_fd, os.fstat(inp.fileno()).st_size, size)
+                        copied = True
+                    except OSError:
+                        use_cfr = False
+                while True:
+                    n = inp.readinto(buf)
+                    if not n:
+                        break
+                    h.update(view[:n])
+                    if not copied:
+                        pwrite_all(out_fd, view[:n], size)
+                    size += n
+        os.ftruncate(out_fd, size)
+    finally:
+        os.close(out_fd)
+    return size, h.hexdigest()
+
+def session_meta_path(up_dir: str) -> str:
+    return os.path.join(up_dir, "session.json")
+
+def load_upload_session(up_dir: str) -> Optional[dict]:
+    try:
+        with open(session_meta_path(up_dir), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_upload_session(up_dir: str, session: dict):
+    # 同一会话的并发分片会在 FS_EXECUTOR 中同时保存：临时名各自独立，避免互相 replace 掉对方的文件
+    tmp = f"{session_meta_path(up_dir)}.{secrets.token_hex(8)}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(session, f)
+    os.replace(tmp, session_meta_path(up_dir))
+
+def assembly_path(up_dir: str) -> str:
+    return os.path.join(up_dir, "__assembly.tmp")
+
+def bitmap_path(up_dir: str) -> str:
+    return os.path.join(up_dir, "chunks.bitmap")
+
+# 位图单字节读改写在 FS_EXECUTOR 中执行：同一字节上的并发分片用锁串行，避免丢失置位
+BITMAP_LOCK = threading.Lock()
+
+def bitmap_set(up_dir: str, index: int, done: bool):
+    # 每个分片 1 bit（在工作线程中执行）
+    with BITMAP_LOCK:
+        fd = os.open(bitmap_path(up_dir), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            pos = index // 8
+            cur = os.pread(fd, 1, pos)
+            byte = cur[0] if cur else 0
+            mask = 1 << (index % 8)
+            byte = (byte | mask) if done else (byte & ~mask)
+            os.pwrite(fd, bytes([byte]), pos)
+        finally:
+            os.close(fd)
+
+def read_bitmap(up_dir: str) -> bytes:
+    try:
+        with open(bitmap_path(up_dir), "rb") as f:
+            return f.read()
+    except OSError:
+        return b""
+
+def bitmap_status(up_dir: str, session: dict) -> dict:
+    """分片状态的紧凑表示：位图按字节 base64 编码，第 i 个分片对应第 i//8 字节的第 i%8 位（低位在前）"""
+    bits = read_bitmap(up_dir)
+    total = session.get("total_chunks") or len(bits) * 8
+    bits = bits[:(total + 7) // 8]
+    return {
+        "uploaded_bitmap": base64.b64encode(bits).decode("ascii"),
+        "uploaded_count": int.from_bytes(bits, "little").bit_count(),
+    }
+
+def bitmap_indices(up_dir: str, total_chunks: Optional[int] = None) -> List[int]:
+    bits = read_bitmap(up_dir)
+    if not total_chunks:
+        total_chunks = len(bits) * 8
+    return [i for i in range(total_chunks) if i // 8 < len(bits) and bits[i // 8] >> (i % 8) & 1]
+
+def create_upload_session(up_dir: str, session: dict, uploaded: Optional[List[int]] = None) -> dict:
+    """
+    写入会话清单 session.json 与已接收分片位图 chunks.bitmap；inplace 模式同时预分配目标临时文件。
+    uploaded 用于迁移没有清单的旧会话（在工作线程中执行）。
+    """
+    if session["assembly"] == "inplace":
+        fd = os.open(assembly_path(up_dir), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            try:
+                os.posix_fallocate(fd, 0, session["size"])
+            except (AttributeError, OSError) as e:
+                if getattr(e, "errno", None) == errno.ENOSPC:
+                    raise
+                os.ftruncate(fd, session["size"])
+        finally:
+            os.close(fd)
+    bits = bytearray((session["total_chunks"] + 7) // 8)
+    for i in uploaded or []:
+        if i // 8 >= len(bits):
+            bits.extend(bytes(i // 8 + 1 - len(bits)))
+        bits[i // 8] |= 1 << (i % 8)
+    with open(bitmap_path(up_dir), "wb") as f:
+        f.write(bits)
+    save_upload_session(up_dir, session)
+    return session
+
+def new_session_manifest(filename: str, size: int, chunk_size: int, total_chunks: int, assembly: str) -> dict:
+    now = time.time()
+    return {
+        "assembly": assembly,
+        "filename": filename,
+        "size": size,
+        "chunk_size": chunk_size,
+        "total_chunks": total_chunks,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+def touch_upload_session(up_dir: str, session: dict):
+    # 记录最后活动时间，供 STAGING 判断闲置过期
+    session["updated_at"] = time.time()
+    save_upload_session(up_dir, session)
+
+class StagingSweeper:
+    """
+    .chunks 暂存区巡检：删除闲置超过 UPLOAD_SESSION_TTL_SECONDS 的会话；
+    暂存总量超过 STAGING_MAX_BYTES 时按最后活动时间淘汰闲置会话；并统计暂存占用。
+    """
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.lock = threading.Lock()
+        # bytes 由事件循环（预留/释放）与巡检线程（校准）共同修改，只在 bytes_lock 内读改写
+        # pending 为已预留、会话目录尚未建好的字节，巡检校准时补回，避免被磁盘统计覆盖
+        self.bytes_lock = threading.Lock()
+        self.bytes = 0
+        self.pending = 0
+        self.sessions = 0
+        self.expired = 0
+        self.evicted = 0
+        self.last_sweep = None
+
+    @staticmethod
+    def scan(chunk_dir: str) -> List[tuple]:
+        """返回 [(会话目录, 最后活动时间, 占用字节)]，占用按实际分配的块计算"""
+        sessions = []
+        try:
+            with os.scandir(chunk_dir) as it:
+                entries = [e for e in it if e.is_dir()]
+        except FileNotFoundError:
+            return sessions
+        for entry in entries:
+            manifest = load_upload_session(entry.path) or {}
+            used = 0
+            latest = 0.0
+            try:
+                with os.scandir(entry.path) as files:
+                    for item in files:
+                        try:
+                            st = item.stat()
+                        except OSError:
+                            continue
+                        used += st.st_blocks * 512
+                        latest = max(latest, st.st_mtime)
+                latest = max(latest, entry.stat().st_mtime)
+            except OSError:
+                continue
+            sessions.append((entry.path, manifest.get("updated_at", latest), used))
+        return sessions
+
+    @staticmethod
+    def busy(path: str, updated_at: float, now: float) -> bool:
+        upload_id = os.path.basename(path)
+        return upload_id in SESSION_WRITERS.active or now - updated_at < STAGING_EVICT_GRACE_SECONDS
+
+    def drop(self, path: str):
+        shutil.rmtree(path, ignore_errors=True)
+        INPLACE_HASH_STATE.pop(os.path.basename(path), None)
+
+    def sweep(self, chunk_dir: str, need_bytes: int = 0) -> int:
+        """执行一次巡检，返回剩余暂存字节数（在 FS_EXECUTOR 中执行）"""
+        with self.lock:
+            now = time.time()
+            remaining = []
+            for path, updated_at, used in self.scan(chunk_dir):
+                if now - updated_at > UPLOAD_SESSION_TTL_SECONDS and os.path.basename(path) not in SESSION_WRITERS.active:
+                    self.drop(path)
+                    self.expired += 1
+                else:
+                    remaining.append((path, updated_at, used))
+            total = sum(used for _, _, used in remaining)
+            if total + need_bytes > STAGING_MAX_BYTES:
+                # 超出上限：从最久未活动的会话开始淘汰，正在写入或刚活动过的会话保留
+                for path, updated_at, used in sorted(remaining, key=lambda x: x[1]):
+                    if total + need_bytes <= STAGING_MAX_BYTES:
+                        break
+                    if self.busy(path, updated_at, now):
+                        continue
+                    self.drop(path)
+                    self.evicted += 1
+                    total -= used
+                    remaining.remove((path, updated_at, used))
+            with self.bytes_lock:
+                self.bytes = total + self.pending
+            self.sessions = len(remaining)
+            self.last_sweep = now
+            return total
+
+    def reserve(self, size: int) -> bool:
+        """检查上限并记入占用，检查与计入在同一步完成；成功后须调用 commit 或 cancel"""
+        with self.bytes_lock:
+            if self.bytes + size > STAGING_MAX_BYTES:
+                return False
+            self.bytes += size
+            self.pending += size
+            return True
+
+    async def admit(self, chunk_dir: str, size: int) -> bool:
+        # 超出上限时先巡检淘汰闲置会话，再重试一次预留
+        if self.reserve(size):
+            return True
+        await run_blocking(self.sweep, chunk_dir, size)
+        return self.reserve(size)
+
+    def commit(self, size: int):
+        # 会话已落盘：此后由巡检的磁盘统计覆盖
+        with self.bytes_lock:
+            self.pending = max(self.pending - size, 0)
+
+    def cancel(self, size: int):
+        with self.bytes_lock:
+            self.pending = max(self.pending - size, 0)
+            self.bytes = max(self.bytes - size, 0)
+
+    def release(self, size: int):
+        with self.bytes_lock:
+            self.bytes = max(self.bytes - size, 0)
+
+    async def run(self, chunk_dir: str, interval: float):
+        while True:
+            try:
+                await run_blocking(self.sweep, chunk_dir)
+            except Exception as e:
+                print(f"Staging sweep failed: {e}", flush=True)
+            await asyncio.sleep(interval)
+
+    def start(self, chunk_dir: str):
+        self.task = asyncio.create_task(self.run(chunk_dir, STAGING_SWEEP_SECONDS))
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def stats(self) -> dict:
+        return {
+            "sessions": self.sessions,
+            "bytes": self.bytes,
+            "max_bytes": STAGING_MAX_BYTES,
+            "expired": self.expired,
+            "evicted": self.evicted,
+            "last_sweep": self.last_sweep,
+        }
+
+STAGING = StagingSweeper()
+
+# 原位组装的顺序哈希状态：{upload_id: [下一个待哈希分片序号, sha256 对象, 已完成但尚未计入的分片序号集合, 是否正在补算]}
+# 分片按序到达时边写边哈希；并发窗口下乱序到达的分片先记入集合，空缺补齐后由 catch_up_inplace_hash
+# 在工作线程中从磁盘补算，完成时只需补读仍未覆盖的尾部；进程重启后丢失则完成时整体重读
+# tus 会话以字节为单位（分片大小视为 1），记录 [已哈希到的偏移, sha256 对象]
+# 使用位置：upload_chunk 原位组装分支与 tus_patch 更新；upload_complete 与 finish_tus_upload 取出
+INPLACE_HASH_STATE = {}
+
+async def run_finish_hash(path: str, state: Optional[list], chunk_size: int) -> str:
+    """补算组装文件的 sha256：经哈希执行器执行；sha256 对象不可 pickle，进程池模式下带顺序哈希状态时在 FS_EXECUTOR 续算"""
+    if state is not None and HASH_EXECUTOR_MODE == "process":
+        return await run_blocking(finish_inplace_hash, path, state, chunk_size)
+    return await run_hashing(finish_inplace_hash, path, state, chunk_size)
+
+def finish_inplace_hash(path: str, state: Optional[list], chunk_size: int) -> str:
+    next_index, h = (state[0], state[1]) if state else (0, hashlib.sha256())
+    h = h.copy()
+    buf = bytearray(MERGE_READ_SIZE)
+    view = memoryview(buf)
+    with open(path, "rb") as f:
+        f.seek(next_index * chunk_size)
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            h.update(view[:n])
+    return h.hexdigest()
+
+def hash_file_range(path: str, h, offset: int, length: int):
+    """把文件 [offset, offset+length) 的内容追加进 h（在工作线程中执行）"""
+    buf = bytearray(MERGE_READ_SIZE)
+    view = memoryview(buf)
+    with open(path, "rb") as f:
+        f.seek(offset)
+        while length > 0:
+            n = f.readinto(view[:min(len(buf), length)])
+            if not n:
+                raise OSError("组装文件提前结束")
+            h.update(view[:n])
+            length -= n
+
+async def catch_up_inplace_hash(upload_id: str, up_dir: str, session: dict):
+    """
+    空缺分片到齐后，从磁盘补算其后已完成的连续分片，让顺序哈希继续前进。
+    同一会话同时只有一个补算协程，它循环到没有可补的分片为止；补算期间新分片不做流内顺序哈希。
+    """
+    state = INPLACE_HASH_STATE.get(upload_id)
+    if state is None or state[3]:
+        return
+    state[3] = True
+    try:
+        while INPLACE_HASH_STATE.get(upload_id) is state:
+            start = end = state[0]
+            while end in state[2]:
+                state[2].discard(end)
+                end += 1
+            if end == start:
+                return
+            # 先推进序号再读盘：补算区间内的分片若被重写，按“已计入哈希”处理，状态随之作废
+            state[0] = end
+            h = state[1].copy()
+            offset = start * session["chunk_size"]
+            length = min(end * session["chunk_size"], session["size"]) - offset
+            # sha256 对象不可 pickle：进程池模式下在 FS_EXECUTOR 中补算
+            runner = run_blocking if HASH_EXECUTOR_MODE == "process" else run_hashing
+            await runner(hash_file_range, assembly_path(up_dir), h, offset, length)
+            if INPLACE_HASH_STATE.get(upload_id) is state:
+                state[1] = h
+    finally:
+        state[3] = False
+
+# 已知文件 sha256：{绝对路径: ((st_ino, st_size, st_mtime_ns), sha256, at_publish)}，stat 变化即视为失效
+# at_publish 表示哈希在发布该版本时即已确定（上传路径），HASH_INDEXER 事后补齐的为 False
+# 持久化为旁路文件 .sidecars/{name}.sha256（内容: "ino size mtime_ns sha256 publish|index"），重启后按需读回
+# 使用位置：各上传路径写入时写入；HASH_INDEXER 后台补齐；upload_init 秒传与 file_etag 读取；delete_file 清除
+KNOWN_FILE_HASHES = {}
+
+def stat_key(st: os.stat_result) -> tuple:
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+def hash_sidecar_path(path: str) -> str:
+    directory, name = os.path.split(path)
+    return os.path.join(directory, SIDECAR_DIR, f"{name}.sha256")
+
+def legacy_hash_sidecar_path(path: str) -> str:
+    # 旧版本放在上传目录顶层的 .{name}.sha256：仍可读回，新记录写入或文件删除时清除
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f".{name}.sha256")
+
+def remember_file_hash(path: str, digest: str, st: os.stat_result, at_publish: bool = True):
+    """记录 path 的 sha256；st 必须是写入该内容的那个 inode 的 stat（发布前取得），不能事后再 stat 路径"""
+    KNOWN_FILE_HASHES[os.path.abspath(path)] = (stat_key(st), digest, at_publish)
+    sidecar = hash_sidecar_path(path)
+    tmp = sidecar + ".tmp"
+    try:
+        os.makedirs(os.path.dirname(sidecar), exist_ok=True)
+        with open(tmp, "w", encoding="utf-8") as f:
+            source = "publish" if at_publish else "index"
+            f.write(f"{st.st_ino} {st.st_size} {st.st_mtime_ns} {digest} {source}\n")
+        os.replace(tmp, sidecar)
+    except OSError:
+        pass
+    try:
+        os.remove(legacy_hash_sidecar_path(path))
+    except OSError:
+        pass
+
+def read_hash_sidecar(path: str, st: os.stat_result) -> Optional[Tuple[str, bool]]:
+    for sidecar in (hash_sidecar_path(path), legacy_hash_sidecar_path(path)):
+        try:
+            with open(sidecar, "r", encoding="utf-8") as f:
+                fields = f.read().split()
+            # 旧格式没有来源字段，按事后补齐处理
+            ino, size, mtime_ns, digest = fields[:4]
+            source = fields[4] if len(fields) > 4 else "index"
+            if (int(ino), int(size), int(mtime_ns)) == stat_key(st):
+                return digest, source == "publish"
+        except (OSError, ValueError):
+            pass
+    return None
+
+def file_hash_entry(path: str, st: os.stat_result) -> Optional[Tuple[str, bool]]:
+    """返回 (sha256, at_publish)；内容寻址存储中的文件入库时即已知哈希"""
+    key = os.path.abspath(path)
+    entry = KNOWN_FILE_HASHES.get(key)
+    if entry and entry[0] == stat_key(st):
+        return entry[1], entry[2]
+    digest = BLOB_STORE.digest_for(st)
+    found = (digest, True) if digest else read_hash_sidecar(path, st)
+    if found:
+        KNOWN_FILE_HASHES[key] = (stat_key(st), *found)
+    return found
+
+def known_file_hash(path: str, st: os.stat_result) -> Optional[str]:
+    found = file_hash_entry(path, st)
+    return found[0] if found else None
+
+def forget_file_hash(path: str):
+    KNOWN_FILE_HASHES.pop(os.path.abspath(path), None)
+    for sidecar in (hash_sidecar_path(path), legacy_hash_sidecar_path(path)):
+        try:
+            os.remove(sidecar)
+        except OSError:
+            pass
+
+class HashIndexer:
+    """
+    后台补齐 sha256 索引：外部放入或旧版本遗留、尚无有效哈希的文件在这里逐个计算，
+    秒传探测因此永远不在请求路径上读整个文件。
+    """
+    def __init__(self):
+        self.queue: Optional[asyncio.Queue] = None
+        self.task: Optional[asyncio.Task] = None
+        self.sweep_task: Optional[asyncio.Task] = None
+        self.pending = set()
+        self.computed = 0
+        self.failed = 0
+        self.skipped = 0
+
+    def schedule(self, path: str):
+        if self.queue is None or path in self.pending:
+            return
+        try:
+            self.queue.put_nowait(path)
+            self.pending.add(path)
+        except asyncio.QueueFull:
+            self.skipped += 1
+
+    def start(self):
+        self.queue = asyncio.Queue(maxsize=HASH_QUEUE_SIZE)
+        self.task = asyncio.create_task(self._worker())
+        self.sweep_task = asyncio.create_task(self.run_sweep(HASH_SWEEP_SECONDS))
+
+    async def stop(self):
+        for task in (self.sweep_task, self.task):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self.queue = None
+        self.task = None
+        self.sweep_task = None
+        self.pending.clear()
+
+    @staticmethod
+    def find_missing(root: str, names: List[str]) -> List[str]:
+        missing = []
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if known_file_hash(path, st) is None:
+                missing.append(path)
+        return missing
+
+    async def sweep(self):
+        with FILE_INDEX.lock:
+            root, names = FILE_INDEX.root, list(FILE_INDEX.entries)
+        if root is None:
+            return
+        for path in await run_blocking(self.find_missing, root, names):
+            if path not in self.pending:
+                self.pending.add(path)
+                await self.queue.put(path)
+
+    async def run_sweep(self, interval: float):
         while True:
-            chunk = f.read(1024 * 1024)
-            if not chunk:
-                break
-            h.update(chunk)
-    return h.hexdigest()
+            try:
+                await self.sweep()
+            except Exception as e:
+                print(f"Hash sweep failed: {e}", flush=True)
+            await asyncio.sleep(interval)
+
+    async def _worker(self):
+        while True:
+            path = await self.queue.get()
+            try:
+                await self.build(path)
+            except Exception as e:
+                self.failed += 1
+                print(f"Hash indexing failed for {path}: {e}", flush=True)
+            finally:
+                self.pending.discard(path)
+
+    async def build(self, path: str):
+        try:
+            st = await run_blocking(os.stat, path)
+        except FileNotFoundError:
+            return
+        if known_file_hash(path, st) is not None:
+            return
+        async with admitted(ADMISSION["merge"], background=True):
+            digest = await run_hashing(file_sha256, path)
+        # 计算期间文件被替换则放弃，等待下次补齐
+        try:
+            if stat_key(await run_blocking(os.stat, path)) != stat_key(st):
+                return
+        except FileNotFoundError:
+            return
+        await run_blocking(remember_file_hash, path, digest, st, False)
+        self.computed += 1
+
+    def stats(self) -> dict:
+        return {
+            "known": len(KNOWN_FILE_HASHES),
+            "queued": len(self.pending),
+            "computed": self.computed,
+            "failed": self.failed,
+            "skipped": self.skipped,
+        }
+
+HASH_INDEXER = HashIndexer()
+
+class SessionWriterLimiter:
+    """按上传会话计数并发写入的分片请求，防止单个客户端独占磁盘 I/O"""
+    def __init__(self, max_writers: int):
+        self.max_writers = max_writers
+        self.active = {}
+        # 正在写入的 (upload_id, 分片序号)：同一分片的并发写入会互相覆盖数据与摘要，直接拒绝
+        self.chunks = set()
+        self.rejected = 0
+
+    def try_acquire(self, upload_id: str) -> bool:
+        n = self.active.get(upload_id, 0)
+        if n >= self.max_writers:
+            self.rejected += 1
+            return False
+        self.active[upload_id] = n + 1
+        return True
+
+    def release(self, upload_id: str):
+        n = self.active.get(upload_id, 0) - 1
+        if n > 0:
+            self.active[upload_id] = n
+        else:
+            self.active.pop(upload_id, None)
+
+SESSION_WRITERS = SessionWriterLimiter(UPLOAD_SESSION_MAX_WRITERS)
 
 @app.post("/upload/init")
 async def upload_init(request: Request):
@@ -683,60 +3468,230 @@ async def upload_init(request: Request):
     file_hash = data.get("hash")
     total_chunks = int(data.get("total_chunks", 0))
     chunk_size = int(data.get("chunk_size", 0))
-    if not filename or not size or not file_hash:
+    # 哈希可在 upload/complete 时再提交：此时用客户端指纹（如修改时间）标识会话
+    fingerprint = data.get("fingerprint")
+    if not filename or not size or not (file_hash or fingerprint):
         raise HTTPException(status_code=400, detail="缺少必要参数")
     upload_dir = getattr(request.app.state, "upload_dir", get_upload_dir())
     chunk_dir = getattr(request.app.state, "chunk_dir", get_chunk_dir())
-    os.makedirs(upload_dir, exist_ok=True)
-    os.makedirs(chunk_dir, exist_ok=True)
+    await run_blocking(os.makedirs, upload_dir, exist_ok=True)
+    await run_blocking(os.makedirs, chunk_dir, exist_ok=True)
     final_path = os.path.join(upload_dir, filename)
-    if os.path.exists(final_path) and os.path.getsize(final_path) == size:
+    if CONTENT_ADDRESSED_STORE and hash_algo == "sha256" and file_hash:
+        # 内容寻址：任意文件名下已有相同内容即可秒传，仅查内存索引
+        await run_blocking(BLOB_STORE.ensure, upload_dir)
+        if BLOB_STORE.lookup(file_hash, size):
+            try:
+                await run_blocking(BLOB_STORE.link, file_hash, final_path)
+            except OSError:
+                pass
+            else:
+                await invalidate_file_caches(final_path)
+                url = f"http://obs.dimond.top/{filename}"
+                return JSONResponse({"skip": True, "url": url})
+    try:
+        st = await run_blocking(os.stat, final_path) if file_hash else None
+    except OSError:
+        st = None
+    if st is not None and st.st_size == size:
         # 进行秒传校验
         if hash_algo == "sha256":
-            existing_hash = file_sha256(final_path)
-            if existing_hash == file_hash:
+            existing_hash = await run_blocking(known_file_hash, final_path, st)
+            if existing_hash is None:
+                # 不在请求路径上哈希：交给后台补齐，本次按普通上传处理
+                HASH_INDEXER.schedule(final_path)
+            elif existing_hash == file_hash:
                 url = f"http://obs.dimond.top/{filename}"
                 return JSONResponse({"skip": True, "url": url})
-    upload_id = make_upload_id(filename, size, hash_algo, file_hash)
+    if data.get("probe"):
+        # 仅探测秒传，不创建会话
+        return JSONResponse({"skip": False})
+    if file_hash:
+        upload_id = make_upload_id(filename, size, hash_algo, file_hash)
+    else:
+        upload_id = make_upload_id(filename, size, hash_algo, "late-" + str(fingerprint).replace("/", "_"))
     up_dir = os.path.join(chunk_dir, upload_id)
-    os.makedirs(up_dir, exist_ok=True)
-    # 枚举已上传分片
-    uploaded = []
-    try:
-        for name in os.listdir(up_dir):
-            if name.endswith(".part"):
-                try:
-                    idx = int(name[:-5])
-                    uploaded.append(idx)
-                except Exception:
-                    pass
-    except Exception:
-        uploaded = []
+    session = await run_blocking(load_upload_session, up_dir)
+    if session is None:
+        # 新会话（或没有清单的旧会话）：写入清单与位图，此后续传状态只读清单
+        legacy_parts = await run_blocking(list_uploaded_parts, up_dir)
+        reserved = not legacy_parts
+        if reserved and not await STAGING.admit(chunk_dir, size):
+            raise HTTPException(status_code=507, detail="暂存空间不足，请稍后重试", headers={"Retry-After": "60"})
+        assembly = data.get("assembly", UPLOAD_ASSEMBLY_MODE)
+        # 原位组装需要可推算偏移的分片参数；旧会话已有 part 文件时保持 parts 模式
+        if assembly != "inplace" or legacy_parts or chunk_size <= 0 or total_chunks != (size + chunk_size - 1) // chunk_size:
+            assembly = "parts"
+        session = new_session_manifest(filename, size, chunk_size, total_chunks, assembly)
+        try:
+            await run_blocking(os.makedirs, up_dir, exist_ok=True)
+            await run_blocking(create_upload_session, up_dir, session, legacy_parts)
+        except OSError as e:
+            if reserved:
+                STAGING.cancel(size)
+            raise HTTPException(status_code=507, detail=f"预分配失败: {str(e)}")
+        except BaseException:
+            if reserved:
+                STAGING.cancel(size)
+            raise
+        if reserved:
+            STAGING.commit(size)
+    result = {
+        "upload_id": upload_id,
+        "total_chunks": session.get("total_chunks", total_chunks),
+        "chunk_size": session.get("chunk_size", chunk_size),
+        "assembly": session["assembly"],
+        **await run_blocking(bitmap_status, up_dir, session),
+    }
+    # status_format=bitmap 时只返回位图，超大文件续传无需传输整数列表
+    if data.get("status_format") != "bitmap":
+        result["uploaded"] = await run_blocking(bitmap_indices, up_dir, session.get("total_chunks"))
+    return JSONResponse(result)
+
+@app.get("/upload/status/{upload_id}")
+async def upload_status(upload_id: str, request: Request):
+    chunk_dir = getattr(request.app.state, "chunk_dir", get_chunk_dir())
+    up_dir = os.path.join(chunk_dir, upload_id)
+    session = await run_blocking(load_upload_session, up_dir)
+    if session is None:
+        raise HTTPException(status_code=404, detail="上传会话不存在或已过期")
     return JSONResponse({
         "upload_id": upload_id,
-        "uploaded": sorted(uploaded),
-        "total_chunks": total_chunks,
-        "chunk_size": chunk_size,
+        "total_chunks": session.get("total_chunks"),
+        "chunk_size": session.get("chunk_size"),
+        "assembly": session["assembly"],
+        "updated_at": session.get("updated_at"),
+        **await run_blocking(bitmap_status, up_dir, session),
     })
 
 @app.put("/upload/chunk/{upload_id}/{index}")
 async def upload_chunk(upload_id: str, index: int, request: Request):
     if index < 0:
         raise HTTPException(status_code=400, detail="分片序号非法")
+    if (upload_id, index) in SESSION_WRITERS.chunks:
+        raise HTTPException(status_code=409, detail=f"分片 {index} 正在写入", headers={"Retry-After": "1"})
+    if not SESSION_WRITERS.try_acquire(upload_id):
+        raise HTTPException(status_code=429, detail="该会话并发写入分片过多", headers={"Retry-After": "1"})
+    SESSION_WRITERS.chunks.add((upload_id, index))
+    try:
+        return await write_chunk(upload_id, index, request)
+    finally:
+        SESSION_WRITERS.chunks.discard((upload_id, index))
+        SESSION_WRITERS.release(upload_id)
+
+async def write_chunk(upload_id: str, index: int, request: Request) -> Response:
     chunk_dir = getattr(request.app.state, "chunk_dir", get_chunk_dir())
     up_dir = os.path.join(chunk_dir, upload_id)
-    os.makedirs(up_dir, exist_ok=True)
+    session = await run_blocking(load_upload_session, up_dir)
+    if session is None:
+        raise HTTPException(status_code=404, detail="上传会话不存在或已过期")
+    if session.get("assembly") == "inplace":
+        return await receive_chunk_inplace(request, up_dir, upload_id, index, session)
     part_path = os.path.join(up_dir, f"{index}.part")
+    # 先写临时文件，摘要落盘后再改名，未写完的分片不会被 upload_init 计入已上传；临时文件名唯一，互不覆盖
+    tmp_part = f"{part_path}.{secrets.token_hex(8)}.tmp"
+    expected = request.headers.get("x-chunk-sha256")
+    h = hashlib.sha256()
+    try:
+        written = 0
+        pending = bytearray()
+        fd = await run_blocking(os.open, tmp_part, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        try:
+            async for chunk in request_body(request):
+                pending += chunk
+                if len(pending) >= INPLACE_WRITE_COALESCE:
+                    await run_blocking(hash_and_pwrite, fd, pending, written, h)
+                    written += len(pending)
+                    pending = bytearray()
+            if pending:
+                await run_blocking(hash_and_pwrite, fd, pending, written, h)
+        finally:
+            await run_blocking(os.close, fd)
+        digest = h.hexdigest()
+        if expected and expected.lower() != digest:
+            raise HTTPException(status_code=422, detail=f"分片 {index} 哈希校验失败")
+        async with aiofiles.open(chunk_digest_path(up_dir, index), "w", encoding="utf-8", executor=FS_EXECUTOR) as f:
+            await f.write(digest)
+        await run_blocking(os.replace, tmp_part, part_path)
+        await run_blocking(bitmap_set, up_dir, index, True)
+        await run_blocking(touch_upload_session, up_dir, session)
+        return Response(content="OK", status_code=201, headers={"X-Chunk-SHA256": digest})
+    except HTTPException:
+        await run_blocking(remove_file, tmp_part)
+        raise
+    except Exception as e:
+        # 失败（含客户端断开）时清理本次的临时文件，改名成功后 remove_file 为空操作
+        await run_blocking(remove_file, tmp_part)
+        raise HTTPException(status_code=500, detail=f"分片写入失败: {str(e)}")
+
+async def receive_chunk_inplace(request: Request, up_dir: str, upload_id: str, index: int, session: dict) -> Response:
+    """原位组装：分片直接 pwrite 到预分配文件的 index*chunk_size 处，校验通过后置位图"""
+    chunk_size = session["chunk_size"]
+    if index >= session["total_chunks"]:
+        raise HTTPException(status_code=400, detail="分片序号非法")
+    offset = index * chunk_size
+    expected_len = min(chunk_size, session["size"] - offset)
+    expected = request.headers.get("x-chunk-sha256")
+    # 重传已完成分片：先清位图，写入过程中失败不会留下“已完成”的脏区间
+    await run_blocking(bitmap_set, up_dir, index, False)
+    state = INPLACE_HASH_STATE.get(upload_id)
+    if state is None:
+        state = INPLACE_HASH_STATE[upload_id] = [0, hashlib.sha256(), set(), False]
+    if index < state[0]:
+        # 已计入顺序哈希的分片被重写，哈希状态作废，完成时整体重读
+        INPLACE_HASH_STATE.pop(upload_id, None)
+        state = None
+    else:
+        state[2].discard(index)
+    sequential = state is not None and not state[3] and index == state[0]
+    running = state[1].copy() if sequential else None
+    h = hashlib.sha256()
+    written = 0
+    pending = bytearray()
+    fd = await run_blocking(os.open, assembly_path(up_dir), os.O_WRONLY)
     try:
-        async with aiofiles.open(part_path, "wb") as f:
-            async for chunk in request.stream():
-                await f.write(chunk)
-        return Response(content="OK", status_code=201)
+        async for chunk in request_body(request):
+            if written + len(pending) + len(chunk) > expected_len:
+                raise HTTPException(status_code=422, detail=f"分片 {index} 大小不匹配")
+            pending += chunk
+            if len(pending) >= INPLACE_WRITE_COALESCE:
+                await run_blocking(hash_and_pwrite, fd, pending, offset + written, h, running)
+                written += len(pending)
+                pending = bytearray()
+        if pending:
+            await run_blocking(hash_and_pwrite, fd, pending, offset + written, h, running)
+            written += len(pending)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"分片写入失败: {str(e)}")
+    finally:
+        await run_blocking(os.close, fd)
+    if written != expected_len:
+        raise HTTPException(status_code=422, detail=f"分片 {index} 大小不匹配")
+    digest = h.hexdigest()
+    if expected and expected.lower() != digest:
+        raise HTTPException(status_code=422, detail=f"分片 {index} 哈希校验失败")
+    async with aiofiles.open(chunk_digest_path(up_dir, index), "w", encoding="utf-8", executor=FS_EXECUTOR) as f:
+        await f.write(digest)
+    await run_blocking(bitmap_set, up_dir, index, True)
+    await run_blocking(touch_upload_session, up_dir, session)
+    if state is not None and INPLACE_HASH_STATE.get(upload_id) is state:
+        if running is not None and state[0] == index:
+            state[0] = index + 1
+            state[1] = running
+        elif index >= state[0]:
+            state[2].add(index)
+        await catch_up_inplace_hash(upload_id, up_dir, session)
+    return Response(content="OK", status_code=201, headers={"X-Chunk-SHA256": digest})
 
 @app.post("/upload/complete/{upload_id}")
 async def upload_complete(upload_id: str, request: Request):
+    # 合并与整文件哈希最耗磁盘：经 merge 类别准入，超出并发的请求排队，排不上返回 503
+    async with admitted(ADMISSION["merge"]):
+        return await merge_upload(upload_id, request)
+
+async def merge_upload(upload_id: str, request: Request):
     data = await request.json()
     filename = data.get("filename")
     size = int(data.get("size", 0))
@@ -748,44 +3703,44 @@ async def upload_complete(upload_id: str, request: Request):
     chunk_dir = getattr(request.app.state, "chunk_dir", get_chunk_dir())
     upload_dir = getattr(request.app.state, "upload_dir", get_upload_dir())
     up_dir = os.path.join(chunk_dir, upload_id)
-    if not os.path.exists(up_dir):
+    if not await run_blocking(os.path.isdir, up_dir):
         raise HTTPException(status_code=404, detail="上传会话不存在")
-    # 校验分片完整
+    session = await run_blocking(load_upload_session, up_dir)
+    inplace = session is not None and session.get("assembly") == "inplace"
+    # 校验分片完整：位图或一次目录扫描，不逐个 stat 分片
+    if inplace:
+        total_chunks = session["total_chunks"]
+        done = set(await run_blocking(bitmap_indices, up_dir, total_chunks))
+    else:
+        done = set(await run_blocking(list_uploaded_parts, up_dir))
     for i in range(total_chunks):
-        if not os.path.exists(os.path.join(up_dir, f"{i}.part")):
+        if i not in done:
             raise HTTPException(status_code=409, detail=f"缺少分片 {i}")
-    # 合并
-    tmp_path = os.path.join(up_dir, "__merge.tmp")
-    try:
-        async with aiofiles.open(tmp_path, "wb") as out:
-            for i in range(total_chunks):
-                p = os.path.join(up_dir, f"{i}.part")
-                async with aiofiles.open(p, "rb") as inp:
-                    while True:
-                        chunk = await inp.read(1024 * 1024)
-                        if not chunk:
-                            break
-                        await out.write(chunk)
+    try:
+        if inplace:
+            # 原位组装：数据已在目标文件中，只需补齐顺序哈希未覆盖的部分
+            tmp_path = assembly_path(up_dir)
+            real_size = await run_blocking(os.path.getsize, tmp_path)
+            state = INPLACE_HASH_STATE.pop(upload_id, None)
+            if state is not None and state[3]:
+                # 补算仍在进行：序号已推进而哈希对象尚未更新，不可用，整体重读
+                state = None
+            merged_hash = await run_finish_hash(tmp_path, state, session["chunk_size"])
+        else:
+            # 合并：单次读取分片，同时计算整体 sha256，不再回读合并结果
+            tmp_path = os.path.join(up_dir, "__merge.tmp")
+            real_size, merged_hash = await run_hashing(merge_parts, up_dir, total_chunks, tmp_path)
         # 校验大小与哈希
-        real_size = os.path.getsize(tmp_path)
         if real_size != size:
             raise HTTPException(status_code=422, detail="合并后大小不匹配")
-        ok_hash = None
-        if hash_algo == "sha256" and file_hash:
-            ok_hash = file_sha256(tmp_path)
-            if ok_hash != file_hash:
-                raise HTTPException(status_code=422, detail="哈希校验失败")
+        if hash_algo == "sha256" and file_hash and merged_hash != file_hash:
+            raise HTTPException(status_code=422, detail="哈希校验失败")
         # 移动到最终位置
         final_path = os.path.join(upload_dir, filename)
-        os.replace(tmp_path, final_path)
-        # 可选清理分片
-        try:
-            for i in range(total_chunks):
-                os.remove(os.path.join(up_dir, f"{i}.part"))
-            os.remove(os.path.join(up_dir, "__merge.tmp")) if os.path.exists(os.path.join(up_dir, "__merge.tmp")) else None
-            os.rmdir(up_dir)
-        except Exception:
-            pass
+        await publish_assembled_upload(tmp_path, final_path, merged_hash)
+        # 清理会话目录（分片、摘要、位图、元数据）
+        await run_blocking(shutil.rmtree, up_dir, ignore_errors=True)
+        STAGING.release(size)
         url = f"http://obs.dimond.top/{filename}"
         return Response(content=url, status_code=200, media_type="text/plain")
     except HTTPException:
@@ -793,45 +3748,425 @@ async def upload_complete(upload_id: str, request: Request):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"合并失败: {str(e)}")
 
-@app.post("/")
-async def upload_file_form(request: Request):
-    # Flexible file upload handler
+async def publish_assembled_upload(tmp_path: str, final_path: str, digest: str):
+    """把暂存区组装好的文件发布到最终位置：开启内容寻址时入库并硬链接，否则原子替换"""
+    if CONTENT_ADDRESSED_STORE:
+        await run_blocking(BLOB_STORE.ensure, os.path.dirname(final_path) or ".")
+        st = await run_blocking(BLOB_STORE.ingest, tmp_path, digest, final_path)
+    else:
+        st = await run_blocking(os.stat, tmp_path)
+        old = await run_blocking(replace_file, tmp_path, final_path)
+        if old is not None:
+            await run_blocking(BLOB_STORE.release, old)
+    await invalidate_file_caches(final_path)
+    await run_blocking(remember_file_hash, final_path, digest, st)
+
+# --- tus 协议：创建 / HEAD 查询偏移 / PATCH 追加，数据写入暂存区内单个预分配文件 ---
+
+def tus_headers(session: Optional[dict] = None) -> dict:
+    headers = {"Tus-Resumable": TUS_VERSION, "Cache-Control": "no-store"}
+    if session is not None:
+        headers["Upload-Offset"] = str(session["offset"])
+        headers["Upload-Length"] = str(session["size"])
+        headers["Upload-Expires"] = formatdate(session["updated_at"] + UPLOAD_SESSION_TTL_SECONDS, usegmt=True)
+    return headers
+
+def check_tus_version(request: Request):
+    # 未携带 Tus-Resumable 时按当前版本处理，方便直接用 curl 续传
+    version = request.headers.get("tus-resumable")
+    if version is not None and version != TUS_VERSION:
+        raise HTTPException(status_code=412, detail="不支持的 tus 协议版本",
+                            headers={"Tus-Resumable": TUS_VERSION, "Tus-Version": TUS_VERSION})
+
+def parse_tus_metadata(header: str) -> dict:
+    """解析 Upload-Metadata：逗号分隔的 "键 base64值" 对，值可省略"""
+    meta = {}
+    for item in header.split(","):
+        key, _, value = item.strip().partition(" ")
+        if not key:
+            continue
+        try:
+            meta[key] = base64.b64decode(value.strip(), validate=True).decode("utf-8")
+        except (ValueError, UnicodeDecodeError):
+            raise HTTPException(status_code=400, detail="Upload-Metadata 格式错误")
+    return meta
+
+def tus_filename_allowed(filename: str) -> bool:
+    # 只接受上传目录下的单层文件名：不含分隔符、不以 . 开头（.chunks、.blobs、.sidecars 等为保留名）
+    return bool(filename) and not filename.startswith(".") and not any(c in filename for c in "/\\\x00")
+
+def create_tus_session(up_dir: str, session: dict):
+    """预分配数据文件并写入清单（在工作线程中执行）"""
+    fd = os.open(assembly_path(up_dir), os.O_RDWR | os.O_CREAT, 0o644)
     try:
-        form = await request.form()
-        
-        # Find the first UploadFile field
-        upload_file: UploadFile = None
-        for key, value in form.items():
-            # Duck typing check for UploadFile (has filename and file attribute)
-            if hasattr(value, "filename") and hasattr(value, "file"):
-                upload_file = value
-                break
-        
-        if not upload_file:
-            # Fallback for "file" param if it was somehow passed differently or check body
+        preallocate_file(fd, session["size"])
+    finally:
+        os.close(fd)
+    save_upload_session(up_dir, session)
+
+async def load_tus_session(request: Request, upload_id: str) -> Tuple[str, dict]:
+    chunk_dir = getattr(request.app.state, "chunk_dir", get_chunk_dir())
+    up_dir = os.path.join(chunk_dir, upload_id)
+    session = await run_blocking(load_upload_session, up_dir) if upload_id.startswith("tus-") else None
+    if session is None or session.get("assembly") != "tus":
+        raise HTTPException(status_code=404, detail="上传会话不存在或已过期", headers=tus_headers())
+    return up_dir, session
+
+async def tus_receive(request: Request, up_dir: str, upload_id: str, session: dict) -> dict:
+    """
+    把请求体从当前偏移起写入数据文件。连接中断时保留已收到的数据：fsync 后再把新偏移写入清单，
+    清单中的 offset 始终不超过已落盘的字节；带 Upload-Checksum 时校验不通过则整段作废。
+    """
+    offset = session["offset"]
+    verify = expected = None
+    checksum = request.headers.get("upload-checksum")
+    if checksum:
+        algo, _, value = checksum.strip().partition(" ")
+        if algo not in TUS_CHECKSUM_ALGORITHMS:
+            raise HTTPException(status_code=400, detail="不支持的校验算法", headers=tus_headers(session))
+        try:
+            expected = base64.b64decode(value.strip(), validate=True)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Upload-Checksum 格式错误", headers=tus_headers(session))
+        verify = hashlib.new(algo)
+    state = INPLACE_HASH_STATE.get(upload_id)
+    if offset == 0:
+        running = hashlib.sha256()
+    elif state is not None and state[0] == offset:
+        running = state[1].copy()
+    else:
+        # 重启后哈希状态丢失：完成时从已哈希的位置补读
+        running = None
+    written = 0
+    pending = bytearray()
+    interrupted = None
+    fd = await run_blocking(os.open, assembly_path(up_dir), os.O_WRONLY)
+    try:
+        try:
+            async for chunk in request_body(request):
+                if offset + written + len(pending) + len(chunk) > session["size"]:
+                    raise HTTPException(status_code=413, detail="超出 Upload-Length", headers=tus_headers(session))
+                pending += chunk
+                if len(pending) >= PUT_WRITE_COALESCE:
+                    await run_blocking(hash_and_pwrite, fd, pending, offset + written, verify, running)
+                    written += len(pending)
+                    pending = bytearray()
+        except HTTPException:
+            raise
+        except Exception as e:
+            interrupted = e
+        if verify is not None:
+            # 尾块写入前先完成校验，校验不通过的数据不落盘
+            if interrupted is not None:
+                raise HTTPException(status_code=400, detail=f"上传中断: {interrupted}", headers=tus_headers(session))
+            await run_blocking(update_hashes, pending, verify)
+            if verify.digest() != expected:
+                raise HTTPException(status_code=460, detail="校验和不匹配", headers=tus_headers(session))
+        if pending:
+            await run_blocking(hash_and_pwrite, fd, pending, offset + written, running)
+            written += len(pending)
+        if written:
+            await run_blocking(os.fsync, fd)
+    finally:
+        await run_blocking(os.close, fd)
+    if written:
+        session["offset"] = offset + written
+        await run_blocking(touch_upload_session, up_dir, session)
+        if running is not None:
+            INPLACE_HASH_STATE[upload_id] = [session["offset"], running]
+    if interrupted is not None:
+        raise HTTPException(status_code=400, detail=f"上传中断: {interrupted}", headers=tus_headers(session))
+    return session
+
+def claim_tus_writer(upload_id: str, session: dict):
+    # 单文件顺序追加：同一会话同时只允许一个写入者。检查与占用之间没有 await，排队等待准入前即已占用
+    if upload_id in SESSION_WRITERS.active or not SESSION_WRITERS.try_acquire(upload_id):
+        raise HTTPException(status_code=409, detail="该上传正在写入", headers=tus_headers(session))
+
+async def finish_tus_upload(request: Request, up_dir: str, upload_id: str, session: dict):
+    """
+    发布已收齐的 tus 上传。此时清单已记录 offset == size，客户端不会再发 PATCH，
+    因此 merge 准入只排队不拒绝；发布失败的会话由下一次 HEAD 重新发布。
+    """
+    upload_dir = getattr(request.app.state, "upload_dir", get_upload_dir())
+    tmp_path = assembly_path(up_dir)
+    async with admitted(ADMISSION["merge"], background=True):
+        state = INPLACE_HASH_STATE.pop(upload_id, None)
+        digest = await run_finish_hash(tmp_path, state, 1)
+        await publish_assembled_upload(tmp_path, os.path.join(upload_dir, session["filename"]), digest)
+    await run_blocking(shutil.rmtree, up_dir, ignore_errors=True)
+    STAGING.release(session["size"])
+
+@app.options("/tus")
+async def tus_options():
+    headers = {
+        "Tus-Resumable": TUS_VERSION,
+        "Tus-Version": TUS_VERSION,
+        "Tus-Extension": "creation,creation-with-upload,checksum,termination,expiration",
+        "Tus-Checksum-Algorithm": ",".join(TUS_CHECKSUM_ALGORITHMS),
+    }
+    if MAX_UPLOAD_SIZE is not None:
+        headers["Tus-Max-Size"] = str(MAX_UPLOAD_SIZE)
+    return Response(status_code=204, headers=headers)
+
+@app.post("/tus")
+async def tus_create(request: Request):
+    check_tus_version(request)
+    length = request.headers.get("upload-length", "")
+    if not length.isdigit():
+        raise HTTPException(status_code=400, detail="缺少 Upload-Length", headers=tus_headers())
+    size = int(length)
+    if MAX_UPLOAD_SIZE is not None and size > MAX_UPLOAD_SIZE:
+        raise HTTPException(status_code=413, detail="文件过大", headers=tus_headers())
+    filename = parse_tus_metadata(request.headers.get("upload-metadata", "")).get("filename")
+    if not filename:
+        raise HTTPException(status_code=400, detail="Upload-Metadata 缺少 filename", headers=tus_headers())
+    if not tus_filename_allowed(filename):
+        raise HTTPException(status_code=400, detail="文件名非法", headers=tus_headers())
+    with_upload = request.headers.get("content-type") == "application/offset+octet-stream"
+    # creation-with-upload 与 PATCH 一样经 upload 类别准入，且先于创建会话：被拒绝时不留下空会话与暂存预留
+    async with admitted(upload_gate(request) if with_upload else None):
+        upload_id, up_dir, session = await open_tus_session(request, filename, size)
+        headers = tus_headers(session)
+        headers["Location"] = f"{str(request.base_url).rstrip('/')}/tus/{upload_id}"
+        claim_tus_writer(upload_id, session)
+        if with_upload:
+            # creation-with-upload：创建请求本身携带首段数据
+            try:
+                session = await tus_receive(request, up_dir, upload_id, session)
+            except BaseException:
+                SESSION_WRITERS.release(upload_id)
+                raise
+    try:
+        if session["offset"] == size:
+            await finish_tus_upload(request, up_dir, upload_id, session)
+    finally:
+        SESSION_WRITERS.release(upload_id)
+    headers.update(tus_headers(session))
+    return Response(status_code=201, headers=headers)
+
+async def open_tus_session(request: Request, filename: str, size: int) -> Tuple[str, str, dict]:
+    """预留暂存空间并创建 tus 会话目录与清单，返回 (upload_id, 会话目录, 清单)"""
+    upload_dir = getattr(request.app.state, "upload_dir", get_upload_dir())
+    chunk_dir = getattr(request.app.state, "chunk_dir", get_chunk_dir())
+    await run_blocking(os.makedirs, upload_dir, exist_ok=True)
+    await run_blocking(os.makedirs, chunk_dir, exist_ok=True)
+    if not await STAGING.admit(chunk_dir, size):
+        raise HTTPException(status_code=507, detail="暂存空间不足，请稍后重试", headers={"Retry-After": "60", **tus_headers()})
+    upload_id = "tus-" + secrets.token_hex(16)
+    up_dir = os.path.join(chunk_dir, upload_id)
+    session = new_session_manifest(filename, size, 0, 0, "tus")
+    session["offset"] = 0
+    try:
+        await run_blocking(os.makedirs, up_dir, exist_ok=True)
+        await run_blocking(create_tus_session, up_dir, session)
+    except OSError as e:
+        STAGING.cancel(size)
+        await run_blocking(shutil.rmtree, up_dir, ignore_errors=True)
+        raise HTTPException(status_code=507, detail=f"预分配失败: {str(e)}", headers=tus_headers())
+    except BaseException:
+        STAGING.cancel(size)
+        raise
+    STAGING.commit(size)
+    return upload_id, up_dir, session
+
+@app.head("/tus/{upload_id}")
+async def tus_head(upload_id: str, request: Request):
+    check_tus_version(request)
+    up_dir, session = await load_tus_session(request, upload_id)
+    if session["offset"] == session["size"] and upload_id not in SESSION_WRITERS.active:
+        # 已收齐但未发布（发布失败或服务重启）：客户端只会查询偏移，在此补做发布
+        claim_tus_writer(upload_id, session)
+        try:
+            # 占用后重读清单：读取清单的 await 期间会话可能已被其它请求发布或删除
+            up_dir, session = await load_tus_session(request, upload_id)
+            await finish_tus_upload(request, up_dir, upload_id, session)
+        finally:
+            SESSION_WRITERS.release(upload_id)
+    return Response(status_code=200, headers=tus_headers(session))
+
+@app.patch("/tus/{upload_id}")
+async def tus_patch(upload_id: str, request: Request):
+    check_tus_version(request)
+    if request.headers.get("content-type") != "application/offset+octet-stream":
+        raise HTTPException(status_code=415, detail="Content-Type 必须为 application/offset+octet-stream", headers=tus_headers())
+    up_dir, session = await load_tus_session(request, upload_id)
+    claim_tus_writer(upload_id, session)
+    try:
+        # 占用后重读清单：读取清单的 await 期间其它 PATCH 可能已推进偏移
+        up_dir, session = await load_tus_session(request, upload_id)
+        offset = request.headers.get("upload-offset", "")
+        if not offset.isdigit() or int(offset) != session["offset"]:
+            raise HTTPException(status_code=409, detail="Upload-Offset 与服务端不一致", headers=tus_headers(session))
+        async with admitted(upload_gate(request)):
+            session = await tus_receive(request, up_dir, upload_id, session)
+        if session["offset"] == session["size"]:
+            await finish_tus_upload(request, up_dir, upload_id, session)
+    finally:
+        SESSION_WRITERS.release(upload_id)
+    return Response(status_code=204, headers=tus_headers(session))
+
+@app.delete("/tus/{upload_id}")
+async def tus_delete(upload_id: str, request: Request):
+    check_tus_version(request)
+    up_dir, session = await load_tus_session(request, upload_id)
+    if upload_id in SESSION_WRITERS.active:
+        raise HTTPException(status_code=409, detail="该上传正在写入", headers=tus_headers(session))
+    await run_blocking(shutil.rmtree, up_dir, ignore_errors=True)
+    INPLACE_HASH_STATE.pop(upload_id, None)
+    STAGING.release(session["size"])
+    return Response(status_code=204, headers=tus_headers())
+
+class UploadMeter:
+    """累计上传字节与耗时，用于观测上传吞吐"""
+    def __init__(self):
+        self.uploads = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.last_throughput = 0.0
+
+    def record(self, size: int, seconds: float) -> float:
+        throughput = size / seconds if seconds > 0 else 0.0
+        self.uploads += 1
+        self.bytes += size
+        self.seconds += seconds
+        self.last_throughput = throughput
+        return throughput
+
+    def stats(self) -> dict:
+        return {
+            "uploads": self.uploads,
+            "bytes": self.bytes,
+            "seconds": round(self.seconds, 3),
+            "avg_throughput": round(self.bytes / self.seconds) if self.seconds > 0 else 0,
+            "last_throughput": round(self.last_throughput),
+        }
+
+UPLOAD_METER = UploadMeter()
+
+def throughput_headers(size: int, seconds: float, throughput: float) -> dict:
+    return {
+        "X-Upload-Bytes": str(size),
+        "X-Upload-Seconds": f"{seconds:.3f}",
+        "X-Upload-Throughput": str(round(throughput)),
+    }
+
+async def receive_form_file(request: Request, upload_dir: str) -> Tuple[str, str, int, str]:
+    """
+    增量解析 multipart/form-data：第一个带文件名的字段直接流入目标目录下的临时文件，其余字段丢弃。
+    返回 (文件名, 临时文件路径, 大小, sha256)；失败时删除临时文件并抛出 HTTPException。
+    """
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    boundary = options.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise HTTPException(status_code=422, detail="No file field found in form data")
+
+    # 解析器回调是同步的：先收集事件，每喂入一块请求体后再异步处理
+    events = []
+    header = {"field": b"", "value": b""}
+    headers = []
+
+    def on_header_field(data, start, end):
+        header["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        header["value"] += data[start:end]
+
+    def on_header_end():
+        headers.append((header["field"].lower(), header["value"]))
+        header["field"] = header["value"] = b""
+
+    def on_headers_finished():
+        events.append(("headers", list(headers)))
+        headers.clear()
+
+    def on_part_data(data, start, end):
+        events.append(("data", data[start:end]))
+
+    def on_part_end():
+        events.append(("end", None))
+
+    parser = MultipartParser(boundary, {
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+
+    filename = None
+    tmp_path = None
+    out = None
+    capturing = False
+    finished = False
+    size = 0
+    pending = bytearray()
+    h = hashlib.sha256()
+    try:
+        async for chunk in request_body(request):
+            parser.write(chunk)
+            for kind, value in events:
+                if kind == "headers" and filename is None:
+                    disposition = dict(value).get(b"content-disposition", b"")
+                    _, params = parse_options_header(disposition)
+                    if b"filename" in params:
+                        filename = params[b"filename"].decode("utf-8", "replace")
+                        if not filename:
+                            raise HTTPException(status_code=400, detail="Filename is empty")
+                        await run_blocking(os.makedirs, upload_dir, exist_ok=True)
+                        tmp_path = upload_temp_path(upload_dir)
+                        out = await run_blocking(os.open, tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+                        capturing = True
+                elif kind == "data" and capturing:
+                    size += len(value)
+                    if MAX_UPLOAD_SIZE is not None and size > MAX_UPLOAD_SIZE:
+                        raise HTTPException(status_code=413, detail="文件过大")
+                    pending += value
+                    if len(pending) >= UPLOAD_CHUNK_SIZE:
+                        await run_blocking(hash_and_pwrite, out, pending, size - len(pending), h)
+                        pending = bytearray()
+                elif kind == "end" and capturing:
+                    capturing = False
+                    finished = True
+            events.clear()
+        parser.finalize()
+        if filename is None or not finished:
             raise HTTPException(status_code=422, detail="No file field found in form data")
+        if pending:
+            await run_blocking(hash_and_pwrite, out, pending, size - len(pending), h)
+        await run_blocking(os.close, out)
+        out = None
+        return filename, tmp_path, size, h.hexdigest()
+    except BaseException:
+        if out is not None:
+            await run_blocking(os.close, out)
+        if tmp_path is not None:
+            await run_blocking(remove_file, tmp_path)
+        raise
 
-        filename = upload_file.filename
-        if not filename:
-            raise HTTPException(status_code=400, detail="Filename is empty")
-            
-        upload_dir = getattr(request.app.state, "upload_dir", get_upload_dir())
-        save_path = os.path.join(upload_dir, filename)
-        
-        async with aiofiles.open(save_path, 'wb') as out_file:
-            # 使用 10MB 分片读取并写入；若设置了 MAX_UPLOAD_SIZE，则进行累计校验
-            total_written = 0
-            while content := await upload_file.read(UPLOAD_CHUNK_SIZE):
-                os.makedirs(upload_dir, exist_ok=True)
-                await out_file.write(content)
-                total_written += len(content)
-                if MAX_UPLOAD_SIZE is not None and total_written > MAX_UPLOAD_SIZE:
-                    raise HTTPException(status_code=413, detail="文件过大")
-        
-        return Response(content=f"文件上传成功: http://obs.dimond.top/{filename}", media_type="text/plain", status_code=201)
-        
+@app.post("/")
+async def upload_file_form(request: Request):
+    # Flexible file upload handler：流式解析表单，第一个文件字段直接写入目标目录的临时文件后原子替换
+    upload_dir = getattr(request.app.state, "upload_dir", get_upload_dir())
+    begin = time.perf_counter()
+    try:
+        async with admitted(upload_gate(request)):
+            filename, tmp_path, size, digest = await receive_form_file(request, upload_dir)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
+    save_path = os.path.join(upload_dir, filename)
+    try:
+        await publish_upload(tmp_path, save_path, digest)
+    except Exception as e:
+        await run_blocking(remove_file, tmp_path)
+        raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
+    seconds = time.perf_counter() - begin
+    throughput = UPLOAD_METER.record(size, seconds)
+    return Response(content=f"文件上传成功: http://obs.dimond.top/{filename}", media_type="text/plain", status_code=201,
+                    headers=throughput_headers(size, seconds, throughput))
 
 @app.put("/{filename}")
 async def upload_file_put(filename: str, request: Request):
@@ -841,92 +4176,722 @@ async def upload_file_put(filename: str, request: Request):
         
     upload_dir = getattr(request.app.state, "upload_dir", get_upload_dir())
     save_path = os.path.join(upload_dir, filename)
+    content_length = request.headers.get("content-length")
+    content_length = int(content_length) if content_length and content_length.isdigit() else None
+    if MAX_UPLOAD_SIZE is not None and content_length is not None and content_length > MAX_UPLOAD_SIZE:
+        raise HTTPException(status_code=413, detail="文件过大")
+
+    # 写入同目录临时文件，完成后原子替换：读者要么看到旧文件要么看到完整新文件，失败不留半截对象
+    tmp_path = None
+    try:
+        await run_blocking(os.makedirs, upload_dir, exist_ok=True)
+        async with admitted(upload_gate(request)):
+            tmp_path, _, digest = await receive_to_temp(request_body(request), upload_dir, content_length)
+        await publish_upload(tmp_path, save_path, digest)
+        tmp_path = None
+
+        file_url = f"http://obs.dimond.top/{filename}"
+        return Response(content=file_url, media_type="text/plain", status_code=201)
+    except HTTPException:
+        raise
+    except OSError as e:
+        if e.errno == errno.ENOSPC:
+            raise HTTPException(status_code=507, detail="磁盘空间不足")
+        raise HTTPException(status_code=500, detail=f"上传失败: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"上传失败: {str(e)}")
+    finally:
+        if tmp_path is not None:
+            await run_blocking(remove_file, tmp_path)
+
+# --- 归档：多文件流式打包下载（ZIP/TAR）与 TAR 流式解包上传 ---
+
+class ArchiveEntry:
+    __slots__ = ("name", "path", "size", "mtime", "offset", "zip64", "header")
+
+    def __init__(self, name: str, path: str, size: int, mtime: float):
+        self.name = name
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.offset = 0
+        self.zip64 = False
+        self.header = b""
+
+def archive_member_path(upload_dir: str, name: str) -> Optional[str]:
+    """把归档内的相对路径映射到上传目录下；绝对路径、含 .. 或隐藏组件（.chunks、.blobs、.sidecars 等）返回 None"""
+    name = name.replace("\\", "/")
+    if not name or name.startswith("/") or "\x00" in name:
+        return None
+    parts = [p for p in name.split("/") if p not in ("", ".")]
+    if not parts or any(p == ".." or p.startswith(".") for p in parts):
+        return None
+    return os.path.join(upload_dir, *parts)
+
+def inside_upload_dir(upload_dir: str, path: str) -> bool:
+    """解析符号链接后 path 仍位于上传目录内（含上传目录本身）"""
+    root = os.path.realpath(upload_dir)
+    real = os.path.realpath(path)
+    return real == root or real.startswith(root + os.sep)
+
+def collect_archive_entries(upload_dir: str, names: List[str]) -> Tuple[List[ArchiveEntry], List[str]]:
+    """按请求顺序（去重）取各文件的 stat，返回 (条目, 不存在或不可打包的名称)（在 FS_EXECUTOR 中执行）"""
+    entries, missing, seen = [], [], set()
+    for name in names:
+        path = archive_member_path(upload_dir, name) if isinstance(name, str) else None
+        if path is None or not inside_upload_dir(upload_dir, path):
+            missing.append(str(name))
+            continue
+        arcname = os.path.relpath(path, upload_dir).replace(os.sep, "/")
+        if arcname in seen:
+            continue
+        try:
+            st = STAT_CACHE.stat(path)
+        except OSError:
+            st = None
+        if st is None or not stat.S_ISREG(st.st_mode):
+            missing.append(name)
+            continue
+        seen.add(arcname)
+        entries.append(ArchiveEntry(arcname, path, st.st_size, st.st_mtime))
+    return entries, missing
+
+async def iter_archive_member(entry: ArchiveEntry):
+    sent = 0
+    if entry.size:
+        async for data in iter_pooled_file(entry.path, 0, entry.size - 1, STREAM_DOWNLOAD_CHUNK_SIZE):
+            sent += len(data)
+            yield data
+    if sent != entry.size:
+        # 长度已写入 Content-Length 与条目头，文件被截断时只能中止响应
+        raise OSError(f"{entry.name} 在打包过程中被修改")
+
+def dos_datetime(mtime: float) -> Tuple[int, int]:
+    t = time.localtime(mtime)
+    if t.tm_year < 1980:
+        return 0, (1 << 5) | 1
+    if t.tm_year > 2107:
+        return (23 << 11) | (59 << 5) | 29, (127 << 9) | (12 << 5) | 31
+    return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+def zip_local_header(entry: ArchiveEntry) -> bytes:
+    # 仅存储不压缩；置位 bit 3（CRC 与大小放在数据描述符中）与 bit 11（UTF-8 文件名）
+    name = entry.name.encode("utf-8", "surrogateescape")
+    dos_time, dos_date = dos_datetime(entry.mtime)
+    extra = struct.pack("<HHQQ", 0x0001, 16, 0, 0) if entry.zip64 else b""
+    size = 0xFFFFFFFF if entry.zip64 else 0
+    return struct.pack("<IHHHHHIIIHH", 0x04034b50, 45 if entry.zip64 else 20, 0x0808, 0, dos_time, dos_date,
+                       0, size, size, len(name), len(extra)) + name + extra
+
+def zip_data_descriptor(entry: ArchiveEntry, crc: int) -> bytes:
+    if entry.zip64:
+        return struct.pack("<IIQQ", 0x08074b50, crc, entry.size, entry.size)
+    return struct.pack("<IIII", 0x08074b50, crc, entry.size, entry.size)
+
+def zip_central_header(entry: ArchiveEntry, crc: int) -> bytes:
+    name = entry.name.encode("utf-8", "surrogateescape")
+    dos_time, dos_date = dos_datetime(entry.mtime)
+    if entry.zip64:
+        extra = struct.pack("<HHQQQ", 0x0001, 24, entry.size, entry.size, entry.offset)
+        size = offset = 0xFFFFFFFF
+    else:
+        extra = b""
+        size, offset = entry.size, entry.offset
+    return struct.pack("<IHHHHHHIIIHHHHHII", 0x02014b50, (3 << 8) | 45, 45 if entry.zip64 else 20, 0x0808, 0,
+                       dos_time, dos_date, crc, size, size, len(name), len(extra), 0, 0, 0, 0o100644 << 16,
+                       offset) + name + extra
+
+def zip_end_records(count: int, cd_offset: int, cd_size: int) -> bytes:
+    records = b""
+    if count >= 0xFFFF or cd_offset >= ZIP64_LIMIT or cd_size >= ZIP64_LIMIT:
+        records += struct.pack("<IQHHIIQQQQ", 0x06064b50, 44, 45, 45, 0, 0, count, count, cd_size, cd_offset)
+        records += struct.pack("<IIQI", 0x07064b50, 0, cd_offset + cd_size, 1)
+        count, cd_offset, cd_size = 0xFFFF, 0xFFFFFFFF, 0xFFFFFFFF
+    return records + struct.pack("<IHHHHIIH", 0x06054b50, 0, 0, count, count, cd_size, cd_offset, 0)
+
+def plan_zip(entries: List[ArchiveEntry]) -> int:
+    """按已知大小排布各条目偏移并决定是否需要 zip64，返回归档总长度"""
+    offset = 0
+    central = 0
+    for entry in entries:
+        name_len = len(entry.name.encode("utf-8", "surrogateescape"))
+        entry.offset = offset
+        entry.zip64 = entry.size >= ZIP64_LIMIT or offset >= ZIP64_LIMIT
+        offset += 30 + name_len + (20 if entry.zip64 else 0) + entry.size + (24 if entry.zip64 else 16)
+        central += 46 + name_len + (28 if entry.zip64 else 0)
+    return offset + central + len(zip_end_records(len(entries), offset, central))
+
+async def iter_zip(entries: List[ArchiveEntry]):
+    crcs = []
+    for entry in entries:
+        yield zip_local_header(entry)
+        crc = 0
+        async for data in iter_archive_member(entry):
+            # 分片最大可达 STREAM_DOWNLOAD_CHUNK_SIZE：CRC32 在 FS_EXECUTOR 中计算（大块时释放 GIL），不阻塞事件循环
+            crc = await run_blocking(zlib.crc32, data, crc)
+            yield data
+        crcs.append(crc)
+        yield zip_data_descriptor(entry, crc)
+    last = entries[-1] if entries else None
+    cd_offset = last.offset + len(zip_local_header(last)) + last.size + len(zip_data_descriptor(last, 0)) if last else 0
+    cd_size = 0
+    batch = []
+    for entry, crc in zip(entries, crcs):
+        header = zip_central_header(entry, crc)
+        cd_size += len(header)
+        batch.append(header)
+        if len(batch) >= 1024:
+            yield b"".join(batch)
+            batch = []
+    if batch:
+        yield b"".join(batch)
+    yield zip_end_records(len(entries), cd_offset, cd_size)
+
+def plan_tar(entries: List[ArchiveEntry]) -> int:
+    total = 0
+    for entry in entries:
+        info = tarfile.TarInfo(entry.name)
+        info.size = entry.size
+        info.mtime = int(entry.mtime)
+        info.mode = 0o644
+        entry.header = info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+        total += len(entry.header) + entry.size + (-entry.size % tarfile.BLOCKSIZE)
+    # 结尾两个全零块
+    return total + 2 * tarfile.BLOCKSIZE
+
+async def iter_tar(entries: List[ArchiveEntry]):
+    for entry in entries:
+        yield entry.header
+        async for data in iter_archive_member(entry):
+            yield data
+        padding = -entry.size % tarfile.BLOCKSIZE
+        if padding:
+            yield bytes(padding)
+    yield bytes(2 * tarfile.BLOCKSIZE)
+
+@app.post("/archive")
+async def download_archive(request: Request):
+    try:
+        data = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="请求体不是合法的 JSON")
+    names = data.get("names")
+    fmt = str(data.get("format") or "zip").lower()
+    if fmt not in ("zip", "tar"):
+        raise HTTPException(status_code=400, detail="不支持的归档格式")
+    if not isinstance(names, list) or not names:
+        raise HTTPException(status_code=400, detail="缺少文件列表")
+    if len(names) > ARCHIVE_MAX_ENTRIES:
+        raise HTTPException(status_code=413, detail="文件数量过多")
+    upload_dir = getattr(request.app.state, "upload_dir", get_upload_dir())
+    entries, missing = await run_blocking(collect_archive_entries, upload_dir, names)
+    if missing:
+        raise HTTPException(status_code=404, detail=f"文件不存在: {', '.join(missing[:10])}")
+    # 条目长度全部由已知大小推算，无需临时文件即可给出 Content-Length
+    if fmt == "zip":
+        length, content, media_type = plan_zip(entries), iter_zip(entries), "application/zip"
+    else:
+        length, content, media_type = plan_tar(entries), iter_tar(entries), "application/x-tar"
+    archive_name = str(data.get("filename") or f"archive.{fmt}")
+    headers = {
+        "Content-Length": str(length),
+        "Content-Disposition": f"attachment; filename*=UTF-8''{quote(archive_name)}",
+    }
+    response = StreamingResponse(shaped_download(request, content, length), media_type=media_type, headers=headers)
+    return await admit_download(response, length)
+
+class TarStreamReader:
+    """在异步请求体上按需读取定长数据，供 TAR 增量解析"""
+    def __init__(self, stream):
+        self.stream = stream.__aiter__()
+        self.buf = bytearray()
+        self.eof = False
+
+    async def fill(self, n: int) -> bool:
+        while len(self.buf) < n and not self.eof:
+            try:
+                chunk = await self.stream.__anext__()
+            except StopAsyncIteration:
+                self.eof = True
+                break
+            self.buf += chunk
+        return len(self.buf) >= n
+
+    async def read(self, n: int) -> bytes:
+        if not await self.fill(n):
+            raise HTTPException(status_code=400, detail="TAR 数据不完整")
+        data = bytes(self.buf[:n])
+        del self.buf[:n]
+        return data
+
+    async def iter_exact(self, n: int):
+        while n > 0:
+            if not self.buf and not await self.fill(1):
+                raise HTTPException(status_code=400, detail="TAR 数据不完整")
+            take = min(n, len(self.buf))
+            data = self.buf[:take]
+            del self.buf[:take]
+            n -= take
+            yield data
+
+    async def skip(self, n: int):
+        async for _ in self.iter_exact(n):
+            pass
+
+def parse_pax_records(data: bytes) -> dict:
+    """解析 PAX 扩展头：以换行结尾的 "长度 键=值" 记录序列"""
+    records = {}
+    pos = 0
+    while pos < len(data):
+        space = data.find(b" ", pos)
+        if space < 0:
+            break
+        try:
+            length = int(data[pos:space])
+        except ValueError:
+            raise HTTPException(status_code=400, detail="TAR 扩展头格式错误")
+        if length <= 0:
+            break
+        key, _, value = data[space + 1:pos + length - 1].partition(b"=")
+        records[key.decode("utf-8", "replace")] = value.decode("utf-8", "surrogateescape")
+        pos += length
+    return records
+
+def prepare_member_dir(upload_dir: str, path: str, directory: bool = False) -> bool:
+    """
+    为解包条目创建目录（directory=True 时为条目本身，否则为其父目录）；
+    经符号链接逃出上传目录、或普通文件的目标已是目录时返回 False（在 FS_EXECUTOR 中执行）
+    """
+    target = path if directory else os.path.dirname(path)
+    if not inside_upload_dir(upload_dir, target):
+        return False
+    try:
+        os.makedirs(target, exist_ok=True)
+    except OSError:
+        return False
+    return inside_upload_dir(upload_dir, target) and (directory or not os.path.isdir(path))
+
+async def receive_to_temp(chunks, directory: str, expected_size: Optional[int] = None) -> Tuple[str, int, str]:
+    """
+    把异步数据块写入 directory 下的隐藏临时文件：已知大小时预分配，小块合并为 PUT_WRITE_COALESCE 对齐的 pwrite，
+    超过 MAX_UPLOAD_SIZE 抛出 413。返回 (临时文件路径, 大小, sha256)；失败时删除临时文件。
+    """
+    tmp_path = upload_temp_path(directory)
+    fd = await run_blocking(os.open, tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
     try:
-        async with aiofiles.open(save_path, 'wb') as out_file:
-            # 保持与客户端流大小一致；若设置了 MAX_UPLOAD_SIZE，则进行累计校验
+        try:
+            if expected_size:
+                await run_blocking(preallocate_file, fd, expected_size)
+            h = hashlib.sha256()
+            offset = 0
             total_written = 0
-            async for chunk in request.stream():
-                os.makedirs(upload_dir, exist_ok=True)
-                await out_file.write(chunk)
+            pending = bytearray()
+            async for chunk in chunks:
                 total_written += len(chunk)
                 if MAX_UPLOAD_SIZE is not None and total_written > MAX_UPLOAD_SIZE:
                     raise HTTPException(status_code=413, detail="文件过大")
-                
-        file_url = f"http://obs.dimond.top/{filename}"
-        return Response(content=file_url, media_type="text/plain", status_code=201)
+                pending += chunk
+                if len(pending) >= PUT_WRITE_COALESCE:
+                    # 只写出 PUT_WRITE_COALESCE 的整数倍，余量留到下一轮，保证每次写入偏移对齐
+                    n = len(pending) - len(pending) % PUT_WRITE_COALESCE
+                    await run_blocking(hash_and_pwrite, fd, pending[:n], offset, h)
+                    del pending[:n]
+                    offset += n
+            if pending:
+                await run_blocking(hash_and_pwrite, fd, pending, offset, h)
+                offset += len(pending)
+            if expected_size is not None and offset != expected_size:
+                # 预分配大小与实际不符时截断到实际写入长度
+                await run_blocking(os.ftruncate, fd, offset)
+        finally:
+            await run_blocking(os.close, fd)
+    except BaseException:
+        await run_blocking(remove_file, tmp_path)
+        raise
+    return tmp_path, offset, h.hexdigest()
+
+async def extract_tar_stream(request: Request, upload_dir: str, prefix: str) -> dict:
+    """
+    边接收边解包 TAR（ustar / GNU 长文件名 / PAX）：普通文件经临时文件原子发布到上传目录，目录按需创建；
+    不安全路径（绝对路径、..、隐藏文件、经符号链接逃逸）以及链接、设备等条目跳过并在结果中列出。
+    """
+    reader = TarStreamReader(request_body(request))
+    extracted, skipped = [], []
+    total = 0
+    pax, global_pax = {}, {}
+    long_name = None
+    while True:
+        if not await reader.fill(tarfile.BLOCKSIZE):
+            if reader.buf:
+                raise HTTPException(status_code=400, detail="TAR 数据不完整")
+            break
+        block = await reader.read(tarfile.BLOCKSIZE)
+        if block == bytes(tarfile.BLOCKSIZE):
+            # 结束块：其后内容忽略
+            break
+        try:
+            info = tarfile.TarInfo.frombuf(block, "utf-8", "surrogateescape")
+        except tarfile.HeaderError:
+            raise HTTPException(status_code=400, detail="TAR 头部校验失败")
+        padded = info.size + (-info.size % tarfile.BLOCKSIZE)
+        if info.type in (tarfile.XHDTYPE, tarfile.XGLTYPE, tarfile.SOLARIS_XHDTYPE):
+            records = parse_pax_records((await reader.read(padded))[:info.size])
+            (global_pax if info.type == tarfile.XGLTYPE else pax).update(records)
+            continue
+        if info.type in (tarfile.GNUTYPE_LONGNAME, tarfile.GNUTYPE_LONGLINK):
+            data = (await reader.read(padded))[:info.size]
+            if info.type == tarfile.GNUTYPE_LONGNAME:
+                long_name = data.rstrip(b"\x00").decode("utf-8", "surrogateescape")
+            continue
+        attrs = {**global_pax, **pax}
+        name = attrs.get("path") or long_name or info.name
+        try:
+            size = int(attrs["size"]) if "size" in attrs else info.size
+        except ValueError:
+            raise HTTPException(status_code=400, detail="PAX size 字段非法")
+        if size < 0:
+            raise HTTPException(status_code=400, detail="PAX size 字段非法")
+        pax, long_name = {}, None
+        padding = -size % tarfile.BLOCKSIZE
+        member = f"{prefix}/{name}" if prefix else name
+        path = archive_member_path(upload_dir, member)
+        if info.type == tarfile.DIRTYPE:
+            if path is None or not await run_blocking(prepare_member_dir, upload_dir, path, True):
+                skipped.append(name)
+            await reader.skip(size + padding)
+            continue
+        if info.type not in (tarfile.REGTYPE, tarfile.AREGTYPE, tarfile.CONTTYPE) or path is None \
+                or not await run_blocking(prepare_member_dir, upload_dir, path):
+            skipped.append(name)
+            await reader.skip(size + padding)
+            continue
+        if MAX_UPLOAD_SIZE is not None and size > MAX_UPLOAD_SIZE:
+            raise HTTPException(status_code=413, detail=f"文件过大: {name}")
+        tmp_path, _, digest = await receive_to_temp(reader.iter_exact(size), os.path.dirname(path), size)
+        try:
+            await publish_upload(tmp_path, path, digest)
+        except BaseException:
+            await run_blocking(remove_file, tmp_path)
+            raise
+        await reader.skip(padding)
+        extracted.append(os.path.relpath(path, upload_dir).replace(os.sep, "/"))
+        total += size
+    return {"extracted": len(extracted), "files": extracted, "skipped": skipped, "bytes": total}
+
+@app.put("/archive/{prefix:path}")
+async def upload_archive(prefix: str, request: Request):
+    # PUT /archive/ 解包到上传目录根，PUT /archive/<目录> 解包到该子目录
+    upload_dir = getattr(request.app.state, "upload_dir", get_upload_dir())
+    prefix = unquote(prefix).strip("/")
+    if prefix and archive_member_path(upload_dir, prefix) is None:
+        raise HTTPException(status_code=400, detail="目标目录非法")
+    begin = time.perf_counter()
+    try:
+        await run_blocking(os.makedirs, upload_dir, exist_ok=True)
+        async with admitted(upload_gate(request)):
+            result = await extract_tar_stream(request, upload_dir, prefix)
+    except HTTPException:
+        raise
+    except OSError as e:
+        if e.errno == errno.ENOSPC:
+            raise HTTPException(status_code=507, detail="磁盘空间不足")
+        raise HTTPException(status_code=500, detail=f"解包失败: {str(e)}")
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"上传失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"解包失败: {str(e)}")
+    seconds = time.perf_counter() - begin
+    throughput = UPLOAD_METER.record(result["bytes"], seconds)
+    return JSONResponse(result, status_code=201, headers=throughput_headers(result["bytes"], seconds, throughput))
+
+def parse_range_header(range_header: str, file_size: int) -> List[Tuple[int, int]]:
+    """解析 RFC 7233 Range 头，返回按起点排序、已合并重叠/相邻区间的闭区间列表。
+
+    语法错误、单位不支持、所有区间都不可满足或合并后超过 MAX_RANGE_COUNT 时抛出 ValueError。
+    """
+    unit, _, spec = range_header.strip().partition("=")
+    if unit.strip().lower() != "bytes" or not spec.strip():
+        raise ValueError("不支持的 Range 单位")
+    ranges = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        first, sep, last = item.partition("-")
+        first, last = first.strip(), last.strip()
+        if not sep or (not first and not last):
+            raise ValueError(f"非法区间: {item}")
+        if not first:
+            # 后缀区间 bytes=-N
+            length = int(last)
+            if length <= 0:
+                continue
+            start, end = max(file_size - length, 0), file_size - 1
+        else:
+            start = int(first)
+            end = int(last) if last else file_size - 1
+            if start > end:
+                raise ValueError(f"非法区间: {item}")
+            end = min(end, file_size - 1)
+        if start >= file_size:
+            continue
+        ranges.append((start, end))
+    if not ranges:
+        raise ValueError("区间不可满足")
+    ranges.sort()
+    merged = [list(ranges[0])]
+    for start, end in ranges[1:]:
+        if start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    if len(merged) > MAX_RANGE_COUNT:
+        raise ValueError("区间数量过多")
+    return [(start, end) for start, end in merged]
+
+def file_etag(path: str, st: os.stat_result) -> str:
+    """
+    强 ETag：发布时即已知 sha256 的文件使用内容哈希，否则为 size+mtime+inode。
+    HASH_INDEXER 事后补齐的哈希不参与 ETag，同一版本文件的 ETag 始终不变，If-Range / If-None-Match 不会失配。
+    """
+    found = file_hash_entry(path, st)
+    if found and found[1]:
+        return f'"sha256-{found[0]}"'
+    return f'"{st.st_size:x}-{st.st_mtime_ns:x}-{st.st_ino:x}"'
+
+def etag_matches(header: str, etag: str, weak: bool = True) -> bool:
+    """If-None-Match（弱比较）/ If-Range（强比较）中的 ETag 列表是否匹配。"""
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return True
+        if tag.startswith("W/"):
+            if not weak:
+                continue
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+def not_modified_since(header: str, mtime: float) -> bool:
+    try:
+        since = parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError):
+        return False
+    return int(mtime) <= since
+
+def conditional_response(request: Request, etag: str, last_modified: str, mtime: float) -> Optional[Response]:
+    """按 If-None-Match（优先）与 If-Modified-Since 判断，命中时返回 304 响应。"""
+    validators = {"ETag": etag, "Last-Modified": last_modified}
+    if_none_match = request.headers.get("if-none-match")
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_none_match is not None:
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=validators)
+    elif if_modified_since and not_modified_since(if_modified_since, mtime):
+        return Response(status_code=304, headers=validators)
+    return None
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    """压缩变体使用独立的强 ETag。"""
+    return f'{etag[:-1]}-{encoding}"'
+
+def if_range_matches(header: str, etag: str, last_modified: str) -> bool:
+    """If-Range 只接受强 ETag 或与 Last-Modified 完全相同的日期。"""
+    header = header.strip()
+    if header.startswith('"') or header.startswith("W/"):
+        return etag_matches(header, etag, weak=False)
+    return header == last_modified
+
+@app.head("/{filename}")
+async def head_file(filename: str, request: Request):
+    filename = unquote(filename)
+    upload_dir = getattr(request.app.state, "upload_dir", get_upload_dir())
+    file_path = os.path.join(upload_dir, filename)
+    try:
+        st = STAT_CACHE.stat(file_path)
+    except OSError:
+        st = None
+    if st is None or not stat.S_ISREG(st.st_mode):
+        return Response(status_code=404)
+    etag = file_etag(file_path, st)
+    last_modified = formatdate(st.st_mtime, usegmt=True)
+    content_length = st.st_size
+    extra_headers = {}
+    if SidecarCompressor.compressible(file_path, st.st_size):
+        extra_headers["Vary"] = "Accept-Encoding"
+        variant = COMPRESSOR.negotiate(file_path, st, request.headers.get("accept-encoding"))
+        if variant is not None:
+            encoding, _, sidecar_st = variant
+            etag = encoded_etag(etag, encoding)
+            content_length = sidecar_st.st_size
+            extra_headers["Content-Encoding"] = encoding
+    not_modified = conditional_response(request, etag, last_modified, st.st_mtime)
+    if not_modified is not None:
+        not_modified.headers.update({k: v for k, v in extra_headers.items() if k == "Vary"})
+        return not_modified
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename)}",
+        "Content-Length": str(content_length),
+        "ETag": etag,
+        "Last-Modified": last_modified,
+        **extra_headers,
+    }
+    return Response(status_code=200, headers=headers, media_type="application/octet-stream")
 
 @app.get("/{filename}")
 async def download_file(filename: str, request: Request):
     filename = unquote(filename)
     upload_dir = getattr(request.app.state, "upload_dir", get_upload_dir())
     file_path = os.path.join(upload_dir, filename)
-    
-    if os.path.exists(file_path) and os.path.isfile(file_path):
+    cached = FILE_CACHE.get(file_path)
+    if cached is not None:
+        st = cached.st
+    else:
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            st = None
+
+    if st is not None and stat.S_ISREG(st.st_mode):
         encoded_filename = quote(filename)
-        file_size = os.path.getsize(file_path)
+        file_size = st.st_size
+        etag = file_etag(file_path, st)
+        last_modified = formatdate(st.st_mtime, usegmt=True)
         range_header = request.headers.get("range")
+        if_range = request.headers.get("if-range")
+        if range_header and if_range is not None and not if_range_matches(if_range, etag, last_modified):
+            # 文件已变化：忽略 Range，返回完整内容
+            range_header = None
+        # 透明压缩仅用于整文件响应；Range 始终针对原始字节
+        compressible = SidecarCompressor.compressible(file_path, file_size)
+        variant = None
+        if compressible and not range_header:
+            variant = COMPRESSOR.negotiate(file_path, st, request.headers.get("accept-encoding"))
+        if variant is not None:
+            etag = encoded_etag(etag, variant[0])
+        not_modified = conditional_response(request, etag, last_modified, st.st_mtime)
+        if not_modified is not None:
+            if compressible:
+                not_modified.headers["Vary"] = "Accept-Encoding"
+            return not_modified
         base_headers = {
             "Accept-Ranges": "bytes",
             "Content-Disposition": f"attachment; filename*=UTF-8''{encoded_filename}",
+            "ETag": etag,
+            "Last-Modified": last_modified,
         }
+        if compressible:
+            base_headers["Vary"] = "Accept-Encoding"
+        # 完整流式下载：池化缓冲区，分片自适应，上限 40MB
+        def iter_all(path, size, chunk_size=STREAM_DOWNLOAD_CHUNK_SIZE):
+            return shaped_download(request, iter_pooled_file(path, 0, size - 1, chunk_size), size)
+        if variant is not None:
+            encoding, sidecar_path, sidecar_st = variant
+            headers = {
+                **base_headers,
+                "Content-Encoding": encoding,
+                "Content-Length": str(sidecar_st.st_size),
+            }
+            response = ZeroCopyFileResponse(sidecar_path, 0, sidecar_st.st_size - 1, sidecar_st.st_size,
+                                            iter_all(sidecar_path, sidecar_st.st_size), status_code=200,
+                                            headers=headers, media_type="application/octet-stream")
+            return await admit_download(response, sidecar_st.st_size)
+        if cached is None and FILE_CACHE.accepts(file_size):
+            # 小文件未命中：整体读入并放入缓存，后续请求不再访问磁盘
+            async with aiofiles.open(file_path, "rb", executor=FS_EXECUTOR) as f:
+                data = await f.read()
+            if len(data) == file_size:
+                cached = FILE_CACHE.put(file_path, st, data)
         if range_header:
             try:
-                unit, rng = range_header.strip().split("=")
-                if unit != "bytes":
-                    raise ValueError()
-                if "," in rng:
-                    raise ValueError()
-                if rng.startswith("-"):
-                    length = int(rng[1:])
-                    start = max(file_size - length, 0)
-                    end = file_size - 1
-                else:
-                    parts = rng.split("-")
-                    start = int(parts[0]) if parts[0] else 0
-                    end = int(parts[1]) if len(parts) > 1 and parts[1] != "" else file_size - 1
-                if start > end or start >= file_size:
-                    return Response(
-                        status_code=416,
-                        headers={**base_headers, "Content-Range": f"bytes */{file_size}"}
-                    )
-                async def iterfile(path, start_pos, end_pos, chunk_size=RANGE_DOWNLOAD_CHUNK_SIZE):
-                    async with aiofiles.open(path, "rb") as f:
-                        await f.seek(start_pos)
-                        remain = end_pos - start_pos + 1
-                        while remain > 0:
-                            read_size = min(chunk_size, remain)
-                            data = await f.read(read_size)
-                            if not data:
-                                break
-                            remain -= len(data)
-                            yield data
+                ranges = parse_range_header(range_header, file_size)
+            except ValueError:
+                return Response(
+                    status_code=416,
+                    headers={**base_headers, "Content-Range": f"bytes */{file_size}"}
+                )
+            async def iterfile(path, start_pos, end_pos, chunk_size=RANGE_DOWNLOAD_CHUNK_SIZE):
+                if cached is not None:
+                    yield memoryview(cached.data)[start_pos:end_pos + 1]
+                    return
+                mapped = MMAP_POOL.acquire(path, st) if MMAP_RANGE_SERVING else None
+                if mapped is not None:
+                    view = memoryview(mapped.mm)
+                    try:
+                        pos = start_pos
+                        while pos <= end_pos:
+                            size = min(chunk_size, end_pos - pos + 1)
+                            if hasattr(mmap, "MADV_WILLNEED"):
+                                # 预读下一片，减少在事件循环线程上发生缺页阻塞
+                                aligned = pos - pos % mmap.ALLOCATIONGRANULARITY
+                                mapped.mm.madvise(mmap.MADV_WILLNEED, aligned, pos + size - aligned)
+                            piece = view[pos:pos + size]
+                            try:
+                                yield piece
+                            finally:
+                                # 恢复执行时该片已发送完毕；释放全部视图后映射才能被关闭
+                                piece.release()
+                            pos += size
+                    finally:
+                        view.release()
+                        MMAP_POOL.release(mapped)
+                    return
+                async for data in iter_pooled_file(path, start_pos, end_pos, chunk_size):
+                    yield data
+            if len(ranges) == 1:
+                start, end = ranges[0]
                 headers = {
                     **base_headers,
                     "Content-Range": f"bytes {start}-{end}/{file_size}",
                     "Content-Length": str(end - start + 1),
                 }
-                return StreamingResponse(iterfile(file_path, start, end), status_code=206, headers=headers, media_type="application/octet-stream")
-            except Exception:
-                return Response(
-                    status_code=416,
-                    headers={**base_headers, "Content-Range": f"bytes */{file_size}"}
-                )
-        else:
-            # 使用 40MB 分片进行完整流式下载
-            async def iter_all(path, chunk_size=STREAM_DOWNLOAD_CHUNK_SIZE):
-                async with aiofiles.open(path, "rb") as f:
-                    while True:
-                        data = await f.read(chunk_size)
-                        if not data:
-                            break
+                if cached is not None and not BANDWIDTH.enabled():
+                    return Response(content=cached.data[start:end + 1], status_code=206, headers=headers,
+                                    media_type="application/octet-stream")
+                response = ZeroCopyFileResponse(file_path, start, end, file_size,
+                                                shaped_download(request, iterfile(file_path, start, end), end - start + 1),
+                                                status_code=206, headers=headers, media_type="application/octet-stream")
+                return await admit_download(response, 0 if cached is not None else end - start + 1)
+            # 多区间：流式输出 multipart/byteranges，每段复用 iterfile
+            boundary = secrets.token_hex(16)
+            part_heads = [
+                (f"--{boundary}\r\nContent-Type: application/octet-stream\r\n"
+                 f"Content-Range: bytes {start}-{end}/{file_size}\r\n\r\n").encode("latin-1")
+                for start, end in ranges
+            ]
+            tail = f"--{boundary}--\r\n".encode("latin-1")
+            content_length = len(tail) + sum(
+                len(head) + (end - start + 1) + 2 for head, (start, end) in zip(part_heads, ranges)
+            )
+            async def iter_multipart(path):
+                for head, (start_pos, end_pos) in zip(part_heads, ranges):
+                    yield head
+                    async for data in iterfile(path, start_pos, end_pos):
                         yield data
+                    yield b"\r\n"
+                yield tail
+            headers = {
+                **base_headers,
+                "Content-Length": str(content_length),
+            }
+            response = StreamingResponse(shaped_download(request, iter_multipart(file_path), content_length),
+                                         status_code=206, headers=headers,
+                                         media_type=f"multipart/byteranges; boundary={boundary}")
+            return await admit_download(response, 0 if cached is not None else content_length)
+        else:
             headers = {
                 **base_headers,
                 "Content-Length": str(file_size),
             }
-            return StreamingResponse(iter_all(file_path), status_code=200, headers=headers, media_type="application/octet-stream")
+            if cached is not None and BANDWIDTH.enabled():
+                return StreamingResponse(shaped_download(request, iter_bytes(cached.data), file_size),
+                                         status_code=200, headers=headers, media_type="application/octet-stream")
+            if cached is not None:
+                return Response(content=cached.data, status_code=200, headers=headers,
+                                media_type="application/octet-stream")
+            response = ZeroCopyFileResponse(file_path, 0, file_size - 1, file_size, iter_all(file_path, file_size),
+                                            status_code=200, headers=headers, media_type="application/octet-stream")
+            return await admit_download(response, file_size)
     else:
         raise HTTPException(status_code=404, detail="File not found")
 
@@ -936,9 +4901,13 @@ async def delete_file(filename: str, request: Request):
     upload_dir = getattr(request.app.state, "upload_dir", get_upload_dir())
     file_path = os.path.join(upload_dir, filename)
     
-    if os.path.exists(file_path) and os.path.isfile(file_path):
+    if await run_blocking(os.path.isfile, file_path):
         try:
-            os.remove(file_path)
+            st = await run_blocking(remove_file, file_path)
+            await invalidate_file_caches(file_path)
+            await run_blocking(forget_file_hash, file_path)
+            if st is not None:
+                await run_blocking(BLOB_STORE.release, st)
             return Response(content="Deleted", status_code=200)
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Delete failed: {str(e)}")
@@ -950,10 +4919,13 @@ if __name__ == "__main__":
     print(f"文件托管服务器启动: http://localhost:{PORT}", flush=True)
     print(f"上传命令示例: curl --upload-file your-file.wav http://obs.dimond.top/your-file.wav", flush=True)
     print(f"文件保存目录: {os.path.abspath(UPLOAD_DIR)}", flush=True)
+    zero_copy = ZERO_COPY_DOWNLOAD and ZeroCopyHttpProtocol is not None
     uvicorn.run(
         app,
         host="0.0.0.0",
         port=PORT,
+        http=ZeroCopyHttpProtocol if zero_copy else "auto",
+        loop="asyncio" if zero_copy else "auto",
         limit_concurrency=UVICORN_CONFIG["limit_concurrency"],
         limit_max_requests=UVICORN_CONFIG["limit_max_requests"],
         timeout_keep_alive=UVICORN_CONFIG["timeout_keep_alive"],
@@ -0,0 +1,162 @@
+import os
+import io
+import time
+import shutil
+import tarfile
+import zipfile
+import threading
+import requests
+import pytest
+
+# 测试端口与目录
+TEST_PORT = 8095
+TEST_DIR = "test_obs_archive"
+os.environ["PORT"] = str(TEST_PORT)
+os.environ["UPLOAD_DIR"] = TEST_DIR
+
+from server import app
+
+BASE_URL = f"http://localhost:{TEST_PORT}"
+
+def run_server():
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=TEST_PORT)
+
+@pytest.fixture(scope="module", autouse=True)
+def setup_teardown():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    server_thread = threading.Thread(target=run_server, daemon=True)
+    server_thread.start()
+    time.sleep(2)
+    yield
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+
+FILES = {
+    "a.txt": b"alpha",
+    "empty.bin": b"",
+    "报告.txt": "中文内容".encode(),
+    "big.bin": os.urandom(3 * 1024 * 1024 + 17),
+}
+
+def put_files():
+    for name, data in FILES.items():
+        assert requests.put(f"{BASE_URL}/{name}", data=data, timeout=10).status_code == 201
+
+def test_archive_zip_streams_with_exact_length():
+    put_files()
+    resp = requests.post(f"{BASE_URL}/archive", json={"names": list(FILES)}, timeout=30)
+    assert resp.status_code == 200
+    assert resp.headers["Content-Type"] == "application/zip"
+    assert int(resp.headers["Content-Length"]) == len(resp.content)
+    with zipfile.ZipFile(io.BytesIO(resp.content)) as zf:
+        assert zf.testzip() is None
+        assert zf.namelist() == list(FILES)
+        for name, data in FILES.items():
+            assert zf.read(name) == data
+
+def test_archive_zip64_records(monkeypatch):
+    import server
+    put_files()
+    # 调低阈值以在小文件上走 zip64 分支，由标准库校验扩展字段
+    monkeypatch.setattr(server, "ZIP64_LIMIT", 1024)
+    resp = requests.post(f"{BASE_URL}/archive", json={"names": list(FILES)}, timeout=30)
+    assert resp.status_code == 200
+    assert int(resp.headers["Content-Length"]) == len(resp.content)
+    with zipfile.ZipFile(io.BytesIO(resp.content)) as zf:
+        assert zf.testzip() is None
+        for name, data in FILES.items():
+            assert zf.read(name) == data
+
+def test_archive_tar_and_missing_names():
+    put_files()
+    resp = requests.post(f"{BASE_URL}/archive", json={"names": list(FILES), "format": "tar"}, timeout=30)
+    assert resp.status_code == 200
+    assert int(resp.headers["Content-Length"]) == len(resp.content)
+    with tarfile.open(fileobj=io.BytesIO(resp.content)) as tf:
+        assert tf.getnames() == list(FILES)
+        for name, data in FILES.items():
+            assert tf.extractfile(name).read() == data
+
+    for names in (["a.txt", "nope.txt"], ["../server.py"], [".sidecars/a.txt.sha256"], []):
+        resp = requests.post(f"{BASE_URL}/archive", json={"names": names}, timeout=10)
+        assert resp.status_code in (400, 404)
+    resp = requests.post(f"{BASE_URL}/archive", json={"names": ["a.txt"], "format": "rar"}, timeout=10)
+    assert resp.status_code == 400
+
+def build_tar() -> bytes:
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w", format=tarfile.PAX_FORMAT) as tf:
+        def add(name, data=b"", kind=tarfile.REGTYPE, linkname=""):
+            info = tarfile.TarInfo(name)
+            info.type = kind
+            info.size = len(data)
+            info.linkname = linkname
+            tf.addfile(info, io.BytesIO(data))
+        add("docs", kind=tarfile.DIRTYPE)
+        add("docs/readme.md", b"# readme")
+        add("docs/" + "长" * 80 + ".txt", b"long name")
+        add("big.dat", os.urandom(2 * 1024 * 1024 + 3))
+        add("../escape.txt", b"evil")
+        add("/abs.txt", b"evil")
+        add(".hidden", b"evil")
+        add("link", kind=tarfile.SYMTYPE, linkname="/etc/passwd")
+    return buf.getvalue()
+
+def test_put_archive_extracts_incrementally_with_traversal_guard():
+    data = build_tar()
+
+    def body():
+        for i in range(0, len(data), 7000):
+            yield data[i:i + 7000]
+
+    resp = requests.put(f"{BASE_URL}/archive/", data=body(), timeout=30)
+    assert resp.status_code == 201, resp.text
+    result = resp.json()
+    long_name = "docs/" + "长" * 80 + ".txt"
+    assert sorted(result["files"]) == sorted(["docs/readme.md", long_name, "big.dat"])
+    assert set(result["skipped"]) == {"../escape.txt", "/abs.txt", ".hidden", "link"}
+    assert "X-Upload-Throughput" in resp.headers
+    with open(os.path.join(TEST_DIR, "docs", "readme.md"), "rb") as f:
+        assert f.read() == b"# readme"
+    with tarfile.open(fileobj=io.BytesIO(data)) as tf:
+        assert open(os.path.join(TEST_DIR, "big.dat"), "rb").read() == tf.extractfile("big.dat").read()
+    assert not os.path.exists(os.path.join(os.path.dirname(os.path.abspath(TEST_DIR)), "escape.txt"))
+    assert not os.path.exists("/abs.txt")
+    assert not os.path.exists(os.path.join(TEST_DIR, ".hidden"))
+    assert not os.path.lexists(os.path.join(TEST_DIR, "link"))
+    assert not [n for n in os.listdir(TEST_DIR) if n.startswith(".upload-")]
+
+    # 解包结果可整体打包取回
+    resp = requests.post(f"{BASE_URL}/archive", json={"names": result["files"]}, timeout=30)
+    with zipfile.ZipFile(io.BytesIO(resp.content)) as zf:
+        assert zf.read("docs/readme.md") == b"# readme"
+        assert zf.read(long_name) == b"long name"
+
+def test_put_archive_into_subdir_and_rejects_bad_input():
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w") as tf:
+        info = tarfile.TarInfo("note.txt")
+        info.size = 4
+        tf.addfile(info, io.BytesIO(b"note"))
+    resp = requests.put(f"{BASE_URL}/archive/inbox", data=buf.getvalue(), timeout=10)
+    assert resp.status_code == 201
+    assert resp.json()["files"] == ["inbox/note.txt"]
+    assert open(os.path.join(TEST_DIR, "inbox", "note.txt"), "rb").read() == b"note"
+
+    assert requests.put(f"{BASE_URL}/archive/.chunks", data=buf.getvalue(), timeout=10).status_code == 400
+    # PAX 扩展头中非法的 size 按坏请求处理
+    bad = io.BytesIO()
+    with tarfile.open(fileobj=bad, mode="w", format=tarfile.PAX_FORMAT) as tf:
+        info = tarfile.TarInfo("bad.txt")
+        info.size = 4
+        info.pax_headers = {"size": "12abc"}
+        tf.addfile(info, io.BytesIO(b"oops"))
+    assert requests.put(f"{BASE_URL}/archive/", data=bad.getvalue(), timeout=10).status_code == 400
+    assert requests.put(f"{BASE_URL}/archive/", data=b"x" * 700, timeout=10).status_code == 400
+    # 截断的 TAR：已开始的条目不会留下半截文件
+    resp = requests.put(f"{BASE_URL}/archive/cut", data=buf.getvalue()[:514], timeout=10)
+    assert resp.status_code == 400
+    assert not os.path.exists(os.path.join(TEST_DIR, "cut", "note.txt"))
+    assert not [n for n in os.listdir(os.path.join(TEST_DIR, "cut")) if n.startswith(".upload-")]
@@ -0,0 +1,587 @@
+import os
+import threading
+import time
+import asyncio
+import requests
+import pytest
+
+# 测试端口与目录
+TEST_PORT = 8093
+TEST_DIR = "test_obs_download"
+os.environ["PORT"] = str(TEST_PORT)
+os.environ["UPLOAD_DIR"] = TEST_DIR
+
+from server import app
+
+BASE_URL = f"http://localhost:{TEST_PORT}"
+
+def run_server():
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=TEST_PORT)
+
+@pytest.fixture(scope="module", autouse=True)
+def setup_teardown():
+    if os.path.exists(TEST_DIR):
+        import shutil
+        shutil.rmtree(TEST_DIR)
+    server_thread = threading.Thread(target=run_server, daemon=True)
+    server_thread.start()
+    time.sleep(2)
+    yield
+    if os.path.exists(TEST_DIR):
+        import shutil
+        shutil.rmtree(TEST_DIR)
+
+def asgi_request(path: str, headers=None, extensions=None, method: str = "GET"):
+    """直接调用 ASGI 应用，模拟声明了指定扩展的服务器，返回收到的全部消息。"""
+    messages = []
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": "2.4"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()],
+        "client": ("127.0.0.1", 12345),
+        "server": ("127.0.0.1", TEST_PORT),
+        "extensions": extensions or {},
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.zerocopysend":
+            f = message["file"]
+            f.seek(message["offset"])
+            message = {**message, "data": f.read(message["count"])}
+        elif "body" in message:
+            # 与真实服务器一致：send 返回前用完数据，响应方随后可释放 mmap 视图
+            message = {**message, "body": bytes(message["body"])}
+        messages.append(message)
+
+    asyncio.run(app(scope, receive, send))
+    return messages
+
+@pytest.fixture
+def no_file_cache(monkeypatch):
+    # 关闭小文件缓存，确保请求走文件发送路径
+    from server import FILE_CACHE
+    monkeypatch.setattr(FILE_CACHE, "max_bytes", 0)
+
+def test_zerocopysend_full_and_range(no_file_cache):
+    filename = "zerocopy.bin"
+    data = bytes(range(256)) * 400
+    assert requests.put(f"{BASE_URL}/{filename}", data=data, timeout=10).status_code == 201
+    ext = {"http.response.zerocopysend": {}}
+    # 完整下载：单条 zerocopysend 消息覆盖整个文件
+    msgs = asgi_request(f"/{filename}", extensions=ext)
+    start = msgs[0]
+    assert start["status"] == 200
+    assert (b"content-length", str(len(data)).encode()) in start["headers"]
+    assert [m["type"] for m in msgs[1:]] == ["http.response.zerocopysend"]
+    assert msgs[1]["data"] == data
+    # Range 下载：offset/count 与 Content-Range 一致
+    msgs = asgi_request(f"/{filename}", headers={"Range": "bytes=100-1099"}, extensions=ext)
+    assert msgs[0]["status"] == 206
+    assert (b"content-range", f"bytes 100-1099/{len(data)}".encode()) in msgs[0]["headers"]
+    assert msgs[1]["offset"] == 100 and msgs[1]["count"] == 1000
+    assert msgs[1]["data"] == data[100:1100]
+
+def test_pathsend_only_for_whole_file(no_file_cache):
+    filename = "pathsend.bin"
+    data = b"P" * 5000
+    assert requests.put(f"{BASE_URL}/{filename}", data=data, timeout=10).status_code == 201
+    ext = {"http.response.pathsend": {}}
+    msgs = asgi_request(f"/{filename}", extensions=ext)
+    assert msgs[1]["type"] == "http.response.pathsend"
+    assert os.path.samefile(msgs[1]["path"], os.path.join(TEST_DIR, filename))
+    # pathsend 无法表达区间，Range 请求回退到生成器
+    msgs = asgi_request(f"/{filename}", headers={"Range": "bytes=0-9"}, extensions=ext)
+    body = b"".join(m.get("body", b"") for m in msgs if m["type"] == "http.response.body")
+    assert body == data[:10]
+
+def test_fallback_stream_without_extensions():
+    filename = "fallback.bin"
+    data = b"F" * 3000
+    assert requests.put(f"{BASE_URL}/{filename}", data=data, timeout=10).status_code == 201
+    resp = requests.get(f"{BASE_URL}/{filename}", timeout=10)
+    assert resp.status_code == 200
+    assert resp.content == data
+    resp = requests.get(f"{BASE_URL}/{filename}", headers={"Range": "bytes=-10"}, timeout=10)
+    assert resp.status_code == 206
+    assert resp.content == data[-10:]
+
+@pytest.mark.parametrize("loop_name,port", [("asyncio", 8096), ("uvloop", 8097)])
+def test_zero_copy_protocol_under_uvicorn(no_file_cache, monkeypatch, loop_name, port):
+    import uvicorn
+    from server import ZeroCopyHttpProtocol
+    if ZeroCopyHttpProtocol is None:
+        pytest.skip("未安装 httptools")
+    calls = []
+    real_sendfile = asyncio.BaseEventLoop.sendfile
+
+    async def counting_sendfile(self, transport, file, offset=0, count=None, **kwargs):
+        calls.append((offset, count))
+        return await real_sendfile(self, transport, file, offset, count, **kwargs)
+
+    monkeypatch.setattr(asyncio.BaseEventLoop, "sendfile", counting_sendfile)
+    # 后台服务已由模块级服务器的 lifespan 启动，这里关闭 lifespan 避免重复启动
+    config = uvicorn.Config(app, host="127.0.0.1", port=port, http=ZeroCopyHttpProtocol, loop=loop_name,
+                            lifespan="off", log_level="warning")
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    try:
+        while not server.started:
+            time.sleep(0.05)
+        filename = f"zerocopy-{loop_name}.bin"
+        data = os.urandom(3 * 1024 * 1024 + 17)
+        assert requests.put(f"{BASE_URL}/{filename}", data=data, timeout=10).status_code == 201
+        url = f"http://127.0.0.1:{port}/{filename}"
+        with requests.Session() as s:
+            # 同一 keep-alive 连接上连续完成整文件、区间与 HEAD 请求
+            resp = s.get(url, timeout=10)
+            assert resp.status_code == 200 and resp.content == data
+            resp = s.get(url, headers={"Range": "bytes=100-1099"}, timeout=10)
+            assert resp.status_code == 206 and resp.content == data[100:1100]
+            resp = s.head(url, timeout=10)
+            assert resp.status_code == 200 and resp.headers["Content-Length"] == str(len(data))
+            assert s.get(f"http://127.0.0.1:{port}/stats/loop", timeout=10).status_code == 200
+        if loop_name == "asyncio":
+            assert calls == [(0, len(data)), (100, 1000)]
+        else:
+            # uvloop 未实现 loop.sendfile，走分片读回退
+            assert calls == []
+    finally:
+        server.should_exit = True
+        thread.join(timeout=10)
+
+def parse_multipart_byteranges(resp):
+    ctype = resp.headers["Content-Type"]
+    assert ctype.startswith("multipart/byteranges; boundary=")
+    boundary = ctype.split("boundary=", 1)[1].encode()
+    parts = []
+    for block in resp.content.split(b"--" + boundary)[1:]:
+        if block.startswith(b"--"):
+            break
+        head, _, body = block.lstrip(b"\r\n").partition(b"\r\n\r\n")
+        content_range = [l for l in head.split(b"\r\n") if l.lower().startswith(b"content-range:")][0]
+        parts.append((content_range.split(b":", 1)[1].strip().decode(), body[:-2]))
+    return parts
+
+def test_multi_range_download():
+    filename = "multirange.bin"
+    data = bytes(range(256)) * 100
+    total = len(data)
+    assert requests.put(f"{BASE_URL}/{filename}", data=data, timeout=10).status_code == 201
+    resp = requests.get(f"{BASE_URL}/{filename}", headers={"Range": "bytes=0-9, 100-199, -5"}, timeout=10)
+    assert resp.status_code == 206
+    assert int(resp.headers["Content-Length"]) == len(resp.content)
+    parts = parse_multipart_byteranges(resp)
+    assert parts == [
+        (f"bytes 0-9/{total}", data[0:10]),
+        (f"bytes 100-199/{total}", data[100:200]),
+        (f"bytes {total - 5}-{total - 1}/{total}", data[-5:]),
+    ]
+
+def test_multi_range_merge_and_limits():
+    filename = "multirange_merge.bin"
+    data = b"M" * 10000
+    assert requests.put(f"{BASE_URL}/{filename}", data=data, timeout=10).status_code == 201
+    # 重叠与相邻区间合并为单区间，按普通 206 返回
+    resp = requests.get(f"{BASE_URL}/{filename}", headers={"Range": "bytes=50-99,0-49,80-120"}, timeout=10)
+    assert resp.status_code == 206
+    assert resp.headers["Content-Range"] == "bytes 0-120/10000"
+    assert resp.content == data[:121]
+    # 超过区间数上限返回 416
+    many = ",".join(f"{i * 10}-{i * 10 + 1}" for i in range(100))
+    resp = requests.get(f"{BASE_URL}/{filename}", headers={"Range": f"bytes={many}"}, timeout=10)
+    assert resp.status_code == 416
+    # 全部不可满足
+    resp = requests.get(f"{BASE_URL}/{filename}", headers={"Range": "bytes=20000-,30000-30010"}, timeout=10)
+    assert resp.status_code == 416
+
+def test_conditional_get_validators():
+    filename = "conditional.bin"
+    data = b"C" * 4096
+    assert requests.put(f"{BASE_URL}/{filename}", data=data, timeout=10).status_code == 201
+    resp = requests.get(f"{BASE_URL}/{filename}", timeout=10)
+    etag = resp.headers["ETag"]
+    last_modified = resp.headers["Last-Modified"]
+    assert etag.startswith('"') and not etag.startswith('W/')
+    # If-None-Match 命中返回 304 且无正文
+    resp = requests.get(f"{BASE_URL}/{filename}", headers={"If-None-Match": etag}, timeout=10)
+    assert resp.status_code == 304
+    assert resp.content == b""
+    assert resp.headers["ETag"] == etag
+    resp = requests.get(f"{BASE_URL}/{filename}", headers={"If-Modified-Since": last_modified}, timeout=10)
+    assert resp.status_code == 304
+    # If-None-Match 不匹配时忽略 If-Modified-Since
+    resp = requests.get(f"{BASE_URL}/{filename}",
+                        headers={"If-None-Match": '"other"', "If-Modified-Since": last_modified}, timeout=10)
+    assert resp.status_code == 200 and resp.content == data
+    # HEAD 同样返回校验器与长度
+    resp = requests.head(f"{BASE_URL}/{filename}", timeout=10)
+    assert resp.status_code == 200
+    assert resp.headers["ETag"] == etag
+    assert int(resp.headers["Content-Length"]) == len(data)
+    resp = requests.head(f"{BASE_URL}/{filename}", headers={"If-None-Match": etag}, timeout=10)
+    assert resp.status_code == 304
+
+def test_if_range_detects_changed_file():
+    filename = "ifrange.bin"
+    assert requests.put(f"{BASE_URL}/{filename}", data=b"A" * 1000, timeout=10).status_code == 201
+    etag = requests.head(f"{BASE_URL}/{filename}", timeout=10).headers["ETag"]
+    resp = requests.get(f"{BASE_URL}/{filename}", headers={"Range": "bytes=10-19", "If-Range": etag}, timeout=10)
+    assert resp.status_code == 206 and resp.content == b"A" * 10
+    # 文件被替换后 If-Range 失配，返回完整新内容
+    time.sleep(0.01)
+    assert requests.put(f"{BASE_URL}/{filename}", data=b"B" * 1200, timeout=10).status_code == 201
+    resp = requests.get(f"{BASE_URL}/{filename}", headers={"Range": "bytes=10-19", "If-Range": etag}, timeout=10)
+    assert resp.status_code == 200
+    assert resp.content == b"B" * 1200
+
+def test_etag_reuses_resumable_sha256():
+    import hashlib
+    filename = "etag_sha.bin"
+    data = b"S" * 9000
+    digest = hashlib.sha256(data).hexdigest()
+    meta = {"filename": filename, "size": len(data), "hash_algo": "sha256", "hash": digest,
+            "chunk_size": 9000, "total_chunks": 1}
+    upload_id = requests.post(f"{BASE_URL}/upload/init", json=meta, timeout=10).json()["upload_id"]
+    assert requests.put(f"{BASE_URL}/upload/chunk/{upload_id}/0", data=data, timeout=10).status_code == 201
+    assert requests.post(f"{BASE_URL}/upload/complete/{upload_id}", json=meta, timeout=10).status_code == 200
+    resp = requests.head(f"{BASE_URL}/{filename}", timeout=10)
+    assert resp.headers["ETag"] == f'"sha256-{digest}"'
+
+def test_etag_stable_when_hash_indexed_later():
+    import hashlib
+    import server
+    filename = "etag_indexed.bin"
+    data = b"X" * 7000
+    path = os.path.join(TEST_DIR, filename)
+    # 带外放入的文件：发布时哈希未知，ETag 为 stat 形式
+    with open(path, "wb") as f:
+        f.write(data)
+    server.FILE_INDEX.refresh(path)
+    etag = requests.head(f"{BASE_URL}/{filename}", timeout=10).headers["ETag"]
+    assert not etag.startswith('"sha256-')
+    probe = {"filename": filename, "size": len(data), "hash_algo": "sha256",
+             "hash": hashlib.sha256(data).hexdigest(), "probe": True}
+    assert requests.post(f"{BASE_URL}/upload/init", json=probe, timeout=10).json()["skip"] is False
+    deadline = time.time() + 5
+    while server.known_file_hash(path, os.stat(path)) is None and time.time() < deadline:
+        time.sleep(0.05)
+    assert server.known_file_hash(path, os.stat(path)) is not None
+    # 后台补齐哈希后同一版本的 ETag 不变，此前拿到的 ETag 仍可用于 If-Range
+    assert requests.head(f"{BASE_URL}/{filename}", timeout=10).headers["ETag"] == etag
+    resp = requests.get(f"{BASE_URL}/{filename}", headers={"Range": "bytes=0-9", "If-Range": etag}, timeout=10)
+    assert resp.status_code == 206 and resp.content == data[:10]
+    # 内存索引丢失后从旁路文件读回，仍保持 stat 形式
+    server.KNOWN_FILE_HASHES.clear()
+    assert requests.head(f"{BASE_URL}/{filename}", timeout=10).headers["ETag"] == etag
+
+def test_small_file_cache_hits_and_invalidation():
+    filename = "cached_small.txt"
+    assert requests.put(f"{BASE_URL}/{filename}", data=b"version-1", timeout=10).status_code == 201
+    before = requests.get(f"{BASE_URL}/stats/cache", timeout=10).json()
+    assert requests.get(f"{BASE_URL}/{filename}", timeout=10).content == b"version-1"
+    assert requests.get(f"{BASE_URL}/{filename}", headers={"Range": "bytes=0-6"}, timeout=10).content == b"version"
+    after = requests.get(f"{BASE_URL}/stats/cache", timeout=10).json()
+    assert after["hits"] >= before["hits"] + 1
+    assert after["misses"] >= before["misses"] + 1
+    # 命中后即使磁盘文件被带外删除，仍从内存返回（证明不访问磁盘）
+    path = os.path.join(TEST_DIR, filename)
+    with open(path, "rb") as f:
+        on_disk = f.read()
+    os.remove(path)
+    assert requests.get(f"{BASE_URL}/{filename}", timeout=10).content == on_disk
+    # PUT 覆盖后缓存失效
+    assert requests.put(f"{BASE_URL}/{filename}", data=b"version-2", timeout=10).status_code == 201
+    assert requests.get(f"{BASE_URL}/{filename}", timeout=10).content == b"version-2"
+    # DELETE 后不再命中
+    assert requests.delete(f"{BASE_URL}/{filename}", timeout=10).status_code == 200
+    assert requests.get(f"{BASE_URL}/{filename}", timeout=10).status_code == 404
+
+def test_file_cache_lru_eviction():
+    from server import FileCache
+    cache = FileCache(max_bytes=10, max_object_size=6)
+    st = os.stat(__file__)
+    cache.put("a", st, b"aaaa")
+    cache.put("b", st, b"bbbb")
+    assert cache.get("a") is not None  # a 变为最近使用
+    cache.put("c", st, b"cccc")       # 超出预算，淘汰最久未用的 b
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert not cache.accepts(7)
+    stats = cache.stats()
+    assert stats["evictions"] == 1 and stats["bytes"] == 8
+
+def test_mmap_range_serving_and_replacement():
+    filename = "mmap_ranges.bin"
+    data = os.urandom(3 * 1024 * 1024)  # 超过小文件缓存上限，走 mmap 路径
+    assert requests.put(f"{BASE_URL}/{filename}", data=data, timeout=10).status_code == 201
+    before = requests.get(f"{BASE_URL}/stats/mmap", timeout=10).json()
+    for start in (0, 4096, 2 * 1024 * 1024 + 17):
+        resp = requests.get(f"{BASE_URL}/{filename}", headers={"Range": f"bytes={start}-{start + 9999}"}, timeout=10)
+        assert resp.status_code == 206
+        assert resp.content == data[start:start + 10000]
+    resp = requests.get(f"{BASE_URL}/{filename}", headers={"Range": "bytes=0-9,1048576-1048585"}, timeout=10)
+    assert resp.status_code == 206
+    after = requests.get(f"{BASE_URL}/stats/mmap", timeout=10).json()
+    assert after["mapped"] == before["mapped"] + 1
+    assert after["reused"] >= before["reused"] + 3
+    assert after["in_use"] == 0
+    # 替换文件后映射退役并真正关闭（所有视图已释放），新请求看到新内容
+    from server import MMAP_POOL
+    old = MMAP_POOL.entries[os.path.abspath(os.path.join(TEST_DIR, filename))]
+    new_data = os.urandom(2 * 1024 * 1024)
+    assert requests.put(f"{BASE_URL}/{filename}", data=new_data, timeout=10).status_code == 201
+    assert old.mm.closed
+    resp = requests.get(f"{BASE_URL}/{filename}", headers={"Range": "bytes=100-199"}, timeout=10)
+    assert resp.content == new_data[100:200]
+    assert requests.get(f"{BASE_URL}/stats/mmap", timeout=10).json()["mapped"] == after["mapped"] + 1
+
+def test_mmap_closed_when_replaced_during_download(rate_limit, no_file_cache):
+    from server import MMAP_POOL
+    filename = "mmap_inflight.bin"
+    data = os.urandom(512 * 1024)
+    assert requests.put(f"{BASE_URL}/{filename}", data=data, timeout=10).status_code == 201
+    # 限速让响应生成器在发送途中保持挂起
+    assert rate_limit(global_bps=512 * 1024, burst_seconds=0.1).status_code == 200
+    resp = requests.get(f"{BASE_URL}/{filename}", headers={"Range": f"bytes=0-{len(data) - 2}"},
+                        stream=True, timeout=10)
+    first = resp.raw.read(1024)
+    mapped = MMAP_POOL.entries[os.path.abspath(os.path.join(TEST_DIR, filename))]
+    # 下载进行中替换文件：映射只退役，最后一个读者结束时关闭
+    assert requests.put(f"{BASE_URL}/{filename}", data=b"new", timeout=10).status_code == 201
+    assert mapped.retired and not mapped.mm.closed
+    assert first + resp.raw.read() == data[:-1]
+    for _ in range(50):
+        if mapped.mm.closed:
+            break
+        time.sleep(0.02)
+    assert mapped.mm.closed
+
+def test_mmap_pool_refcount_and_retire(tmp_path):
+    from server import MmapPool
+    path = tmp_path / "pool.bin"
+    path.write_bytes(b"x" * 8192)
+    pool = MmapPool(max_files=1)
+    st = os.stat(path)
+    first = pool.acquire(str(path), st)
+    assert pool.acquire(str(path), st) is first and first.refs == 2
+    pool.invalidate(str(path))
+    assert first.retired and not first.mm.closed
+    pool.release(first)
+    pool.release(first)
+    assert first.mm.closed
+
+def test_head_uses_stat_cache():
+    filename = "head_meta.bin"
+    data = b"H" * 2048
+    assert requests.put(f"{BASE_URL}/{filename}", data=data, timeout=10).status_code == 201
+    route = [r for r in app.routes if getattr(r, "path", "") == "/{filename}" and "HEAD" in r.methods][0]
+    assert route.name == "head_file"
+    before = requests.get(f"{BASE_URL}/stats/stat", timeout=10).json()
+    first = requests.head(f"{BASE_URL}/{filename}", timeout=10)
+    second = requests.head(f"{BASE_URL}/{filename}", timeout=10)
+    for resp in (first, second):
+        assert resp.status_code == 200
+        assert resp.content == b""
+        assert resp.headers["Content-Length"] == str(len(data))
+        assert resp.headers["Accept-Ranges"] == "bytes"
+        assert resp.headers["Content-Type"] == "application/octet-stream"
+        assert "ETag" in resp.headers and "Last-Modified" in resp.headers
+    after = requests.get(f"{BASE_URL}/stats/stat", timeout=10).json()
+    assert after["hits"] >= before["hits"] + 1
+    # 上传覆盖会使 stat 缓存失效，HEAD 立即看到新长度
+    assert requests.put(f"{BASE_URL}/{filename}", data=b"H" * 10, timeout=10).status_code == 201
+    assert requests.head(f"{BASE_URL}/{filename}", timeout=10).headers["Content-Length"] == "10"
+    assert requests.delete(f"{BASE_URL}/{filename}", timeout=10).status_code == 200
+    assert requests.head(f"{BASE_URL}/{filename}", timeout=10).status_code == 404
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return False
+
+def test_transparent_gzip_sidecar():
+    import gzip
+    filename = "notes公告板.txt"
+    data = ("公告内容 notice line\n" * 2000).encode("utf-8")
+    assert requests.put(f"{BASE_URL}/{filename}", data=data, timeout=10).status_code == 201
+    sidecar = os.path.join(TEST_DIR, ".sidecars", f"{filename}.gz")
+    # 用户自己的同名隐藏文件与旁路文件互不影响
+    own = os.path.join(TEST_DIR, f".{filename}.gz")
+    with open(own, "wb") as f:
+        f.write(b"mine")
+    # 首次请求返回原文并排队生成旁路压缩文件
+    resp = requests.get(f"{BASE_URL}/{filename}", headers={"Accept-Encoding": "gzip"}, timeout=10)
+    assert resp.status_code == 200 and resp.content == data
+    assert resp.headers.get("Vary") == "Accept-Encoding"
+    assert wait_for(lambda: os.path.exists(sidecar))
+    # 旁路文件就绪后返回 gzip 编码内容
+    resp = requests.get(f"{BASE_URL}/{filename}", headers={"Accept-Encoding": "gzip"}, stream=True, timeout=10)
+    raw = resp.raw.read(decode_content=False)
+    assert resp.headers["Content-Encoding"] == "gzip"
+    assert int(resp.headers["Content-Length"]) == len(raw) < len(data)
+    assert gzip.decompress(raw) == data
+    gzip_etag = resp.headers["ETag"]
+    # 旁路文件的 stat 按源文件 stat_key 缓存，后续请求不再 stat 旁路文件
+    from server import COMPRESSOR
+    cached = COMPRESSOR.variants[os.path.abspath(os.path.join(TEST_DIR, filename))]
+    assert cached[1]["gzip"].st_size == len(raw)
+    assert gzip_etag.endswith('-gzip"')
+    assert requests.get(f"{BASE_URL}/{filename}", headers={"Accept-Encoding": "gzip", "If-None-Match": gzip_etag},
+                        timeout=10).status_code == 304
+    head = requests.head(f"{BASE_URL}/{filename}", headers={"Accept-Encoding": "gzip"}, timeout=10)
+    assert head.headers["Content-Encoding"] == "gzip"
+    assert head.headers["Content-Length"] == str(len(raw))
+    # 不接受压缩或 Range 请求时返回原始字节
+    resp = requests.get(f"{BASE_URL}/{filename}", headers={"Accept-Encoding": "identity"}, timeout=10)
+    assert "Content-Encoding" not in resp.headers and resp.content == data
+    resp = requests.get(f"{BASE_URL}/{filename}", headers={"Accept-Encoding": "gzip", "Range": "bytes=0-9"}, timeout=10)
+    assert resp.status_code == 206 and "Content-Encoding" not in resp.headers
+    # 旁路文件是隐藏文件，不出现在首页列表
+    assert ".sidecars" not in requests.get(BASE_URL, timeout=10).text
+    # 覆盖与删除都会清理旁路文件
+    assert requests.put(f"{BASE_URL}/{filename}", data=data + b"more", timeout=10).status_code == 201
+    assert not os.path.exists(sidecar)
+    requests.get(f"{BASE_URL}/{filename}", headers={"Accept-Encoding": "gzip"}, timeout=10)
+    assert wait_for(lambda: os.path.exists(sidecar))
+    assert requests.delete(f"{BASE_URL}/{filename}", timeout=10).status_code == 200
+    assert not os.path.exists(sidecar)
+    with open(own, "rb") as f:
+        assert f.read() == b"mine"
+
+def test_binary_files_not_compressed():
+    filename = "blob.bin"
+    assert requests.put(f"{BASE_URL}/{filename}", data=b"\0" * 50000, timeout=10).status_code == 201
+    resp = requests.get(f"{BASE_URL}/{filename}", headers={"Accept-Encoding": "gzip"}, timeout=10)
+    assert "Vary" not in resp.headers
+    assert not os.path.exists(os.path.join(TEST_DIR, ".sidecars", f"{filename}.gz"))
+
+def test_pooled_buffers_concurrent_downloads(monkeypatch):
+    import server
+    from concurrent.futures import ThreadPoolExecutor
+    monkeypatch.setattr(server, "MMAP_RANGE_SERVING", False)
+    filename = "pooled.bin"
+    data = os.urandom(6 * 1024 * 1024 + 123)
+    assert requests.put(f"{BASE_URL}/{filename}", data=data, timeout=30).status_code == 201
+
+    def fetch(i):
+        if i % 2:
+            resp = requests.get(f"{BASE_URL}/{filename}", headers={"Range": "bytes=1000-"}, timeout=30)
+            return resp.content == data[1000:]
+        return requests.get(f"{BASE_URL}/{filename}", timeout=30).content == data
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        assert all(pool.map(fetch, range(16)))
+    stats = requests.get(f"{BASE_URL}/stats/buffers", timeout=10).json()
+    assert stats["in_use_bytes"] == 0
+    assert stats["reused"] > 0
+    assert stats["free_bytes"] <= stats["max_bytes"]
+
+def test_buffer_pool_caps_memory():
+    from server import BufferPool, adaptive_chunk_size, ADAPTIVE_CHUNK_MIN
+
+    async def scenario():
+        pool = BufferPool(max_bytes=1024)
+        a = await pool.acquire(512)
+        b = await pool.acquire(512)
+        assert pool.try_acquire(512) is None
+        waiter = asyncio.ensure_future(pool.acquire(512))
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+        pool.release(a)
+        c = await asyncio.wait_for(waiter, 1)
+        assert c is a  # 复用同一块缓冲区
+        pool.release(b)
+        pool.release(c)
+        # 更换尺寸时丢弃空闲缓冲区，总量仍不超过上限
+        d = await pool.acquire(1024)
+        assert pool.stats()["free_bytes"] == 0 and len(d) == 1024
+
+    asyncio.run(scenario())
+    assert adaptive_chunk_size(0, 10 << 20) == ADAPTIVE_CHUNK_MIN
+    assert adaptive_chunk_size(1e12, 10 << 20) == 8 << 20
+
+@pytest.fixture
+def rate_limit():
+    # 测试结束后恢复为不限速
+    original = requests.get(f"{BASE_URL}/config/ratelimit", timeout=10).json()
+    yield lambda **options: requests.put(f"{BASE_URL}/config/ratelimit", json=options, timeout=10)
+    requests.put(f"{BASE_URL}/config/ratelimit", json=original, timeout=10)
+
+def test_idle_client_bucket_is_kept_until_refilled():
+    import server
+    shaper = server.BandwidthShaper()
+    shaper.configure(client_bps=1024 * 1024, burst_seconds=0.25)
+    flow = shaper.open("10.0.0.1", 1024)
+    bucket = shaper.client_buckets["10.0.0.1"]
+    bucket.consume(bucket.capacity)
+    shaper.close(flow)
+    # 空闲但未回满：下一个请求沿用同一个桶，不会获得新的突发额度
+    flow = shaper.open("10.0.0.1", 1024)
+    assert shaper.client_buckets["10.0.0.1"] is bucket
+    assert bucket.wait_time(64 * 1024, time.monotonic()) > 0
+    bucket.stamp -= 1.0
+    shaper.close(flow)
+    assert "10.0.0.1" not in shaper.client_buckets
+
+def test_global_rate_limit_applies_to_downloads(rate_limit, no_file_cache):
+    filename = "shaped.bin"
+    data = os.urandom(2 * 1024 * 1024)
+    assert requests.put(f"{BASE_URL}/{filename}", data=data, timeout=10).status_code == 201
+    assert rate_limit(global_bps=2 * 1024 * 1024, burst_seconds=0.25).status_code == 200
+    begin = time.monotonic()
+    resp = requests.get(f"{BASE_URL}/{filename}", timeout=30)
+    elapsed = time.monotonic() - begin
+    assert resp.content == data
+    # 2MB / 2MB/s，扣除 0.5MB 突发
+    assert elapsed >= 0.6
+    stats = requests.get(f"{BASE_URL}/stats/ratelimit", timeout=10).json()
+    assert stats["enabled"] and stats["waits"] > 0 and stats["granted_bytes"] >= len(data)
+
+def test_small_download_not_starved_by_bulk_transfer(rate_limit, no_file_cache):
+    bulk = os.urandom(8 * 1024 * 1024)
+    small = os.urandom(64 * 1024)
+    assert requests.put(f"{BASE_URL}/bulk.bin", data=bulk, timeout=10).status_code == 201
+    assert requests.put(f"{BASE_URL}/small.bin", data=small, timeout=10).status_code == 201
+    assert rate_limit(global_bps=4 * 1024 * 1024).status_code == 200
+    result = {}
+
+    def pull_bulk():
+        result["bulk"] = requests.get(f"{BASE_URL}/bulk.bin", timeout=30).content
+
+    t = threading.Thread(target=pull_bulk)
+    t.start()
+    time.sleep(0.3)
+    begin = time.monotonic()
+    resp = requests.get(f"{BASE_URL}/small.bin", timeout=30)
+    latency = time.monotonic() - begin
+    assert resp.content == small
+    # 大文件需约 2 秒；加权公平调度下小文件几乎立即完成
+    assert latency < 0.5
+    t.join()
+    assert result["bulk"] == bulk
+
+def test_per_client_rate_limit_applies_to_uploads(rate_limit):
+    assert rate_limit(client_bps=1024 * 1024, burst_seconds=0.25).status_code == 200
+    data = os.urandom(1536 * 1024)
+    begin = time.monotonic()
+    assert requests.put(f"{BASE_URL}/shaped_upload.bin", data=data, timeout=30).status_code == 201
+    assert time.monotonic() - begin >= 0.8
+    with open(os.path.join(TEST_DIR, "shaped_upload.bin"), "rb") as f:
+        assert f.read() == data
+    assert rate_limit(client_bps=-1).status_code == 400
+    assert rate_limit(client_bps=None).json()["client_bps"] is None
@@ -0,0 +1,155 @@
+import os
+import threading
+import time
+import requests
+import pytest
+
+# 测试端口与目录
+TEST_PORT = 8094
+TEST_DIR = "test_obs_listing"
+os.environ["PORT"] = str(TEST_PORT)
+os.environ["UPLOAD_DIR"] = TEST_DIR
+
+from server import app
+
+BASE_URL = f"http://localhost:{TEST_PORT}"
+
+def run_server():
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=TEST_PORT)
+
+@pytest.fixture(scope="module", autouse=True)
+def setup_teardown():
+    if os.path.exists(TEST_DIR):
+        import shutil
+        shutil.rmtree(TEST_DIR)
+    # 启动前放入一个文件，验证 lifespan 启动时的全量扫描
+    os.makedirs(TEST_DIR)
+    with open(os.path.join(TEST_DIR, "preexisting.log"), "w") as f:
+        f.write("x" * 50)
+    server_thread = threading.Thread(target=run_server, daemon=True)
+    server_thread.start()
+    time.sleep(2)
+    yield
+    if os.path.exists(TEST_DIR):
+        import shutil
+        shutil.rmtree(TEST_DIR)
+
+def list_all(**params):
+    names, cursor = [], None
+    while True:
+        query = dict(params)
+        if cursor:
+            query["cursor"] = cursor
+        data = requests.get(f"{BASE_URL}/api/files", params=query, timeout=10).json()
+        names.extend(item["name"] for item in data["items"])
+        cursor = data["next_cursor"]
+        if not cursor:
+            return names
+
+def test_index_tracks_startup_upload_and_delete():
+    names = list_all()
+    assert names == ["preexisting.log"]
+    for i, size in enumerate((30, 10, 20)):
+        assert requests.put(f"{BASE_URL}/f{i}.txt", data=b"a" * size, timeout=10).status_code == 201
+        time.sleep(0.02)
+    assert requests.put(f"{BASE_URL}/a.json", data=b"{}", timeout=10).status_code == 201
+    assert list_all(sort="time", limit=2) == ["a.json", "f2.txt", "f1.txt", "f0.txt", "preexisting.log"]
+    assert list_all(sort="name", limit=3) == ["a.json", "f0.txt", "f1.txt", "f2.txt", "preexisting.log"]
+    assert list_all(sort="size", limit=1) == ["preexisting.log", "f0.txt", "f2.txt", "f1.txt", "a.json"]
+    assert list_all(sort="ext") == ["a.json", "preexisting.log", "f0.txt", "f1.txt", "f2.txt"]
+    assert requests.delete(f"{BASE_URL}/f1.txt", timeout=10).status_code == 200
+    assert "f1.txt" not in list_all(sort="name")
+
+def test_listing_filters_and_metadata():
+    assert list_all(sort="name", ext="txt", limit=1) == ["f0.txt", "f2.txt"]
+    assert list_all(sort="name", q="PRE") == ["preexisting.log"]
+    data = requests.get(f"{BASE_URL}/api/files", params={"sort": "name", "limit": 1}, timeout=10).json()
+    item = data["items"][0]
+    assert item["name"] == "a.json" and item["size"] == 2 and item["ext"] == ".json"
+    assert item["url"] == "http://obs.dimond.top/a.json"
+    assert data["total"] == 4
+    # 游标与排序方式不匹配时拒绝
+    assert requests.get(f"{BASE_URL}/api/files", params={"sort": "name", "cursor": data["next_cursor"]},
+                        timeout=10).status_code == 200
+    assert requests.get(f"{BASE_URL}/api/files", params={"sort": "time", "cursor": data["next_cursor"]},
+                        timeout=10).status_code == 400
+
+def test_save_notice_and_rescan_update_index():
+    from server import FILE_INDEX
+    requests.post(f"{BASE_URL}/notice", json={"content": "hello"}, timeout=10)
+    saved = requests.post(f"{BASE_URL}/save_notice", timeout=10).json()["filename"]
+    assert saved in list_all(sort="name")
+    # 带外写入的文件在重扫后出现
+    with open(os.path.join(TEST_DIR, "outofband.bin"), "wb") as f:
+        f.write(b"z")
+    assert "outofband.bin" not in list_all(sort="name")
+    FILE_INDEX.load(FILE_INDEX.root)
+    # 重扫在工作线程中已排好全部视图，列表请求无需在事件循环上重排
+    from server import FILE_SORT_KEYS
+    assert set(FILE_INDEX.views) == set(FILE_SORT_KEYS)
+    assert "outofband.bin" in list_all(sort="name")
+    # 隐藏文件（如旁路压缩文件、.chunks）不进入索引
+    assert not any(name.startswith(".") for name in list_all(sort="name"))
+
+def test_index_page_speed():
+    from server import FileIndex, FileEntry
+    index = FileIndex()
+    index.root = "/nonexistent"
+    index.entries = {f"file_{i}.bin": FileEntry(f"file_{i}.bin", i, i * 1000) for i in range(200000)}
+    index.view("time")
+    began = time.perf_counter()
+    for _ in range(100):
+        items, next_key = index.page("time", 100)
+        index.page("time", 100, after=next_key)
+    assert (time.perf_counter() - began) / 200 < 0.001
+
+def test_index_filtered_page_speed():
+    from server import FileIndex, FileEntry, FILE_LIST_SCAN_MAX
+    index = FileIndex()
+    index.root = "/nonexistent"
+    # 稀有扩展名与稀有关键字都落在时间排序视图的末尾
+    names = [f"file_{i}.bin" for i in range(200000)] + ["rare_0.iso", "rare_1.iso", "needle_x.bin"]
+    index.entries = {name: FileEntry(name, i, -i * 1000) for i, name in enumerate(names)}
+    index.view("time", ".iso")
+    began = time.perf_counter()
+    for _ in range(100):
+        items, next_key = index.page("time", 100, ext=".iso")
+    assert (time.perf_counter() - began) / 100 < 0.001
+    assert [e.name for e in items] == ["rare_0.iso", "rare_1.iso"] and next_key is None
+    # q 过滤每次最多检查 FILE_LIST_SCAN_MAX 个条目，未凑满一页也带游标提前返回
+    began = time.perf_counter()
+    for _ in range(20):
+        items, next_key = index.page("time", 100, q="needle")
+    assert (time.perf_counter() - began) / 20 < 0.005
+    assert items == [] and next_key is not None
+    found, pages, after = [], 0, None
+    while True:
+        items, after = index.page("time", 100, after=after, q="NEEDLE")
+        found.extend(e.name for e in items)
+        pages += 1
+        if after is None:
+            break
+    assert found == ["needle_x.bin"]
+    assert pages == -(-len(names) // FILE_LIST_SCAN_MAX)
+
+def test_homepage_streams_first_page_with_cursor(monkeypatch):
+    import re
+    import server
+    monkeypatch.setattr(server, "HOMEPAGE_PAGE_SIZE", 2)
+    resp = requests.get(BASE_URL, timeout=10)
+    assert resp.status_code == 200
+    assert resp.headers["Content-Type"].startswith("text/html")
+    assert "content-length" not in resp.headers  # 分块流式输出
+    html = resp.text
+    expected = list_all(sort="time")
+    assert html.find(expected[0]) < html.find(expected[1])
+    assert f"http://obs.dimond.top/{expected[2]}" not in html
+    match = re.search(r'id="file-list-more" data-sort="time" data-limit="2" data-cursor="([^"]+)"', html)
+    assert match
+    assert "loadMoreFiles" in html and "IntersectionObserver" in html
+    rest = list_all(sort="time", limit=2, cursor=match.group(1))
+    assert expected[:2] + rest == expected
+    # 扩展名排序同样分页
+    html = requests.get(f"{BASE_URL}?sort=ext", timeout=10).text
+    assert 'data-sort="ext"' in html
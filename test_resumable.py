@@ -142,3 +142,734 @@ def test_resume_missing_chunk_and_skip_when_exists():
     data3 = resp3.json()
     assert data3.get("skip") is True
     assert data3.get("url", "").endswith(f"/{filename}")
+
+@pytest.mark.parametrize("assembly", ["inplace", "parts"])
+def test_chunk_digest_persisted_and_merge_single_pass(monkeypatch, assembly):
+    import server
+    filename = f"digest-{assembly}.bin"
+    data = os.urandom(12000)
+    chunk_size = 5000
+    total_chunks = (len(data) + chunk_size - 1) // chunk_size
+    file_hash = sha256_hex(data)
+    resp = requests.post(f"{BASE_URL}/upload/init", json={
+        "filename": filename,
+        "size": len(data),
+        "hash_algo": "sha256",
+        "hash": file_hash,
+        "chunk_size": chunk_size,
+        "total_chunks": total_chunks,
+        "assembly": assembly
+    }, timeout=10)
+    assert resp.json()["assembly"] == assembly
+    upload_id = resp.json()["upload_id"]
+    up_dir = os.path.join(TEST_DIR, ".chunks", upload_id)
+    for i in range(total_chunks):
+        chunk = data[i * chunk_size:(i + 1) * chunk_size]
+        r = requests.put(f"{BASE_URL}/upload/chunk/{upload_id}/{i}", data=chunk,
+                         headers={"X-Chunk-SHA256": sha256_hex(chunk)}, timeout=10)
+        assert r.status_code == 201
+        assert r.headers["X-Chunk-SHA256"] == sha256_hex(chunk)
+        with open(os.path.join(up_dir, f"{i}.sha256")) as f:
+            assert f.read() == sha256_hex(chunk)
+    # 分片哈希不符时拒绝，重传正确内容后可继续完成
+    last = total_chunks - 1
+    chunk = data[last * chunk_size:]
+    r = requests.put(f"{BASE_URL}/upload/chunk/{upload_id}/{last}", data=b"x" * len(chunk),
+                     headers={"X-Chunk-SHA256": "0" * 64}, timeout=10)
+    assert r.status_code == 422
+    r = requests.put(f"{BASE_URL}/upload/chunk/{upload_id}/{last}", data=chunk, timeout=10)
+    assert r.status_code == 201
+    # 合并阶段不再回读整个文件计算哈希
+    def fail(path):
+        raise AssertionError("file_sha256 不应被调用")
+    monkeypatch.setattr(server, "file_sha256", fail)
+    r = requests.post(f"{BASE_URL}/upload/complete/{upload_id}", json={
+        "filename": filename,
+        "size": len(data),
+        "total_chunks": total_chunks,
+        "hash_algo": "sha256",
+        "hash": file_hash
+    }, timeout=20)
+    assert r.status_code == 200
+    assert requests.get(f"{BASE_URL}/{filename}", timeout=10).content == data
+    # 秒传校验直接复用合并时得到的哈希
+    resp = requests.post(f"{BASE_URL}/upload/init", json={
+        "filename": filename,
+        "size": len(data),
+        "hash_algo": "sha256",
+        "hash": file_hash,
+    }, timeout=10)
+    assert resp.json().get("skip") is True
+
+def test_complete_rejects_wrong_hash():
+    filename = "badhash.bin"
+    data = b"B" * 6000
+    resp = requests.post(f"{BASE_URL}/upload/init", json={
+        "filename": filename,
+        "size": len(data),
+        "hash_algo": "sha256",
+        "hash": "f" * 64,
+        "chunk_size": 6000,
+        "total_chunks": 1
+    }, timeout=10)
+    upload_id = resp.json()["upload_id"]
+    assert requests.put(f"{BASE_URL}/upload/chunk/{upload_id}/0", data=data, timeout=10).status_code == 201
+    r = requests.post(f"{BASE_URL}/upload/complete/{upload_id}", json={
+        "filename": filename,
+        "size": len(data),
+        "total_chunks": 1,
+        "hash_algo": "sha256",
+        "hash": "f" * 64
+    }, timeout=20)
+    assert r.status_code == 422
+    assert not os.path.exists(os.path.join(TEST_DIR, filename))
+
+def test_inplace_assembly_preallocates_and_hashes_in_order(monkeypatch):
+    import server
+    filename = "inplace.bin"
+    data = os.urandom(10000)
+    chunk_size = 4096
+    total_chunks = (len(data) + chunk_size - 1) // chunk_size
+    file_hash = sha256_hex(data)
+    init = {
+        "filename": filename,
+        "size": len(data),
+        "hash_algo": "sha256",
+        "hash": file_hash,
+        "chunk_size": chunk_size,
+        "total_chunks": total_chunks
+    }
+    info = requests.post(f"{BASE_URL}/upload/init", json=init, timeout=10).json()
+    assert info["assembly"] == "inplace"
+    upload_id = info["upload_id"]
+    up_dir = os.path.join(TEST_DIR, ".chunks", upload_id)
+    assert os.path.getsize(os.path.join(up_dir, "__assembly.tmp")) == len(data)
+    # 超出分片边界的写入被拒绝，不会覆盖相邻分片
+    r = requests.put(f"{BASE_URL}/upload/chunk/{upload_id}/0", data=b"z" * (chunk_size + 1), timeout=10)
+    assert r.status_code == 422
+    r = requests.put(f"{BASE_URL}/upload/chunk/{upload_id}/{total_chunks}", data=b"z", timeout=10)
+    assert r.status_code == 400
+    for i in range(total_chunks - 1):
+        r = requests.put(f"{BASE_URL}/upload/chunk/{upload_id}/{i}", data=data[i * chunk_size:(i + 1) * chunk_size], timeout=10)
+        assert r.status_code == 201
+    assert not any(name.endswith(".part") for name in os.listdir(up_dir))
+    # 位图记录已完成分片，重新初始化可续传
+    info = requests.post(f"{BASE_URL}/upload/init", json=init, timeout=10).json()
+    assert info["uploaded"] == list(range(total_chunks - 1))
+    r = requests.post(f"{BASE_URL}/upload/complete/{upload_id}", json={**init, "total_chunks": total_chunks}, timeout=20)
+    assert r.status_code == 409
+    last = total_chunks - 1
+    r = requests.put(f"{BASE_URL}/upload/chunk/{upload_id}/{last}", data=data[last * chunk_size:], timeout=10)
+    assert r.status_code == 201
+    # 分片按序到达，完成时无需再读取已组装的数据
+    assert server.INPLACE_HASH_STATE[upload_id][0] == total_chunks
+    reads = []
+    orig = server.finish_inplace_hash
+    def spy(path, state, size):
+        reads.append(state[0] if state else 0)
+        return orig(path, state, size)
+    monkeypatch.setattr(server, "finish_inplace_hash", spy)
+    r = requests.post(f"{BASE_URL}/upload/complete/{upload_id}", json=init, timeout=20)
+    assert r.status_code == 200
+    assert reads == [total_chunks]
+    assert not os.path.exists(up_dir)
+    assert requests.get(f"{BASE_URL}/{filename}", timeout=10).content == data
+
+def test_inplace_hash_catches_up_after_out_of_order_chunks(monkeypatch):
+    import server
+    filename = "inplace-window.bin"
+    data = os.urandom(5 * 4096 + 100)
+    chunk_size = 4096
+    total_chunks = (len(data) + chunk_size - 1) // chunk_size
+    init = {"filename": filename, "size": len(data), "hash_algo": "sha256", "hash": sha256_hex(data),
+            "chunk_size": chunk_size, "total_chunks": total_chunks, "assembly": "inplace"}
+    upload_id = requests.post(f"{BASE_URL}/upload/init", json=init, timeout=10).json()["upload_id"]
+    put = lambda i: requests.put(f"{BASE_URL}/upload/chunk/{upload_id}/{i}",
+                                 data=data[i * chunk_size:(i + 1) * chunk_size], timeout=10)
+    # 并发窗口下的到达顺序：空缺之后的分片先到，空缺补齐时从磁盘补算其后已完成的连续分片
+    for i in (1, 2, 4):
+        assert put(i).status_code == 201
+    assert server.INPLACE_HASH_STATE[upload_id][0] == 0
+    assert put(0).status_code == 201
+    assert server.INPLACE_HASH_STATE[upload_id][0] == 3
+    assert put(3).status_code == 201
+    assert put(5).status_code == 201
+    assert server.INPLACE_HASH_STATE[upload_id][0] == total_chunks
+    reads = []
+    orig = server.finish_inplace_hash
+    def spy(path, state, size):
+        reads.append(state[0] if state else 0)
+        return orig(path, state, size)
+    monkeypatch.setattr(server, "finish_inplace_hash", spy)
+    r = requests.post(f"{BASE_URL}/upload/complete/{upload_id}", json=init, timeout=20)
+    assert r.status_code == 200
+    assert reads == [total_chunks]
+    assert requests.get(f"{BASE_URL}/{filename}", timeout=10).content == data
+    # 真正并发的窗口上传：补算与流内哈希交错，完成时整体哈希仍与客户端一致
+    from concurrent.futures import ThreadPoolExecutor
+    data = os.urandom(24 * chunk_size)
+    init = {**init, "filename": "inplace-parallel.bin", "size": len(data), "hash": sha256_hex(data), "total_chunks": 24}
+    upload_id = requests.post(f"{BASE_URL}/upload/init", json=init, timeout=10).json()["upload_id"]
+    with ThreadPoolExecutor(4) as pool:
+        codes = [r.status_code for r in pool.map(put, [5, 1, 0, 3, 2, 4] + list(range(6, 24)))]
+    assert codes == [201] * 24
+    r = requests.post(f"{BASE_URL}/upload/complete/{upload_id}", json=init, timeout=20)
+    assert r.status_code == 200
+    assert reads[-1] > 0
+    assert requests.get(f"{BASE_URL}/inplace-parallel.bin", timeout=10).content == data
+
+def test_parts_merge_falls_back_without_copy_file_range(monkeypatch):
+    import server
+    up_dir = os.path.join(TEST_DIR, "merge-fallback")
+    os.makedirs(up_dir, exist_ok=True)
+    chunks = [os.urandom(3000), os.urandom(3000), os.urandom(123)]
+    for i, c in enumerate(chunks):
+        with open(os.path.join(up_dir, f"{i}.part"), "wb") as f:
+            f.write(c)
+    out = os.path.join(up_dir, "out")
+    expected = b"".join(chunks)
+    for enabled in (True, False):
+        monkeypatch.setattr(server, "MERGE_COPY_FILE_RANGE", enabled)
+        size, digest = server.merge_parts(up_dir, len(chunks), out)
+        assert size == len(expected)
+        assert digest == sha256_hex(expected)
+        with open(out, "rb") as f:
+            assert f.read() == expected
+
+@pytest.mark.parametrize("mode", ["parts", "inplace"])
+def test_session_and_bitmap_io_off_event_loop(monkeypatch, mode):
+    import server
+    calls = []
+    def spy(name):
+        orig = getattr(server, name)
+        def wrapper(*args, **kwargs):
+            calls.append((name, threading.current_thread().name))
+            return orig(*args, **kwargs)
+        monkeypatch.setattr(server, name, wrapper)
+    for name in ("load_upload_session", "bitmap_set", "bitmap_indices", "bitmap_status",
+                 "list_uploaded_parts", "forget_file_hash", "refresh_path_state"):
+        spy(name)
+    filename = f"offloop-{mode}.bin"
+    data = os.urandom(10000)
+    meta = {"filename": filename, "size": len(data), "hash_algo": "sha256", "hash": sha256_hex(data),
+            "chunk_size": 4096, "total_chunks": 3, "assembly": mode}
+    upload_id = requests.post(f"{BASE_URL}/upload/init", json=meta, timeout=10).json()["upload_id"]
+    for i in range(3):
+        chunk = data[i * 4096:(i + 1) * 4096]
+        assert requests.put(f"{BASE_URL}/upload/chunk/{upload_id}/{i}", data=chunk, timeout=10).status_code == 201
+    assert requests.get(f"{BASE_URL}/upload/status/{upload_id}", timeout=10).status_code == 200
+    assert requests.post(f"{BASE_URL}/upload/complete/{upload_id}", json=meta, timeout=10).status_code == 200
+    assert requests.delete(f"{BASE_URL}/{filename}", timeout=10).status_code == 200
+    names = {name for name, _ in calls}
+    assert {"load_upload_session", "bitmap_set", "bitmap_status", "forget_file_hash", "refresh_path_state"} <= names
+    assert ("bitmap_indices" if mode == "inplace" else "list_uploaded_parts") in names
+    # 会话清单、位图、目录扫描与哈希旁路文件删除都在工作线程中执行，不占用事件循环线程
+    assert not [c for c in calls if "run_server" in c[1]]
+
+def test_session_writer_cap_returns_429(monkeypatch):
+    import server
+    monkeypatch.setattr(server.SESSION_WRITERS, "max_writers", 1)
+    data = b"C" * 8192
+    info = requests.post(f"{BASE_URL}/upload/init", json={
+        "filename": "capped.bin",
+        "size": len(data),
+        "hash_algo": "sha256",
+        "hash": sha256_hex(data),
+        "chunk_size": 4096,
+        "total_chunks": 2
+    }, timeout=10).json()
+    upload_id = info["upload_id"]
+    release = threading.Event()
+    def slow_body():
+        yield data[:1024]
+        release.wait(10)
+        yield data[1024:4096]
+    result = {}
+    def slow_put():
+        result["status"] = requests.put(f"{BASE_URL}/upload/chunk/{upload_id}/0", data=slow_body(), timeout=20).status_code
+    t = threading.Thread(target=slow_put)
+    t.start()
+    deadline = time.time() + 5
+    while not server.SESSION_WRITERS.active.get(upload_id) and time.time() < deadline:
+        time.sleep(0.05)
+    r = requests.put(f"{BASE_URL}/upload/chunk/{upload_id}/1", data=data[4096:], timeout=10)
+    assert r.status_code == 429
+    assert r.headers.get("Retry-After") == "1"
+    release.set()
+    t.join(20)
+    assert result["status"] == 201
+    assert upload_id not in server.SESSION_WRITERS.active
+    r = requests.put(f"{BASE_URL}/upload/chunk/{upload_id}/1", data=data[4096:], timeout=10)
+    assert r.status_code == 201
+    # 首页并发窗口上限与服务端一致
+    assert f"UPLOAD_WINDOW_MAX = {server.UPLOAD_SESSION_MAX_WRITERS};" in requests.get(BASE_URL, timeout=10).text
+
+def test_late_hash_supplied_at_complete():
+    filename = "late.bin"
+    data = os.urandom(9000)
+    init = {
+        "filename": filename,
+        "size": len(data),
+        "hash_algo": "sha256",
+        "fingerprint": "1700000000000",
+        "chunk_size": 4096,
+        "total_chunks": 3
+    }
+    # 未提供哈希也未提供指纹时拒绝
+    r = requests.post(f"{BASE_URL}/upload/init", json={**init, "fingerprint": None}, timeout=10)
+    assert r.status_code == 400
+    info = requests.post(f"{BASE_URL}/upload/init", json=init, timeout=10).json()
+    upload_id = info["upload_id"]
+    for i in range(2):
+        assert requests.put(f"{BASE_URL}/upload/chunk/{upload_id}/{i}", data=data[i * 4096:(i + 1) * 4096], timeout=10).status_code == 201
+    # 同一指纹重新初始化得到同一会话，可续传
+    again = requests.post(f"{BASE_URL}/upload/init", json=init, timeout=10).json()
+    assert again["upload_id"] == upload_id
+    assert again["uploaded"] == [0, 1]
+    assert requests.put(f"{BASE_URL}/upload/chunk/{upload_id}/2", data=data[8192:], timeout=10).status_code == 201
+    done = {"filename": filename, "size": len(data), "total_chunks": 3, "hash_algo": "sha256"}
+    r = requests.post(f"{BASE_URL}/upload/complete/{upload_id}", json={**done, "hash": "0" * 64}, timeout=20)
+    assert r.status_code == 422
+    r = requests.post(f"{BASE_URL}/upload/complete/{upload_id}", json={**done, "hash": sha256_hex(data)}, timeout=20)
+    assert r.status_code == 200
+    assert requests.get(f"{BASE_URL}/{filename}", timeout=10).content == data
+
+def test_probe_reports_instant_upload_without_creating_session():
+    data = os.urandom(5000)
+    probe = {"filename": "probe.bin", "size": len(data), "hash_algo": "sha256", "hash": sha256_hex(data), "probe": True}
+    before = set(os.listdir(os.path.join(TEST_DIR, ".chunks")))
+    r = requests.post(f"{BASE_URL}/upload/init", json=probe, timeout=10)
+    assert r.json() == {"skip": False}
+    assert set(os.listdir(os.path.join(TEST_DIR, ".chunks"))) == before
+    requests.put(f"{BASE_URL}/probe.bin", data=data, timeout=10)
+    r = requests.post(f"{BASE_URL}/upload/init", json=probe, timeout=10)
+    assert r.json()["skip"] is True
+
+def resumable_upload(filename: str, data: bytes, chunk_size: int = 4096):
+    total_chunks = (len(data) + chunk_size - 1) // chunk_size
+    init = {
+        "filename": filename,
+        "size": len(data),
+        "hash_algo": "sha256",
+        "hash": sha256_hex(data),
+        "chunk_size": chunk_size,
+        "total_chunks": total_chunks
+    }
+    info = requests.post(f"{BASE_URL}/upload/init", json=init, timeout=10).json()
+    if info.get("skip"):
+        return info
+    for i in range(total_chunks):
+        r = requests.put(f"{BASE_URL}/upload/chunk/{info['upload_id']}/{i}", data=data[i * chunk_size:(i + 1) * chunk_size], timeout=10)
+        assert r.status_code == 201
+    r = requests.post(f"{BASE_URL}/upload/complete/{info['upload_id']}", json=init, timeout=20)
+    assert r.status_code == 200
+    return info
+
+def test_content_addressed_store_dedups_and_refcounts(monkeypatch):
+    import server
+    monkeypatch.setattr(server, "CONTENT_ADDRESSED_STORE", True)
+    data = os.urandom(10000)
+    digest = sha256_hex(data)
+    blob = os.path.join(TEST_DIR, ".blobs", digest[:2], digest)
+    resumable_upload("cas-a.bin", data)
+    assert os.path.exists(blob)
+    assert os.stat(blob).st_ino == os.stat(os.path.join(TEST_DIR, "cas-a.bin")).st_ino
+    # 不同文件名的相同内容：只查内存索引即秒传，不读盘哈希
+    def fail(path):
+        raise AssertionError("file_sha256 不应被调用")
+    monkeypatch.setattr(server, "file_sha256", fail)
+    info = resumable_upload("cas-b.bin", data)
+    assert info["skip"] is True
+    assert os.stat(os.path.join(TEST_DIR, "cas-b.bin")).st_ino == os.stat(blob).st_ino
+    assert os.stat(blob).st_nlink == 3
+    assert requests.get(f"{BASE_URL}/cas-b.bin", timeout=10).content == data
+    assert requests.head(f"{BASE_URL}/cas-b.bin", timeout=10).headers["ETag"] == f'"sha256-{digest}"'
+    # 覆盖写入某个文件名不影响 blob 与其他文件名
+    assert requests.put(f"{BASE_URL}/cas-a.bin", data=b"other", timeout=10).status_code == 201
+    assert os.stat(blob).st_nlink == 2
+    assert requests.get(f"{BASE_URL}/cas-b.bin", timeout=10).content == data
+    # 最后一个引用删除后回收 blob
+    assert requests.delete(f"{BASE_URL}/cas-b.bin", timeout=10).status_code == 200
+    assert not os.path.exists(blob)
+    assert digest not in server.BLOB_STORE.by_hash
+    assert requests.get(f"{BASE_URL}/stats/blobs", timeout=10).json()["blobs"] == 0
+    # 重启后从磁盘重建索引
+    resumable_upload("cas-c.bin", data)
+    server.BLOB_STORE.load(TEST_DIR)
+    assert server.BLOB_STORE.lookup(digest, len(data))
+    assert not any(e["name"].startswith(".") for e in requests.get(f"{BASE_URL}/api/files", timeout=10).json()["items"])
+
+def test_hash_index_persisted_and_filled_in_background(monkeypatch):
+    import server
+    data = os.urandom(7000)
+    digest = sha256_hex(data)
+    probe = {"filename": "indexed.bin", "size": len(data), "hash_algo": "sha256", "hash": digest, "probe": True}
+    # 上传路径边写边哈希并落盘旁路索引
+    assert requests.put(f"{BASE_URL}/indexed.bin", data=data, timeout=10).status_code == 201
+    sidecar = os.path.join(TEST_DIR, ".sidecars", "indexed.bin.sha256")
+    with open(sidecar) as f:
+        assert f.read().split()[3:] == [digest, "publish"]
+    # 旁路文件在私有目录中，上传目录顶层不出现隐藏的哈希文件
+    assert not [n for n in os.listdir(TEST_DIR) if n.endswith(".sha256")]
+    # 旧版本顶层旁路文件仍可读回
+    legacy = os.path.join(TEST_DIR, ".indexed.bin.sha256")
+    os.replace(sidecar, legacy)
+    server.KNOWN_FILE_HASHES.clear()
+    assert requests.post(f"{BASE_URL}/upload/init", json=probe, timeout=10).json()["skip"] is True
+    os.replace(legacy, sidecar)
+    # 内存索引丢失（如重启）后从旁路文件读回
+    server.KNOWN_FILE_HASHES.clear()
+    calls = []
+    orig = server.file_sha256
+    def spy(path):
+        calls.append(threading.current_thread().name)
+        return orig(path)
+    monkeypatch.setattr(server, "file_sha256", spy)
+    assert requests.post(f"{BASE_URL}/upload/init", json=probe, timeout=10).json()["skip"] is True
+    assert calls == []
+    # 外部放入的文件：探测不在请求路径上哈希，由后台补齐后才可秒传
+    other = os.urandom(6000)
+    with open(os.path.join(TEST_DIR, "external.bin"), "wb") as f:
+        f.write(other)
+    probe2 = {**probe, "filename": "external.bin", "size": len(other), "hash": sha256_hex(other)}
+    assert requests.post(f"{BASE_URL}/upload/init", json=probe2, timeout=10).json()["skip"] is False
+    deadline = time.time() + 5
+    while not os.path.exists(os.path.join(TEST_DIR, ".sidecars", "external.bin.sha256")) and time.time() < deadline:
+        time.sleep(0.05)
+    assert requests.post(f"{BASE_URL}/upload/init", json=probe2, timeout=10).json()["skip"] is True
+    assert calls and not any("run_server" in name for name in calls)
+    # 删除文件同时清除索引
+    assert requests.delete(f"{BASE_URL}/indexed.bin", timeout=10).status_code == 200
+    assert not os.path.exists(os.path.join(TEST_DIR, ".sidecars", "indexed.bin.sha256"))
+
+def test_published_hash_bound_to_published_inode(monkeypatch):
+    import server
+    # 发布之后、记录哈希之前同名文件被另一个写入者覆盖：旧内容的哈希不能记到新文件上
+    orig = server.replace_file
+    def racing_replace(src, dst):
+        old = orig(src, dst)
+        with open(dst + ".other", "wb") as f:
+            f.write(b"overwritten by another writer")
+        os.replace(dst + ".other", dst)
+        return old
+    monkeypatch.setattr(server, "replace_file", racing_replace)
+    assert requests.put(f"{BASE_URL}/race.bin", data=b"original", timeout=10).status_code == 201
+    path = os.path.join(TEST_DIR, "race.bin")
+    assert server.known_file_hash(path, os.stat(path)) is None
+
+def test_session_manifest_and_status_without_listdir(monkeypatch):
+    import json
+    import server
+    data = os.urandom(9000)
+    init = {
+        "filename": "manifest.bin",
+        "size": len(data),
+        "hash_algo": "sha256",
+        "hash": sha256_hex(data),
+        "chunk_size": 4096,
+        "total_chunks": 3,
+        "assembly": "parts"
+    }
+    upload_id = requests.post(f"{BASE_URL}/upload/init", json=init, timeout=10).json()["upload_id"]
+    up_dir = os.path.join(TEST_DIR, ".chunks", upload_id)
+    with open(os.path.join(up_dir, "session.json")) as f:
+        manifest = json.load(f)
+    assert manifest["filename"] == "manifest.bin"
+    assert manifest["size"] == len(data)
+    assert manifest["total_chunks"] == 3
+    created = manifest["created_at"]
+    time.sleep(0.01)
+    assert requests.put(f"{BASE_URL}/upload/chunk/{upload_id}/1", data=data[4096:8192], timeout=10).status_code == 201
+    with open(os.path.join(up_dir, "session.json")) as f:
+        manifest = json.load(f)
+    assert manifest["created_at"] == created
+    assert manifest["updated_at"] > created
+    # 续传状态读取清单位图，不再枚举目录
+    def fail(up_dir):
+        raise AssertionError("不应枚举分片目录")
+    monkeypatch.setattr(server, "list_uploaded_parts", fail)
+    assert requests.post(f"{BASE_URL}/upload/init", json=init, timeout=10).json()["uploaded"] == [1]
+
+def test_staging_sweeper_expires_and_caps_sessions(monkeypatch):
+    import json
+    import server
+    chunk_dir = os.path.join(TEST_DIR, ".chunks")
+    def start_session(name, size):
+        data = os.urandom(size)
+        info = requests.post(f"{BASE_URL}/upload/init", json={
+            "filename": name,
+            "size": size,
+            "hash_algo": "sha256",
+            "hash": sha256_hex(data),
+            "chunk_size": size,
+            "total_chunks": 1
+        }, timeout=10)
+        return info
+    def age(upload_id, seconds):
+        path = os.path.join(chunk_dir, upload_id, "session.json")
+        with open(path) as f:
+            manifest = json.load(f)
+        manifest["updated_at"] -= seconds
+        with open(path, "w") as f:
+            json.dump(manifest, f)
+    # 闲置超时的会话被清理，之后写分片返回 404
+    stale = start_session("stale.bin", 8192).json()["upload_id"]
+    age(stale, server.UPLOAD_SESSION_TTL_SECONDS + 1)
+    expired = server.STAGING.expired
+    server.STAGING.sweep(chunk_dir)
+    assert server.STAGING.expired == expired + 1
+    assert not os.path.exists(os.path.join(chunk_dir, stale))
+    assert requests.put(f"{BASE_URL}/upload/chunk/{stale}/0", data=b"x", timeout=10).status_code == 404
+    # 超出暂存上限：淘汰最久未活动的闲置会话为新会话腾出空间
+    server.STAGING.sweep(chunk_dir)
+    base = server.STAGING.bytes
+    monkeypatch.setattr(server, "STAGING_MAX_BYTES", base + 300 * 1024)
+    idle = start_session("idle.bin", 200 * 1024).json()["upload_id"]
+    age(idle, server.STAGING_EVICT_GRACE_SECONDS + 1)
+    fresh = start_session("fresh.bin", 200 * 1024)
+    assert fresh.status_code == 200
+    assert not os.path.exists(os.path.join(chunk_dir, idle))
+    # 剩余会话都在宽限期内时拒绝新会话
+    r = start_session("toobig.bin", 200 * 1024)
+    assert r.status_code == 507
+    assert r.headers.get("Retry-After") == "60"
+    stats = requests.get(f"{BASE_URL}/stats/staging", timeout=10).json()
+    assert stats["evicted"] >= 1
+    assert stats["bytes"] <= stats["max_bytes"]
+
+def test_staging_reservation_is_atomic(monkeypatch, tmp_path):
+    import server
+    staging = server.StagingSweeper()
+    monkeypatch.setattr(server, "STAGING_MAX_BYTES", 1000)
+    # 检查与计入在同一步：第二个预留看到第一个的占用
+    assert staging.reserve(600)
+    assert not staging.reserve(600)
+    # 巡检按磁盘校准时保留尚未落盘的预留
+    staging.sweep(str(tmp_path))
+    assert staging.bytes == 600
+    staging.cancel(600)
+    assert staging.bytes == 0 and staging.pending == 0
+    assert staging.reserve(600)
+    staging.commit(600)
+    staging.sweep(str(tmp_path))
+    assert staging.bytes == 0
+
+def test_upload_status_bitmap():
+    import base64
+    data = os.urandom(20 * 1024)
+    init = {
+        "filename": "bitmap.bin",
+        "size": len(data),
+        "hash_algo": "sha256",
+        "hash": sha256_hex(data),
+        "chunk_size": 1024,
+        "total_chunks": 20,
+        "status_format": "bitmap"
+    }
+    info = requests.post(f"{BASE_URL}/upload/init", json=init, timeout=10).json()
+    assert "uploaded" not in info
+    upload_id = info["upload_id"]
+    for i in (0, 2, 9, 19):
+        assert requests.put(f"{BASE_URL}/upload/chunk/{upload_id}/{i}", data=data[i * 1024:(i + 1) * 1024], timeout=10).status_code == 201
+    status = requests.get(f"{BASE_URL}/upload/status/{upload_id}", timeout=10).json()
+    assert status["uploaded_count"] == 4
+    assert status["total_chunks"] == 20
+    bits = base64.b64decode(status["uploaded_bitmap"])
+    assert len(bits) == 3
+    assert [i for i in range(20) if bits[i // 8] >> (i % 8) & 1] == [0, 2, 9, 19]
+    info = requests.post(f"{BASE_URL}/upload/init", json=init, timeout=10).json()
+    assert info["uploaded_bitmap"] == status["uploaded_bitmap"]
+    assert requests.get(f"{BASE_URL}/upload/status/missing", timeout=10).status_code == 404
+
+def tus_create(filename: str, size: int, **headers):
+    meta = "filename " + __import__("base64").b64encode(filename.encode()).decode()
+    resp = requests.post(f"{BASE_URL}/tus", headers={
+        "Tus-Resumable": "1.0.0", "Upload-Length": str(size), "Upload-Metadata": meta, **headers}, timeout=10)
+    assert resp.status_code == 201, resp.text
+    assert resp.headers["Tus-Resumable"] == "1.0.0"
+    return resp.headers["Location"], resp
+
+def tus_patch(location: str, offset: int, data, checksum: str = None):
+    headers = {"Tus-Resumable": "1.0.0", "Upload-Offset": str(offset),
+               "Content-Type": "application/offset+octet-stream"}
+    if checksum:
+        headers["Upload-Checksum"] = checksum
+    return requests.patch(location, data=data, headers=headers, timeout=30)
+
+def test_tus_create_head_patch_with_checksum():
+    import base64
+    import server
+    resp = requests.options(f"{BASE_URL}/tus", timeout=10)
+    assert resp.status_code == 204
+    assert "checksum" in resp.headers["Tus-Extension"].split(",")
+    assert "sha256" in resp.headers["Tus-Checksum-Algorithm"].split(",")
+
+    filename = "tus_upload.bin"
+    data = os.urandom(3 * 1024 * 1024 + 77)
+    location, _ = tus_create(filename, len(data))
+    head = requests.head(location, headers={"Tus-Resumable": "1.0.0"}, timeout=10)
+    assert head.status_code == 200
+    assert head.headers["Upload-Offset"] == "0"
+    assert head.headers["Upload-Length"] == str(len(data))
+    assert head.headers["Cache-Control"] == "no-store"
+
+    # 偏移不一致被拒绝
+    assert tus_patch(location, 5, b"x").status_code == 409
+    # 校验和不匹配：460，偏移不前进
+    bad = base64.b64encode(hashlib.sha256(b"other").digest()).decode()
+    assert tus_patch(location, 0, data[:1024], f"sha256 {bad}").status_code == 460
+    assert requests.head(location, timeout=10).headers["Upload-Offset"] == "0"
+    assert tus_patch(location, 0, data[:1024], "crc32 AAAA").status_code == 400
+
+    offset = 0
+    for piece in (data[:1024 * 1024], data[1024 * 1024:2 * 1024 * 1024 + 5], data[2 * 1024 * 1024 + 5:]):
+        digest = base64.b64encode(hashlib.sha1(piece).digest()).decode()
+        resp = tus_patch(location, offset, piece, f"sha1 {digest}")
+        assert resp.status_code == 204, resp.text
+        offset += len(piece)
+        assert resp.headers["Upload-Offset"] == str(offset)
+    path = os.path.join(TEST_DIR, filename)
+    with open(path, "rb") as f:
+        assert f.read() == data
+    assert server.known_file_hash(path, os.stat(path)) == sha256_hex(data)
+    # 完成后会话清理
+    assert requests.head(location, timeout=10).status_code == 404
+
+def test_tus_resumes_after_interrupted_patch():
+    import server
+    filename = "tus_interrupted.bin"
+    data = os.urandom(4 * 1024 * 1024)
+    location, _ = tus_create(filename, len(data))
+    upload_id = location.rsplit("/", 1)[1]
+
+    def broken_body():
+        yield data[:1024 * 1024]
+        yield data[1024 * 1024:2 * 1024 * 1024]
+        raise IOError("模拟断线")
+
+    with pytest.raises(Exception):
+        tus_patch(location, 0, broken_body())
+    # 客户端抛错时服务端可能尚未察觉断线：等待已收数据落盘并释放写入者
+    for _ in range(100):
+        offset = int(requests.head(location, timeout=10).headers["Upload-Offset"])
+        if offset and upload_id not in server.SESSION_WRITERS.active:
+            break
+        time.sleep(0.05)
+    assert 0 < offset <= 2 * 1024 * 1024
+    resp = tus_patch(location, offset, data[offset:])
+    assert resp.status_code == 204
+    assert resp.headers["Upload-Offset"] == str(len(data))
+    path = os.path.join(TEST_DIR, filename)
+    with open(path, "rb") as f:
+        assert f.read() == data
+    assert server.known_file_hash(path, os.stat(path)) == sha256_hex(data)
+
+def test_tus_rejects_unsafe_filenames():
+    import base64
+    for name in ("../escape.txt", "a/b.txt", "a\\b.txt", ".hidden", ".chunks"):
+        meta = "filename " + base64.b64encode(name.encode()).decode()
+        resp = requests.post(f"{BASE_URL}/tus", headers={
+            "Tus-Resumable": "1.0.0", "Upload-Length": "4", "Upload-Metadata": meta}, timeout=10)
+        assert resp.status_code == 400, name
+    assert not os.path.exists(os.path.join(os.path.dirname(os.path.abspath(TEST_DIR)), "escape.txt"))
+
+def test_tus_head_publishes_completed_upload(monkeypatch):
+    import server
+    filename = "tus_head_publish.bin"
+    data = os.urandom(64 * 1024)
+    location, _ = tus_create(filename, len(data))
+    publish = server.publish_assembled_upload
+
+    async def failing_publish(*args):
+        raise OSError("模拟发布失败")
+
+    # 数据已收齐但发布失败：客户端随后只会 HEAD，由 HEAD 补做发布
+    monkeypatch.setattr(server, "publish_assembled_upload", failing_publish)
+    assert tus_patch(location, 0, data).status_code == 500
+    path = os.path.join(TEST_DIR, filename)
+    assert not os.path.exists(path)
+    monkeypatch.setattr(server, "publish_assembled_upload", publish)
+    resp = requests.head(location, timeout=10)
+    assert resp.status_code == 200
+    assert resp.headers["Upload-Offset"] == str(len(data))
+    with open(path, "rb") as f:
+        assert f.read() == data
+    assert requests.head(location, timeout=10).status_code == 404
+
+def test_tus_creation_with_upload_and_termination():
+    data = b"tus creation with upload"
+    resp = requests.post(f"{BASE_URL}/tus", data=data, headers={
+        "Tus-Resumable": "1.0.0", "Upload-Length": str(len(data) * 2),
+        "Upload-Metadata": "filename dHVzX3NtYWxsLnR4dA==",
+        "Content-Type": "application/offset+octet-stream"}, timeout=10)
+    assert resp.status_code == 201
+    assert resp.headers["Upload-Offset"] == str(len(data))
+    location = resp.headers["Location"]
+    assert requests.patch(location, data=data, headers={"Upload-Offset": str(len(data))}, timeout=10).status_code == 415
+    resp = requests.delete(location, headers={"Tus-Resumable": "1.0.0"}, timeout=10)
+    assert resp.status_code == 204
+    assert requests.head(location, timeout=10).status_code == 404
+    assert not os.path.exists(os.path.join(TEST_DIR, "tus_small.txt"))
+    assert requests.post(f"{BASE_URL}/tus", headers={"Tus-Resumable": "0.2.2", "Upload-Length": "1"}, timeout=10).status_code == 412
+
+def test_tus_creation_with_upload_respects_upload_gate(monkeypatch):
+    import server
+    # 名额为 0 且不排队的 upload 闸门：任何需要准入的上传都立即 503
+    monkeypatch.setattr(server, "ADMISSION_LARGE_UPLOAD", 1)
+    monkeypatch.setitem(server.ADMISSION, "upload", server.AdmissionGate("upload", 0, 0, 0.1))
+    chunk_dir = os.path.join(TEST_DIR, ".chunks")
+    sessions = lambda: {n for n in os.listdir(chunk_dir) if n.startswith("tus-")} if os.path.isdir(chunk_dir) else set()
+    before, pending = sessions(), server.STAGING.pending
+    data = b"gated creation with upload"
+    resp = requests.post(f"{BASE_URL}/tus", data=data, headers={
+        "Tus-Resumable": "1.0.0", "Upload-Length": str(len(data)),
+        "Upload-Metadata": "filename Z2F0ZWQudHh0",
+        "Content-Type": "application/offset+octet-stream"}, timeout=10)
+    assert resp.status_code == 503
+    assert resp.headers["Retry-After"] == str(server.ADMISSION_RETRY_AFTER)
+    # 准入先于创建会话：被拒绝时不留下空会话与暂存预留
+    assert sessions() == before and server.STAGING.pending == pending
+    assert not os.path.exists(os.path.join(TEST_DIR, "gated.txt"))
+    # 不带数据的创建请求不经 upload 闸门
+    resp = requests.post(f"{BASE_URL}/tus", headers={
+        "Tus-Resumable": "1.0.0", "Upload-Length": str(len(data)),
+        "Upload-Metadata": "filename Z2F0ZWQudHh0"}, timeout=10)
+    assert resp.status_code == 201
+    assert requests.delete(resp.headers["Location"], headers={"Tus-Resumable": "1.0.0"}, timeout=10).status_code == 204
+
+def test_concurrent_writes_of_same_chunk_rejected():
+    import threading
+    data = os.urandom(8 * 1024)
+    info = requests.post(f"{BASE_URL}/upload/init", json={
+        "filename": "dup_chunk.bin",
+        "size": len(data),
+        "hash_algo": "sha256",
+        "hash": sha256_hex(data),
+        "chunk_size": 4096,
+        "total_chunks": 2,
+        "assembly": "parts"
+    }, timeout=10).json()
+    upload_id = info["upload_id"]
+    started = threading.Event()
+
+    def slow_body():
+        yield data[:1024]
+        started.set()
+        time.sleep(0.5)
+        yield data[1024:4096]
+
+    result = {}
+    writer = threading.Thread(target=lambda: result.update(resp=requests.put(
+        f"{BASE_URL}/upload/chunk/{upload_id}/0", data=slow_body(), timeout=10)))
+    writer.start()
+    started.wait(5)
+    time.sleep(0.1)
+    # 同一分片正在写入时拒绝第二个写入者，不同分片不受影响
+    assert requests.put(f"{BASE_URL}/upload/chunk/{upload_id}/0", data=data[:4096], timeout=10).status_code == 409
+    assert requests.put(f"{BASE_URL}/upload/chunk/{upload_id}/1", data=data[4096:], timeout=10).status_code == 201
+    writer.join()
+    assert result["resp"].status_code == 201
+    up_dir = os.path.join(TEST_DIR, ".chunks", upload_id)
+    assert not [n for n in os.listdir(up_dir) if n.endswith(".tmp") and ".part." in n]
+    with open(os.path.join(up_dir, "0.part"), "rb") as f:
+        assert f.read() == data[:4096]
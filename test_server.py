@@ -410,3 +410,167 @@ async def test_websocket_sync():
             assert data_2['content'] == ""
             
     print("WebSocket sync test passed!")
+
+def multipart_body(filename, payload, boundary="obsboundary", extra_fields=()):
+    head = b""
+    for name, value in extra_fields:
+        head += (f"--{boundary}\r\nContent-Disposition: form-data; name=\"{name}\"\r\n\r\n{value}\r\n").encode()
+    head += (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{filename}\"\r\n"
+             "Content-Type: application/octet-stream\r\n\r\n").encode()
+    tail = f"\r\n--{boundary}--\r\n".encode()
+    return head, tail, {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+
+def test_form_upload_streams_without_spooling(monkeypatch):
+    import hashlib
+    import server
+    from starlette.requests import Request
+
+    async def no_form(self, *args, **kwargs):
+        raise AssertionError("表单不应整体缓冲")
+    monkeypatch.setattr(Request, "form", no_form)
+
+    filename = "stream_form.bin"
+    payload = os.urandom(3 * 1024 * 1024 + 123)
+    head, tail, headers = multipart_body(filename, payload, extra_fields=[("note", "hello")])
+
+    def body():
+        yield head
+        for i in range(0, len(payload), 64 * 1024):
+            yield payload[i:i + 64 * 1024]
+        yield tail
+
+    resp = requests.post(BASE_URL, data=body(), headers=headers)
+    assert resp.status_code == 201, resp.text
+    assert "文件上传成功" in resp.text
+    assert resp.headers["X-Upload-Bytes"] == str(len(payload))
+    assert float(resp.headers["X-Upload-Seconds"]) >= 0
+    assert int(resp.headers["X-Upload-Throughput"]) >= 0
+    with open(os.path.join(TEST_DIR, filename), "rb") as f:
+        assert f.read() == payload
+    path = os.path.join(TEST_DIR, filename)
+    assert server.known_file_hash(path, os.stat(path)) == hashlib.sha256(payload).hexdigest()
+    assert not [n for n in os.listdir(TEST_DIR) if n.startswith(".upload-")]
+
+    stats = requests.get(f"{BASE_URL}/stats/uploads").json()
+    assert stats["uploads"] >= 1 and stats["bytes"] >= len(payload)
+
+def test_form_upload_size_limit_enforced_while_streaming(monkeypatch):
+    import server
+    monkeypatch.setattr(server, "MAX_UPLOAD_SIZE", 1024 * 1024)
+
+    filename = "too_big_form.bin"
+    original = b"keep me"
+    with open(os.path.join(TEST_DIR, filename), "wb") as f:
+        f.write(original)
+    head, tail, headers = multipart_body(filename, b"")
+    resp = requests.post(BASE_URL, data=head + b"x" * (2 * 1024 * 1024) + tail, headers=headers)
+    assert resp.status_code == 413
+    # 超限时旧文件保持不变，临时文件被清理
+    with open(os.path.join(TEST_DIR, filename), "rb") as f:
+        assert f.read() == original
+    assert not [n for n in os.listdir(TEST_DIR) if n.startswith(".upload-")]
+
+def test_form_upload_rejects_missing_file_field():
+    resp = requests.post(BASE_URL, data={"note": "no file"})
+    assert resp.status_code == 422
+    resp = requests.post(BASE_URL, data=b"plain", headers={"Content-Type": "text/plain"})
+    assert resp.status_code == 422
+
+def test_put_is_atomic_and_cleans_up_on_failure(monkeypatch):
+    import server
+    filename = "atomic_put.bin"
+    original = b"old content"
+    assert requests.put(f"{BASE_URL}/{filename}", data=original).status_code == 201
+
+    monkeypatch.setattr(server, "MAX_UPLOAD_SIZE", 1024 * 1024)
+    seen = []
+
+    def body():
+        for _ in range(4):
+            yield b"y" * (512 * 1024)
+            # 上传进行中读者只能看到旧文件
+            seen.append(open(os.path.join(TEST_DIR, filename), "rb").read())
+
+    resp = requests.put(f"{BASE_URL}/{filename}", data=body())
+    assert resp.status_code == 413
+    assert seen and all(s == original for s in seen)
+    with open(os.path.join(TEST_DIR, filename), "rb") as f:
+        assert f.read() == original
+    assert not [n for n in os.listdir(TEST_DIR) if n.startswith(".upload-")]
+
+    # Content-Length 超限直接拒绝
+    resp = requests.put(f"{BASE_URL}/{filename}", data=b"z" * (2 * 1024 * 1024))
+    assert resp.status_code == 413
+
+def test_put_preallocates_and_coalesces_aligned_writes(monkeypatch):
+    import server
+    allocated, writes = [], []
+    real_pwrite_all = server.pwrite_all
+
+    def record_fallocate(fd, offset, length):
+        allocated.append(length)
+
+    def record_pwrite_all(fd, data, offset):
+        writes.append((offset, len(data)))
+        real_pwrite_all(fd, data, offset)
+
+    monkeypatch.setattr(server.os, "posix_fallocate", record_fallocate)
+    monkeypatch.setattr(server, "pwrite_all", record_pwrite_all)
+    monkeypatch.setattr(server, "PUT_WRITE_COALESCE", 256 * 1024)
+
+    payload = os.urandom(1024 * 1024 + 4321)
+    resp = requests.put(f"{BASE_URL}/prealloc_put.bin", data=payload)
+    assert resp.status_code == 201
+    assert allocated == [len(payload)]
+    with open(os.path.join(TEST_DIR, "prealloc_put.bin"), "rb") as f:
+        assert f.read() == payload
+
+    # 分块传输的小块被合并为对齐的大块写入，仅最后一次写入余量
+    writes.clear()
+
+    def body():
+        for i in range(0, len(payload), 4096):
+            yield payload[i:i + 4096]
+
+    resp = requests.put(f"{BASE_URL}/coalesced_put.bin", data=body())
+    assert resp.status_code == 201
+    assert sum(n for _, n in writes) == len(payload)
+    assert len(writes) <= len(payload) // (256 * 1024) + 1
+    for offset, n in writes[:-1]:
+        assert offset % (256 * 1024) == 0 and n % (256 * 1024) == 0
+    with open(os.path.join(TEST_DIR, "coalesced_put.bin"), "rb") as f:
+        assert f.read() == payload
+
+def test_put_batched_fsync_group_commit(monkeypatch):
+    import server
+    from concurrent.futures import ThreadPoolExecutor
+    monkeypatch.setattr(server, "UPLOAD_FSYNC_POLICY", "batched")
+    monkeypatch.setattr(server.FSYNC_BATCHER, "window", 0.05)
+    before = requests.get(f"{BASE_URL}/stats/fsync").json()
+
+    def put(i):
+        return requests.put(f"{BASE_URL}/batched_{i}.txt", data=f"batched {i}".encode()).status_code
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        assert list(pool.map(put, range(8))) == [201] * 8
+    after = requests.get(f"{BASE_URL}/stats/fsync").json()
+    assert after["policy"] == "batched"
+    # 组提交把并发上传合并成更少的批次，同一批内的目录只 fsync 一次
+    assert after["requests"] - before["requests"] == 8
+    assert after["batches"] - before["batches"] < 8
+    assert after["dir_syncs"] - before["dir_syncs"] == after["batches"] - before["batches"]
+    assert after["pending"] == 0
+    for i in range(8):
+        with open(os.path.join(TEST_DIR, f"batched_{i}.txt")) as f:
+            assert f.read() == f"batched {i}"
+
+def test_put_on_close_fsync(monkeypatch):
+    import server
+    synced = []
+    real_fsync_path = server.fsync_path
+    monkeypatch.setattr(server, "UPLOAD_FSYNC_POLICY", "on-close")
+    monkeypatch.setattr(server, "fsync_path", lambda p: (synced.append(p), real_fsync_path(p)))
+    assert requests.put(f"{BASE_URL}/on_close.txt", data=b"durable").status_code == 201
+    assert len(synced) == 2
+    assert os.path.basename(synced[0]).startswith(".upload-")
+    assert os.path.abspath(synced[1]) == os.path.abspath(TEST_DIR)
@@ -54,3 +54,154 @@ def test_large_file_stream_download():
     assert resp_get.status_code == 200
     assert resp_get.headers.get("Accept-Ranges") == "bytes"
     assert int(resp_get.headers.get("Content-Length", "0")) == len(data)
+
+def test_event_loop_lag_during_large_hash_and_listing():
+    import server
+    assert server.FS_EXECUTOR._max_workers == server.FS_EXECUTOR_WORKERS
+    # 外部放入的大文件由后台哈希；大量文件的首次目录扫描也在执行器中完成
+    path = os.path.join(TEST_DIR, "lag_probe.bin")
+    block = os.urandom(1024 * 1024)
+    with open(path, "wb") as f:
+        for _ in range(256):
+            f.write(block)
+    listing_dir = os.path.join(TEST_DIR, "listing")
+    os.makedirs(listing_dir, exist_ok=True)
+    for i in range(5000):
+        open(os.path.join(listing_dir, f"f{i}.txt"), "w").close()
+    server.LOOP_LAG.reset()
+    computed = server.HASH_INDEXER.computed
+    r = requests.post(f"{BASE_URL}/upload/init", json={
+        "filename": "lag_probe.bin",
+        "size": 256 * 1024 * 1024,
+        "hash_algo": "sha256",
+        "hash": "0" * 64,
+        "probe": True
+    }, timeout=10)
+    assert r.json()["skip"] is False
+    os.environ["UPLOAD_DIR"] = listing_dir
+    try:
+        server.app.state.upload_dir = listing_dir
+        assert requests.get(f"{BASE_URL}/api/files", params={"limit": 10}, timeout=30).json()["total"] == 5000
+    finally:
+        server.app.state.upload_dir = TEST_DIR
+        os.environ["UPLOAD_DIR"] = TEST_DIR
+    deadline = time.time() + 30
+    while server.HASH_INDEXER.computed == computed and time.time() < deadline:
+        time.sleep(0.05)
+    assert server.HASH_INDEXER.computed > computed
+    stats = requests.get(f"{BASE_URL}/stats/loop", timeout=10).json()
+    assert stats["samples"] > 0
+    assert stats["max_ms"] < 100
+
+def test_hashing_in_process_pool(monkeypatch):
+    import asyncio
+    import hashlib
+    import server
+    data = os.urandom(3 * 1024 * 1024)
+    path = os.path.join(TEST_DIR, "process_hash.bin")
+    with open(path, "wb") as f:
+        f.write(data)
+    server.shutdown_hash_executor()
+    monkeypatch.setattr(server, "HASH_EXECUTOR_MODE", "process")
+    try:
+        digest = asyncio.run(server.run_hashing(server.file_sha256, path))
+        assert isinstance(server.HASH_EXECUTOR, server.ProcessPoolExecutor)
+    finally:
+        server.shutdown_hash_executor()
+    assert digest == hashlib.sha256(data).hexdigest()
+
+def test_finish_hash_with_running_state_in_process_mode(monkeypatch):
+    import asyncio
+    import hashlib
+    import server
+    data = os.urandom(3 * 1024 * 1024)
+    path = os.path.join(TEST_DIR, "finish_hash.bin")
+    with open(path, "wb") as f:
+        f.write(data)
+    # sha256 对象不可 pickle：带顺序哈希状态时不能提交给进程池
+    monkeypatch.setattr(server, "HASH_EXECUTOR_MODE", "process")
+    state = [1, hashlib.sha256(data[:1024 * 1024])]
+    try:
+        digest = asyncio.run(server.run_finish_hash(path, state, 1024 * 1024))
+        assert asyncio.run(server.run_finish_hash(path, None, 1024 * 1024)) == digest
+    finally:
+        server.shutdown_hash_executor()
+    assert digest == hashlib.sha256(data).hexdigest()
+
+def test_admission_gate_queues_and_rejects():
+    import asyncio
+    import server
+    from fastapi import HTTPException
+
+    async def scenario():
+        gate = server.AdmissionGate("merge", 1, 1, 0.2)
+        await gate.acquire()
+        # 名额已满：第二个请求排队，第三个因队列已满立即 503
+        waiter = asyncio.create_task(gate.acquire())
+        await asyncio.sleep(0.01)
+        with pytest.raises(HTTPException) as exc:
+            await gate.acquire()
+        assert exc.value.status_code == 503
+        assert exc.value.headers["Retry-After"] == str(server.ADMISSION_RETRY_AFTER)
+        # 释放时名额直接转交排队者
+        gate.release()
+        await waiter
+        assert gate.active == 1
+        # 排队超时同样返回 503
+        with pytest.raises(HTTPException) as exc:
+            await gate.acquire()
+        assert exc.value.status_code == 503
+        # 后台任务不受队列容量与超时限制
+        background = asyncio.create_task(gate.acquire(background=True))
+        await asyncio.sleep(0.3)
+        assert not background.done()
+        gate.release()
+        await background
+        gate.release()
+        return gate.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["active"] == 0 and stats["waiting"] == 0
+    assert stats["admitted"] == 3
+    assert stats["rejected"] == 1 and stats["timeouts"] == 1
+    assert stats["wait_max_ms"] >= 200
+
+def test_admission_rejects_concurrent_large_downloads(monkeypatch):
+    import server
+    monkeypatch.setattr(server, "ADMISSION_LARGE_DOWNLOAD", 1024)
+    monkeypatch.setattr(server.FILE_CACHE, "max_bytes", 0)
+    filename = "admission.bin"
+    data = os.urandom(1024 * 1024)
+    assert requests.put(f"{BASE_URL}/{filename}", data=data, timeout=10).status_code == 201
+    original = requests.get(f"{BASE_URL}/config/admission", timeout=10).json()
+    original_rate = requests.get(f"{BASE_URL}/config/ratelimit", timeout=10).json()
+    assert requests.put(f"{BASE_URL}/config/admission", json={"download": {"limit": 0}}, timeout=10).status_code == 400
+    assert requests.put(f"{BASE_URL}/config/admission", json={"nope": {"limit": 1}}, timeout=10).status_code == 400
+    resp = requests.put(f"{BASE_URL}/config/admission", json={"download": {"limit": 1, "max_queue": 0}}, timeout=10)
+    assert resp.status_code == 200
+    # 限速使第一个下载持续约 2 秒，期间第二个下载被拒绝
+    requests.put(f"{BASE_URL}/config/ratelimit", json={"global_bps": 512 * 1024, "burst_seconds": 0.1}, timeout=10)
+    try:
+        result = {}
+        slow = threading.Thread(target=lambda: result.update(
+            resp=requests.get(f"{BASE_URL}/{filename}", timeout=30)))
+        slow.start()
+        time.sleep(0.5)
+        resp = requests.get(f"{BASE_URL}/{filename}", timeout=10)
+        assert resp.status_code == 503
+        assert resp.headers["Retry-After"] == str(server.ADMISSION_RETRY_AFTER)
+        slow.join()
+        assert result["resp"].content == data
+        # 名额在最后一次 send 返回后才归还，客户端可能先读完响应体
+        for _ in range(100):
+            stats = requests.get(f"{BASE_URL}/stats/admission", timeout=10).json()["download"]
+            if stats["active"] == 0:
+                break
+            time.sleep(0.05)
+        assert stats["active"] == 0 and stats["rejected"] >= 1
+        # 名额归还后可再次下载
+        requests.put(f"{BASE_URL}/config/ratelimit", json=original_rate, timeout=10)
+        assert requests.get(f"{BASE_URL}/{filename}", timeout=10).content == data
+    finally:
+        requests.put(f"{BASE_URL}/config/ratelimit", json=original_rate, timeout=10)
+        requests.put(f"{BASE_URL}/config/admission", json=original, timeout=10)